@@ -1,30 +1,38 @@
 # %%
 import os
+import sys
+import glob
 import matplotlib.pyplot as plt
 import pandas as pd
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import read_csv_cached, to_month_category
+from streaming_join import load_transaction, iter_join_data, aggregate_join_data
+from sales_cube import update_sales_cube
+
 # データの読みこみ
-customer_master = pd.read_csv("input/customer_master.csv")
+customer_master = read_csv_cached("input/customer_master.csv")
 print("customer_master:")
 customer_master.head()
 
 # %%
-item_master = pd.read_csv("input/item_master.csv")
+item_master = read_csv_cached("input/item_master.csv")
 print("item_master:")
 item_master.head()
 
 # %%
-transaction_1 = pd.read_csv("input/transaction_1.csv")
-transaction_2 = pd.read_csv("input/transaction_2.csv")
+transaction_1 = read_csv_cached("input/transaction_1.csv")
+transaction_2 = read_csv_cached("input/transaction_2.csv")
 
 print("transaction:")
 transaction_1.head()
 
 # %%
-transaction_detail_1 = pd.read_csv("input/transaction_detail_1.csv")
-transaction_detail_2 = pd.read_csv("input/transaction_detail_2.csv")
+transaction_detail_1 = read_csv_cached("input/transaction_detail_1.csv")
+transaction_detail_2 = read_csv_cached("input/transaction_detail_2.csv")
 
 print("transaction_detail:")
 transaction_detail_1.head()
@@ -119,17 +127,19 @@ join_data.dtypes
 join_data["payment_date"] = pd.to_datetime(join_data["payment_date"])
 
 # 3.payment_dateから年月のみを抽出したデータ列(payment_month)を作成する
-join_data["payment_month"] = join_data["payment_date"].dt.strftime("%Y-%m")
+# 年月は整数の月キーから作成したカテゴリ型とし、行毎の文字列の作成を省く
+# （カテゴリ型の列で集計するときはobserved=Trueを指定する）
+join_data["payment_month"] = to_month_category(join_data["payment_date"])
 join_data[["payment_date", "payment_month"]].head()
 
 # %%
 # 4.月毎に売上データを集計する
-join_data[["payment_month", "price"]].groupby("payment_month").sum()
+join_data[["payment_month", "price"]].groupby("payment_month", observed=True).sum()
 
 # %%
 # 月別、商品別で売上データを集計する
 join_data[["payment_month", "item_name", "price", "quantity"]].groupby(
-    ["payment_month", "item_name"]
+    ["payment_month", "item_name"], observed=True
 ).sum()
 
 # %%
@@ -140,6 +150,7 @@ pd.pivot_table(
     columns="payment_month",
     values=["price", "quantity"],
     aggfunc="sum",
+    observed=True,
 )
 
 # %%
@@ -151,6 +162,7 @@ graph_data = pd.pivot_table(
     columns="item_name",
     values=["price", "quantity"],
     aggfunc="sum",
+    observed=True,
 )
 graph_data
 
@@ -179,3 +191,57 @@ ax2.legend(loc="lower right")
 ax2.set_title("quantity")
 
 # %%
+# 明細データがメモリに載らない場合は、チャンク単位で結合しながら集計する
+# 1.ディメンションテーブル（transaction, customer_master, item_master）のみをメモリに読み込む
+transaction_dimension = load_transaction(
+    sorted(glob.glob("input/transaction_[0-9]*.csv"))
+)
+
+# 2.明細データをチャンク毎に結合し、月別・商品別の売上と販売数を逐次集計する
+monthly_item_sales = aggregate_join_data(
+    iter_join_data(
+        sorted(glob.glob("input/transaction_detail_[0-9]*.csv")),
+        transaction_dimension,
+        customer_master,
+        item_master,
+        chunksize=100000,
+    )
+)
+monthly_item_sales.head()
+
+# %%
+# 3.集計結果からpivot_tableを作成し、一括で結合した場合と一致することを確認する
+graph_data_streaming = pd.pivot_table(
+    monthly_item_sales,
+    index="payment_month",
+    columns="item_name",
+    values=["price", "quantity"],
+    aggfunc="sum",
+)
+graph_data_streaming.equals(graph_data.set_axis(graph_data.index.astype(str)))
+
+# %%
+# 日次で追加される明細のシャードを、保存済みの月別・商品別の集計（キューブ）に取り込む
+# 取り込み済みのシャードは集計し直さないため、再実行時は新しいシャードの分のみ集計する
+if not os.path.exists("output"):
+    # ディレクトリが存在しない場合、ディレクトリを作成する
+    os.makedirs("output")
+
+sales_cube = update_sales_cube(
+    "output/sales_cube.pkl",
+    sorted(glob.glob("input/transaction_detail_[0-9]*.csv")),
+    transaction_dimension,
+    customer_master,
+    item_master,
+)
+
+# キューブから商品別の売上と販売数の推移を集計する
+pd.pivot_table(
+    sales_cube,
+    index="payment_month",
+    columns="item_name",
+    values=["price", "quantity"],
+    aggfunc="sum",
+)
+
+# %%
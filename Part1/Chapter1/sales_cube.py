@@ -0,0 +1,162 @@
+import hashlib
+import os
+from collections.abc import Iterable, Iterator
+import pandas as pd
+from streaming_join import iter_join_data, aggregate_join_data
+
+# 取り込み済みのシャードの一覧の列
+SHARD_COLUMNS = ["path", "size", "mtime", "sha256"]
+
+
+def _content_hash(path: str) -> str:
+    """
+    ファイルの内容のハッシュ値（SHA-256）を計算する
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def load_sales_cube(cube_path: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    保存済みの月別・商品別の売上集計（キューブ）と取り込み済みのシャードの一覧を読み込む
+
+    Args:
+        cube_path (str): キューブの保存先のパス
+
+    Returns:
+        sales_cube (pd.DataFrame): payment_month、item_name、price、quantity列を持つ集計結果
+        ingested_shards (pd.DataFrame): 取り込み済みのシャードの絶対パス（path）、サイズ（size）、更新時刻（mtime）、
+            内容のハッシュ値（sha256）
+    """
+    if os.path.exists(cube_path):
+        saved = pd.read_pickle(cube_path)
+        return saved["sales_cube"], saved["ingested_shards"]
+    sales_cube = pd.DataFrame(
+        columns=["payment_month", "item_name", "price", "quantity"]
+    )
+    ingested_shards = pd.DataFrame(columns=SHARD_COLUMNS)
+    return sales_cube, ingested_shards
+
+
+def _check_join_data(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    結合済みのチャンクを順に返す
+    transactionや商品マスターと結合できない明細は集計で欠落し、取り込み済みとしたシャードは集計し直さないため、
+    そのような明細があればエラーとする
+    """
+    for join_data in chunks:
+        is_unmatched = (
+            join_data["payment_month"].isnull() | join_data["item_name"].isnull()
+        )
+        if is_unmatched.any():
+            transaction_ids = join_data.loc[is_unmatched, "transaction_id"].unique()
+            raise ValueError(
+                "transactionまたは商品マスターと結合できない明細があります: "
+                f"{is_unmatched.sum()}件（transaction_id: {transaction_ids[:5].tolist()}等）"
+            )
+        yield join_data
+
+
+def _save_sales_cube(
+    cube_path: str, sales_cube: pd.DataFrame, ingested_shards: pd.DataFrame
+) -> None:
+    """
+    キューブと取り込み済みのシャードの一覧を保存する
+    """
+    # キューブと取り込み済みのシャードの一覧は1つのファイルにまとめて置き換え、両者が食い違わないようにする
+    pd.to_pickle(
+        {"sales_cube": sales_cube, "ingested_shards": ingested_shards},
+        cube_path + ".tmp",
+    )
+    os.replace(cube_path + ".tmp", cube_path)
+
+
+def update_sales_cube(
+    cube_path: str,
+    detail_paths: list,
+    transaction: pd.DataFrame,
+    customer_master: pd.DataFrame,
+    item_master: pd.DataFrame,
+    chunksize: int = 100000,
+) -> pd.DataFrame:
+    """
+    まだ取り込んでいない明細のシャードのみを集計してキューブに足し込み、保存する
+
+    取り込み済みのシャードは絶対パスで判定し、内容のハッシュ値を記録しておく（追記のみを前提とする）。
+    サイズか更新時刻が変わったシャードは内容のハッシュ値を計算し直し、内容が変わっていればエラーとする
+    （更新時刻のみが変わった場合は記録を更新して続ける）。
+    取り込み済みのシャードと内容が同じ別のパスのシャードも、二重に取り込まないようエラーとする。
+    新しいシャードにtransactionや商品マスターと結合できない明細がある場合は、キューブを更新せずにエラーとする
+    （そのシャードは取り込み済みにならないため、transaction等を追加してから再実行すれば取り込まれる）
+
+    Args:
+        cube_path (str): キューブの保存先のパス
+        detail_paths (list): transaction_detailデータのcsv（日次のシャード等）のパスのリスト
+        transaction (pd.DataFrame): 新しいシャードの明細を含むtransactionデータ（streaming_join.load_transactionで読み込んだもの）
+        customer_master (pd.DataFrame): 顧客マスターデータ
+        item_master (pd.DataFrame): 商品マスターデータ
+        chunksize (int): 一度に読み込む明細の行数
+
+    Returns:
+        sales_cube (pd.DataFrame): 更新後のキューブ
+    """
+    sales_cube, ingested_shards = load_sales_cube(cube_path)
+    ingested = ingested_shards.set_index("path")
+    ingested_hashes = set(ingested["sha256"])
+
+    new_paths = []
+    new_shards = []
+    is_touched = False
+    for path in detail_paths:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if path in ingested.index:
+            if (ingested.loc[path, "size"], ingested.loc[path, "mtime"]) != (
+                stat.st_size,
+                stat.st_mtime,
+            ):
+                if _content_hash(path) != ingested.loc[path, "sha256"]:
+                    raise ValueError(
+                        f"取り込み済みのシャードが変更されています: {path}"
+                    )
+                ingested.loc[path, ["size", "mtime"]] = [stat.st_size, stat.st_mtime]
+                is_touched = True
+            continue
+        content_hash = _content_hash(path)
+        if content_hash in ingested_hashes:
+            raise ValueError(f"取り込み済みのシャードと内容が同じシャードです: {path}")
+        ingested_hashes.add(content_hash)
+        new_paths.append(path)
+        new_shards.append([path, stat.st_size, stat.st_mtime, content_hash])
+    ingested_shards = ingested.reset_index()
+
+    if len(new_paths) == 0:
+        if is_touched:
+            _save_sales_cube(cube_path, sales_cube, ingested_shards)
+        return sales_cube
+
+    new_sales = aggregate_join_data(
+        _check_join_data(
+            iter_join_data(
+                new_paths, transaction, customer_master, item_master, chunksize
+            )
+        )
+    )
+    sales_cube = (
+        pd.concat([sales_cube, new_sales])
+        .groupby(["payment_month", "item_name"], as_index=False)[["price", "quantity"]]
+        .sum()
+        if len(sales_cube) > 0
+        else new_sales
+    )
+    new_shards = pd.DataFrame(new_shards, columns=SHARD_COLUMNS)
+    ingested_shards = (
+        pd.concat([ingested_shards, new_shards], ignore_index=True)
+        if len(ingested_shards) > 0
+        else new_shards
+    )
+    _save_sales_cube(cube_path, sales_cube, ingested_shards)
+    return sales_cube
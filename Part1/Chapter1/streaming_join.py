@@ -0,0 +1,87 @@
+from collections.abc import Iterable, Iterator
+import pandas as pd
+from common import to_month_key, month_key_to_str
+
+
+def load_transaction(paths: list) -> pd.DataFrame:
+    """
+    複数ファイルにわたるtransactionデータを読み込み、payment_month列を付与する
+    transactionは明細（transaction_detail）より粒度が粗いため、ディメンションテーブルとしてメモリに保持する
+
+    Args:
+        paths (list): transactionデータのcsvのパスのリスト
+
+    Returns:
+        transaction (pd.DataFrame): 縦に結合したtransactionデータ
+    """
+    transaction = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    transaction["payment_month"] = month_key_to_str(
+        to_month_key(pd.to_datetime(transaction["payment_date"]))
+    )
+    return transaction
+
+
+def iter_join_data(
+    detail_paths: list,
+    transaction: pd.DataFrame,
+    customer_master: pd.DataFrame,
+    item_master: pd.DataFrame,
+    chunksize: int = 100000,
+) -> Iterator[pd.DataFrame]:
+    """
+    transaction_detailをチャンク単位で読み込み、メモリ上のディメンションテーブル
+    （transaction, customer_master, item_master）と結合したデータを順に返す
+    メモリ使用量は明細全体ではなく、ディメンションテーブルとチャンクの大きさで決まる
+
+    Args:
+        detail_paths (list): transaction_detailデータのcsv（日次のシャード等）のパスのリスト
+        transaction (pd.DataFrame): load_transactionで読み込んだtransactionデータ
+        customer_master (pd.DataFrame): 顧客マスターデータ
+        item_master (pd.DataFrame): 商品マスターデータ
+        chunksize (int): 一度に読み込む明細の行数
+
+    Yields:
+        join_data (pd.DataFrame): chapter1.pyのjoin_dataと同じ列（price列、payment_month列を含む）を持つチャンク
+    """
+    # 結合キーをindexにしておき、チャンク毎にハッシュ結合する
+    transaction_index = transaction.set_index("transaction_id")[
+        ["payment_date", "customer_id", "payment_month"]
+    ]
+    customer_index = customer_master.set_index("customer_id")
+    item_index = item_master.set_index("item_id")
+
+    for path in detail_paths:
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            join_data = chunk.join(transaction_index, on="transaction_id")
+            join_data = join_data.join(customer_index, on="customer_id")
+            join_data = join_data.join(item_index, on="item_id")
+            join_data["price"] = join_data["item_price"] * join_data["quantity"]
+            join_data["payment_month"] = join_data.pop("payment_month")
+            yield join_data
+
+
+def aggregate_join_data(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    結合済みのチャンクから、月別・商品別の売上（price）と販売数（quantity）の合計を逐次集計する
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): iter_join_dataが返すチャンク
+
+    Returns:
+        monthly_item_sales (pd.DataFrame): payment_month、item_name、price、quantity列を持つ集計結果
+    """
+    aggregate = pd.DataFrame(
+        columns=["payment_month", "item_name", "price", "quantity"]
+    )
+    aggregate = aggregate.set_index(["payment_month", "item_name"])
+    for join_data in chunks:
+        chunk_aggregate = join_data.groupby(["payment_month", "item_name"])[
+            ["price", "quantity"]
+        ].sum()
+        # これまでの集計結果にチャンクの集計結果を足し込む
+        aggregate = (
+            pd.concat([aggregate, chunk_aggregate]).groupby(level=[0, 1]).sum()
+            if len(aggregate) > 0
+            else chunk_aggregate
+        )
+    return aggregate.reset_index()
@@ -1,16 +1,34 @@
 # %%
 import os
+import sys
 import numpy as np
 import pandas as pd
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import read_csv_cached, read_excel_cached, to_month_category
+from cleansing import (
+    impute_item_price,
+    normalize_item_names,
+    parse_mixed_dates,
+    remove_spaces,
+)
+from fuzzy_join import fuzzy_merge
+
 # データの読みこみ
-uriage_data = pd.read_csv("input/uriage.csv")
+uriage_data = read_csv_cached("input/uriage.csv", parse_dates=["purchase_date"])
 uriage_data.head()
 
 # %%
-kokyaku_data = pd.read_excel("input/kokyaku_daicho.xlsx")
+# 顧客台帳は読み取り専用モードで一定の行数ずつ読み込み、読み込んだ行毎に
+# 顧客名の空白の削除（顧客名の揺れの補正）と登録日のdatetime型への変換（日付の揺れの補正）を行う
+# 補正後のデータはキャッシュし、ファイルが更新されていなければ次回以降はxlsxを読み込まない
+kokyaku_data = read_excel_cached(
+    "input/kokyaku_daicho.xlsx",
+    converters={"顧客名": remove_spaces, "登録日": parse_mixed_dates},
+)
 print(kokyaku_data.head())
 print(len(kokyaku_data))
 
@@ -24,7 +42,9 @@ uriage_data.dtypes
 uriage_data["purchase_date"] = pd.to_datetime(uriage_data["purchase_date"])
 
 # 3.年月のみ抽出したデータ列(purchase_month)を作成する
-uriage_data["purchase_month"] = uriage_data["purchase_date"].dt.strftime("%Y-%m")
+# 年月は整数の月キーから作成したカテゴリ型とし、行毎の文字列の作成を省く
+# （カテゴリ型の列で集計するときはobserved=Trueを指定する）
+uriage_data["purchase_month"] = to_month_category(uriage_data["purchase_date"])
 uriage_data[["purchase_date", "purchase_month"]].head()
 
 # %%
@@ -35,6 +55,7 @@ pd.pivot_table(
     columns="item_name",
     aggfunc="size",
     fill_value=0,
+    observed=True,
 )
 # %%
 # 5.商品毎の月別売上を集計する
@@ -45,6 +66,7 @@ pd.pivot_table(
     values="item_price",
     aggfunc="sum",
     fill_value=0,
+    observed=True,
 )
 
 # %%
@@ -54,24 +76,29 @@ len(pd.unique(uriage_data["item_name"]))
 
 # %%
 # 2.データの揺れを解消する
-# 2-1.半角を全角に統一する
-uriage_data["item_name"] = uriage_data["item_name"].str.upper()
+# 半角と全角の統一、スペース（全角、半角両方）の削除、大文字への統一をユニークな商品名に対してのみ行う
+# 商品名と補正後の商品名の対応（辞書）を保存しておき、次回以降は新しい商品名のみを補正する
+if not os.path.exists("output"):
+    # ディレクトリが存在しない場合、ディレクトリを作成する
+    os.makedirs("output")
 
-# 2-2.スペース（全角、半角両方）を消す
-uriage_data["item_name"] = uriage_data["item_name"].str.replace("　", "")
-uriage_data["item_name"] = uriage_data["item_name"].str.replace(" ", "")
+uriage_data["item_name"], item_name_map = normalize_item_names(
+    uriage_data["item_name"], dictionary_path="output/item_name_dictionary.json"
+)
+item_name_map
 
-# 2-3.商品名順にソートする
+# %%
+# 2-1.商品名順にソートする
 uriage_data.sort_values("item_name", ascending=True)
 
 # %%
 # 3.補正結果の検証をする
-# 3-1.ユニークな商品名の確認
-np.sort(pd.unique(uriage_data["item_name"]))
+# 3-1.ユニークな商品名の確認（ユニークな商品名毎の補正結果から確認する）
+np.sort(item_name_map["canonical_name"].unique())
 
 # %%
 # 3-2.ユニークな商品名の数の確認
-len(pd.unique(uriage_data["item_name"]))
+item_name_map["canonical_name"].nunique()
 
 # %%
 # 金額の欠損値を補完する
@@ -93,17 +120,17 @@ price_is_null_item_name_list
 
 # %%
 # 2-3.item_priceに欠損があるの商品の価格を欠損していない行から取得し欠損値を補完する
-for item_name in price_is_null_item_name_list:
-    # 対象となるitem_nameのitem_priceを欠損していない行から取得する
-    item_price = uriage_data.loc[
-        (~item_price_is_null) & (uriage_data["item_name"] == item_name), "item_price"
-    ].max()
-    # 対象となるitem_nameのitem_price列の全ての欠損値を取得したitem_priceで補完する
-    uriage_data.loc[
-        (item_price_is_null) & (uriage_data["item_name"] == item_name), "item_price"
-    ] = item_price
+# 商品毎の価格（ここでは最大値）を一度に集計し、全ての欠損値をまとめて補完する
+uriage_data["item_price"], item_price_audit = impute_item_price(
+    uriage_data, strategy="max"
+)
 uriage_data.head()
 
+# %%
+# 2-4.商品毎の補完内容（欠損数、補完した価格、欠損していない行の価格の範囲）を確認し、保存する
+item_price_audit.to_csv("output/item_price_audit.csv", index=False)
+item_price_audit
+
 # %%
 # 3.補完の検証を行う
 # 3-1.欠損値の有無を確認する
@@ -111,15 +138,12 @@ uriage_data.isnull().any()
 
 # %%
 # 3-2.補完した金額の値が正しいかを確認する
-for item_name in price_is_null_item_name_list:
-    item_price_max = uriage_data.loc[
-        uriage_data["item_name"] == item_name, "item_price"
-    ].max()
-
-    item_price_min = uriage_data.loc[
-        uriage_data["item_name"] == item_name, "item_price"
-    ].min()
-
+item_price_range = (
+    uriage_data[uriage_data["item_name"].isin(price_is_null_item_name_list)]
+    .groupby("item_name", observed=True)["item_price"]
+    .agg(["max", "min"])
+)
+for item_name, item_price_max, item_price_min in item_price_range.itertuples():
     print(f"{item_name}の最大額:{item_price_max}、最小額:{item_price_min}")
 
 # %%
@@ -134,61 +158,52 @@ print(uriage_data["customer_name"].head())
 
 # %%
 # 1-2.空白を削除する
-kokyaku_data["顧客名"] = kokyaku_data["顧客名"].str.replace("　", "")
-kokyaku_data["顧客名"] = kokyaku_data["顧客名"].str.replace(" ", "")
+# 読み込み時にremove_spacesで削除済み
 kokyaku_data["顧客名"].head()
 
 # %%
 # 2.日付の揺れを補正する
-kokyaku_data["登録日"].head()
-
-# %%
-# 2-1.数値として取り込まれている行を特定する
-register_date_is_digit = kokyaku_data["登録日"].astype("str").str.isdigit()
-# 該当する行数を確認する
-register_date_is_digit.sum()
-
-# %%
-# 2-2.数値として取り込まれている行をdatetime型に変換する
-correct_register_date_from_serial = pd.to_datetime("1900-01-01") + pd.to_timedelta(
-    kokyaku_data.loc[register_date_is_digit, "登録日"].astype("float"), unit="D"
-)
-correct_register_date_from_serial
-
-# %%
-# 2-3.文字列として取り込まれている行をdatetime型に変換する
-correct_register_date_from_string = pd.to_datetime(
-    kokyaku_data.loc[~register_date_is_digit, "登録日"]
-)
-correct_register_date_from_string
-
-# %%
-# 2-4.数値列から変換した行と文字列から変換した行を結合して顧客データの登録日データを更新する
-kokyaku_data["登録日"] = pd.concat(
-    [correct_register_date_from_serial, correct_register_date_from_string]
-)
+# 数値（Excelのシリアル値）、日付、日付文字列が混在する登録日データは、読み込み時にparse_mixed_datesでdatetime型に変換済み
+# シリアル値はExcelの1900年の閏年の扱いに合わせて変換する（1900年1月1日を1とする日数で、1900年3月1日以降は1899年12月30日からの日数）
+# 値があるのに変換できなかった登録日はNaTとなり、xlsxの読み込み時にその件数と例が警告される（件数は3-4でも確認する）
 kokyaku_data["登録日"].head()
 
 # %%
 # 3.月毎の顧客登録数をカウントする
 # 3-1.登録日データから登録月データを作成する
-kokyaku_data["登録月"] = kokyaku_data["登録日"].dt.strftime("%Y-%m")
+kokyaku_data["登録月"] = to_month_category(kokyaku_data["登録日"])
 
 # 3-2.月毎の登録顧客数をカウントする
-print(kokyaku_data[["登録月", "顧客名"]].groupby("登録月").count())
+print(kokyaku_data[["登録月", "顧客名"]].groupby("登録月", observed=True).count())
 
 # 3-3.顧客データ数に変化がないかを検証する
 print(len(kokyaku_data))
 
-# 3-4.登録日データに数値列が残っていないかを確認する
-register_date_is_digit = kokyaku_data["登録日"].astype("str").str.isdigit()
-register_date_is_digit.sum()
+# 3-4.登録日データに変換できなかった値（NaT）がないかを確認する
+kokyaku_data["登録日"].isnull().sum()
 
 # %%
 # 売上履歴に顧客データを結合する
-join_data = pd.merge(
-    uriage_data, kokyaku_data, how="left", left_on="customer_name", right_on="顧客名"
-)
+# 顧客名の表記揺れを名寄せしてから結合する場合はTrueにする（Falseの場合は顧客名が完全に一致するデータのみ結合する）
+use_fuzzy_join = False
+if use_fuzzy_join:
+    # 顧客名が一致しない場合は、編集距離が1以下で最も近い顧客名に名寄せする
+    # （同じ距離の顧客名が複数ある場合や、顧客名が短いか信頼度が低い場合は名寄せしない）
+    join_data, customer_name_matches = fuzzy_merge(
+        uriage_data, kokyaku_data, left_on="customer_name", right_on="顧客名"
+    )
+    # 名寄せできなかった顧客名を、確認用に出力する
+    customer_name_matches[customer_name_matches["matched_name"].isnull()].to_csv(
+        "output/unmatched_names.csv", index=False
+    )
+else:
+    join_data = pd.merge(
+        uriage_data,
+        kokyaku_data,
+        how="left",
+        left_on="customer_name",
+        right_on="顧客名",
+    )
 # 重複するデータ列(customer_nameと顧客名)の一方（customer_name）を削除する
 join_data = join_data.drop("customer_name", axis=1)
 join_data.head()
@@ -0,0 +1,311 @@
+import datetime
+import json
+import os
+import unicodedata
+import warnings
+import numpy as np
+import pandas as pd
+
+# impute_item_priceで指定できる補完値の決め方
+IMPUTE_STRATEGIES = ["max", "mode", "latest"]
+
+# Excelのシリアル値の起点（1900年を閏年として扱うExcelの仕様に合わせ、シリアル値61以降の日付の起点とする）
+EXCEL_EPOCH = np.datetime64("1899-12-30", "ns")
+
+# 和暦の元号と元年の西暦
+JAPANESE_ERAS = {"明治": 1868, "大正": 1912, "昭和": 1926, "平成": 1989, "令和": 2019}
+
+
+def _reference_price(
+    observed: pd.DataFrame,
+    strategy: str,
+    item_column: str,
+    price_column: str,
+    date_column: str,
+) -> pd.Series:
+    """
+    欠損していない行から、商品毎の補完に用いる価格を計算する
+
+    Args:
+        observed (pd.DataFrame): 価格が欠損していない行のデータ
+        strategy (str): 補完値の決め方（IMPUTE_STRATEGIESのいずれか）
+        item_column (str): 商品名の列名
+        price_column (str): 価格の列名
+        date_column (str): 購入日の列名（strategyが"latest"の場合に用いる）
+
+    Returns:
+        reference_price (pd.Series): 商品名をindexとする補完に用いる価格
+    """
+    if strategy == "max":
+        return observed.groupby(item_column, observed=True)[price_column].max()
+    if strategy == "mode":
+        # 最も多く出現する価格（同数の場合は安い方）
+        price_counts = observed.groupby(
+            [item_column, price_column], observed=True
+        ).size()
+        price_counts = price_counts.reset_index(name="count").sort_values(
+            [item_column, "count", price_column],
+            ascending=[True, False, True],
+            kind="stable",
+        )
+        return price_counts.drop_duplicates(item_column).set_index(item_column)[
+            price_column
+        ]
+    if strategy == "latest":
+        # 最後に購入された時の価格（同時刻の場合は後の行）
+        latest = observed.sort_values(date_column, kind="stable").drop_duplicates(
+            item_column, keep="last"
+        )
+        return latest.set_index(item_column)[price_column]
+    raise ValueError(
+        f"strategyは{IMPUTE_STRATEGIES}のいずれかを指定してください: {strategy}"
+    )
+
+
+def impute_item_price(
+    uriage_data: pd.DataFrame,
+    strategy: str = "max",
+    item_column: str = "item_name",
+    price_column: str = "item_price",
+    date_column: str = "purchase_date",
+) -> tuple[pd.Series, pd.DataFrame]:
+    """
+    価格の欠損値を、同じ商品の価格が欠損していない行から求めた価格で補完する
+    商品毎の補完値は1回の集計でまとめて求め、全ての欠損値を一度に補完する
+
+    Args:
+        uriage_data (pd.DataFrame): 売上履歴データ（商品名の表記揺れは補正済みとする）
+        strategy (str): 補完値の決め方
+            "max": 最大値、"mode": 最頻値（同数の場合は安い方）、"latest": 最後に購入された時の価格
+        item_column (str): 商品名の列名
+        price_column (str): 価格の列名
+        date_column (str): 購入日の列名（strategyが"latest"の場合に用いる）
+
+    Returns:
+        item_price (pd.Series): 欠損値を補完した価格（補完に用いる価格がない商品は欠損値のまま）
+        audit (pd.DataFrame): 欠損値があった商品毎の補完内容
+            n_missing: 欠損値の数、n_observed: 欠損していない行の数、
+            filled_price: 補完した価格、observed_min, observed_max: 欠損していない行の価格の最小値、最大値
+    """
+    price_is_null = uriage_data[price_column].isnull()
+    observed = uriage_data[~price_is_null]
+    reference_price = _reference_price(
+        observed, strategy, item_column, price_column, date_column
+    )
+
+    # 商品名がカテゴリ型の場合も価格の型のまま補完できるよう、mapではなくreindexで各行の補完値を求める
+    item_price = uriage_data[price_column].fillna(
+        pd.Series(
+            reference_price.reindex(uriage_data[item_column]).to_numpy(),
+            index=uriage_data.index,
+        )
+    )
+
+    # 欠損値があった商品毎の補完内容
+    observed_stats = observed.groupby(item_column, observed=True)[price_column].agg(
+        ["size", "min", "max"]
+    )
+    # 商品名がカテゴリ型の場合は欠損値のない商品も0件として数えられるため除く
+    n_missing = uriage_data.loc[price_is_null, item_column].value_counts()
+    audit = n_missing[n_missing > 0].sort_index().rename("n_missing").to_frame()
+    audit["n_observed"] = observed_stats["size"].reindex(audit.index, fill_value=0)
+    audit["filled_price"] = reference_price.reindex(audit.index)
+    audit["observed_min"] = observed_stats["min"].reindex(audit.index)
+    audit["observed_max"] = observed_stats["max"].reindex(audit.index)
+    audit.index.name = item_column
+    return item_price, audit.reset_index()
+
+
+def remove_spaces(names: pd.Series) -> pd.Series:
+    """
+    名前の列からスペース（全角、半角両方）を削除する
+
+    Args:
+        names (pd.Series): 顧客名等の名前の列
+
+    Returns:
+        names (pd.Series): スペースを削除した名前の列
+    """
+    return names.str.replace("　", "").str.replace(" ", "")
+
+
+def normalize_item_name(item_name: str) -> str:
+    """
+    商品名の表記揺れを補正する
+    全角・半角の統一（NFKC正規化）、空白（全角、半角両方）の削除、大文字への統一を行う
+
+    Args:
+        item_name (str): 商品名
+
+    Returns:
+        canonical_name (str): 補正後の商品名
+    """
+    return "".join(unicodedata.normalize("NFKC", item_name).split()).upper()
+
+
+def normalize_item_names(
+    item_names: pd.Series, dictionary_path: str = None
+) -> tuple[pd.Series, pd.DataFrame]:
+    """
+    商品名の列の表記揺れを補正する
+    補正はユニークな商品名に対してのみ行い、カテゴリ型のコードを用いて各行に割り当てる。
+    dictionary_pathを指定すると、商品名と補正後の商品名の対応（辞書）を保存し、
+    次回以降は辞書にない商品名のみを補正する
+
+    Args:
+        item_names (pd.Series): 商品名の列
+        dictionary_path (str): 辞書を保存するjsonファイルのパス（Noneの場合は保存しない）
+
+    Returns:
+        canonical_names (pd.Series): 補正後の商品名の列（補正後の商品名をカテゴリとするカテゴリ型。欠損値は欠損値のまま）
+        name_map (pd.DataFrame): item_names内のユニークな商品名（item_name）と補正後の商品名（canonical_name）の対応
+    """
+    dictionary = {}
+    if dictionary_path is not None and os.path.exists(dictionary_path):
+        with open(dictionary_path, encoding="utf-8") as f:
+            dictionary = json.load(f)
+
+    item_categories = pd.Categorical(item_names)
+    unseen_names = [
+        name for name in item_categories.categories if name not in dictionary
+    ]
+    for name in unseen_names:
+        dictionary[name] = normalize_item_name(name)
+    if dictionary_path is not None and len(unseen_names) > 0:
+        with open(dictionary_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(dictionary, f, ensure_ascii=False, indent=0)
+        os.replace(dictionary_path + ".tmp", dictionary_path)
+
+    name_map = pd.DataFrame({"item_name": item_categories.categories})
+    name_map["canonical_name"] = name_map["item_name"].map(dictionary)
+
+    # ユニークな商品名毎の補正結果を、カテゴリ型のコードで各行に割り当てる
+    # （欠損値のコードは-1のため、欠損値でない行のみに割り当てる。全て欠損値の場合はカテゴリが空になる）
+    canonical_categories = pd.Categorical(name_map["canonical_name"])
+    codes = item_categories.codes
+    is_valid = codes >= 0
+    canonical_codes = np.full(len(codes), -1, dtype=canonical_categories.codes.dtype)
+    canonical_codes[is_valid] = canonical_categories.codes[codes[is_valid]]
+    canonical_names = pd.Series(
+        pd.Categorical.from_codes(
+            canonical_codes, categories=canonical_categories.categories
+        ),
+        index=item_names.index,
+        name=item_names.name,
+    )
+    return canonical_names, name_map
+
+
+def excel_serial_to_datetime(serials: np.ndarray) -> np.ndarray:
+    """
+    Excelのシリアル値（1900年1月1日を1とする日数。小数部は時刻）をdatetime64に変換する
+    Excelは1900年を閏年として扱い、存在しない1900年2月29日をシリアル値60としているため、
+    シリアル値60未満は1日ずらして変換し、シリアル値60（と1未満）はNaTとする
+
+    Args:
+        serials (np.ndarray): シリアル値
+
+    Returns:
+        dates (np.ndarray): datetime64[ns]型の日付
+    """
+    serials = np.asarray(serials, dtype=np.float64)
+    is_invalid = np.isnan(serials) | (serials < 1) | ((serials >= 60) & (serials < 61))
+    days = np.where(is_invalid, 0, np.where(serials < 60, serials + 1, serials))
+    dates = EXCEL_EPOCH + np.round(days * 86400 * 10**9).astype("timedelta64[ns]")
+    dates[is_invalid] = np.datetime64("NaT")
+    return dates
+
+
+def _japanese_to_iso(date_strings: pd.Series) -> pd.Series:
+    """
+    和暦・西暦の「年月日」表記や「/」「.」区切りの日付文字列を、ISO 8601形式（"%Y-%m-%d"）の文字列に書き換える
+    （該当しない文字列はそのまま返す）
+
+    Args:
+        date_strings (pd.Series): NFKC正規化済みの日付文字列
+
+    Returns:
+        iso_strings (pd.Series): 書き換え後の日付文字列
+    """
+    iso_strings = date_strings.str.replace(
+        r"^(\d{4})\s*(?:年|/|\.)\s*(\d{1,2})\s*(?:月|/|\.)\s*(\d{1,2})(?:\s*日)?",
+        r"\1-\2-\3",
+        regex=True,
+    )
+    era = iso_strings.str.extract(
+        r"^(明治|大正|昭和|平成|令和)\s*(元|\d{1,2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日(.*)$"
+    )
+    is_era = era[0].notna()
+    if is_era.any():
+        era = era[is_era]
+        year = era[0].map(JAPANESE_ERAS) + era[1].replace("元", "1").astype(int) - 1
+        iso_strings[is_era] = year.astype(str) + "-" + era[2] + "-" + era[3] + era[4]
+    return iso_strings
+
+
+def parse_mixed_dates(dates: pd.Series) -> pd.Series:
+    """
+    日付型、Excelのシリアル値（数値、数字の文字列）、日付文字列（ISO 8601形式、「/」区切り、
+    和暦・西暦の「年月日」表記）が混在する列をdatetime型に変換する
+    変換はユニークな値に対してのみ行い（同じ値は一度だけ変換する）、結果を各行に割り当てる
+
+    Args:
+        dates (pd.Series): 日付データの列（Excelから読み込んだ列等）
+
+    Returns:
+        parsed_dates (pd.Series): datetime型の日付データ（変換できない値はNaTとし、その件数と例を警告する）
+    """
+    codes, unique_values = pd.factorize(dates)
+    unique_values = np.asarray(unique_values, dtype=object)
+    parsed = np.full(len(unique_values), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    value_types = pd.Series(unique_values).map(type)
+    is_datetime = value_types.map(
+        lambda t: issubclass(t, (datetime.date, np.datetime64))
+    ).to_numpy(dtype=bool)
+    is_number = value_types.map(
+        lambda t: issubclass(t, (int, float, np.number)) and not issubclass(t, bool)
+    ).to_numpy(dtype=bool)
+    is_string = value_types.map(lambda t: issubclass(t, str)).to_numpy(dtype=bool)
+
+    if is_datetime.any():
+        parsed[is_datetime] = pd.to_datetime(unique_values[is_datetime]).to_numpy(
+            dtype="datetime64[ns]"
+        )
+    if is_number.any():
+        parsed[is_number] = excel_serial_to_datetime(unique_values[is_number])
+    if is_string.any():
+        strings = pd.Series(unique_values[is_string]).map(
+            lambda x: unicodedata.normalize("NFKC", x).strip()
+        )
+        # 数字のみの文字列はシリアル値として変換する
+        is_serial = strings.str.fullmatch(r"\d+(?:\.\d+)?").to_numpy(dtype=bool)
+        string_parsed = np.full(
+            len(strings), np.datetime64("NaT"), dtype="datetime64[ns]"
+        )
+        string_parsed[is_serial] = excel_serial_to_datetime(
+            strings[is_serial].astype(np.float64)
+        )
+        string_parsed[~is_serial] = pd.to_datetime(
+            _japanese_to_iso(strings[~is_serial]), format="ISO8601", errors="coerce"
+        ).to_numpy(dtype="datetime64[ns]")
+        parsed[is_string] = string_parsed
+
+    # 値があるのに日付に変換できなかったもの（空白のみの文字列を除く）は、件数と例を警告する
+    is_blank = np.zeros(len(unique_values), dtype=bool)
+    if is_string.any():
+        is_blank[is_string] = (strings == "").to_numpy(dtype=bool)
+    is_unparsed = np.isnat(parsed) & ~is_blank
+    if is_unparsed.any():
+        n_unparsed = np.isin(codes, np.flatnonzero(is_unparsed)).sum()
+        warnings.warn(
+            f"{dates.name}: 日付に変換できない値をNaTにしました: {n_unparsed}件"
+            f"（{list(unique_values[is_unparsed][:5])}等）",
+            stacklevel=2,
+        )
+
+    return pd.Series(
+        np.where(codes >= 0, parsed[codes], np.datetime64("NaT")),
+        index=dates.index,
+        name=dates.name,
+    )
@@ -0,0 +1,314 @@
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from common import can_fork_workers
+
+# 各ワーカープロセスで共有する名寄せ先のインデックス（initializerで設定する）
+_worker_index = {}
+
+
+def name_key(name: str) -> str:
+    """
+    名寄せに用いるキーを作成する（NFKC正規化し、空白を削除する）
+
+    Args:
+        name (str): 名前
+
+    Returns:
+        key (str): 名寄せのキー
+    """
+    return "".join(unicodedata.normalize("NFKC", name).split())
+
+
+def _ngrams(key: str, n: int) -> set:
+    """
+    先頭と末尾に印をつけたキーのn-gramの集合を作成する
+    （印をつけることで、短いキーや先頭・末尾が異なるキーでも共通のn-gramが残りやすくなる）
+    """
+    padded = "^" + key + "$"
+    return {padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    2つの文字列の編集距離（レーベンシュタイン距離）を計算する
+    max_distanceを超えることが確定した時点で計算を打ち切り、max_distance + 1を返す
+
+    Args:
+        a (str): 文字列
+        b (str): 文字列
+        max_distance (int): 計算する編集距離の上限
+
+    Returns:
+        distance (int): 編集距離（max_distanceを超える場合はmax_distance + 1）
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def _build_index(master_keys: list, n: int) -> dict:
+    """
+    名寄せ先のキーのn-gramをキー、そのn-gramを含む名寄せ先の番号の配列を値とするインデックス（ブロック）を作成する
+    """
+    blocks = defaultdict(list)
+    for i, key in enumerate(master_keys):
+        for gram in _ngrams(key, n):
+            blocks[gram].append(i)
+    return {gram: np.array(ids, dtype=np.int64) for gram, ids in blocks.items()}
+
+
+def _init_worker(master_keys: list, blocks: dict, n: int, max_distance: int) -> None:
+    """
+    ワーカープロセスに名寄せ先のインデックスを設定する（チャンク毎にインデックスを送らないようにする）
+    """
+    _worker_index.update(
+        master_keys=master_keys, blocks=blocks, n=n, max_distance=max_distance
+    )
+
+
+def _match_chunk(keys: list) -> list:
+    """
+    キーのチャンクについて、編集距離がmax_distance以下で最も近い名寄せ先を探す
+
+    n-gramを共有する名寄せ先のみを候補とし、さらに編集距離がmax_distance以下になるために必要な数
+    （キーのn-gram数 - max_distance * n）以上のn-gramを共有する候補のみ編集距離を計算する
+
+    Returns:
+        matches (list): キー毎の(最も近い名寄せ先の番号（ないか、同じ距離の候補が複数ある場合は-1）, 編集距離, 同じ距離の候補数)
+    """
+    master_keys = _worker_index["master_keys"]
+    blocks = _worker_index["blocks"]
+    n = _worker_index["n"]
+    max_distance = _worker_index["max_distance"]
+
+    matches = []
+    for key in keys:
+        grams = _ngrams(key, n)
+        postings = [blocks[gram] for gram in grams if gram in blocks]
+        if len(postings) == 0:
+            matches.append((-1, max_distance + 1, 0))
+            continue
+        candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+        candidates = candidates[shared >= len(grams) - max_distance * n]
+
+        best_distance = max_distance + 1
+        best = []
+        for candidate in candidates:
+            distance = bounded_edit_distance(
+                key, master_keys[candidate], min(max_distance, best_distance)
+            )
+            if distance < best_distance:
+                best_distance = distance
+                best = [candidate]
+            elif distance == best_distance and distance <= max_distance:
+                best.append(candidate)
+        matches.append((best[0] if len(best) == 1 else -1, best_distance, len(best)))
+    return matches
+
+
+def fuzzy_match_names(
+    names: pd.Series,
+    master_names: pd.Series,
+    max_distance: int = 1,
+    min_confidence: float = 0.75,
+    min_key_length: int = 4,
+    n: int = 2,
+    chunksize: int = 1000,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """
+    名前を名寄せ先の名前と照合し、一致する（一致しない場合は編集距離が最も近い）名寄せ先の名前を求める
+
+    照合はユニークな名前に対してのみ行う。名寄せ先に同じ名前がある場合はそのまま照合し、
+    NFKC正規化して空白を削除したキーが一致する場合はキーで照合する。
+    一致しない名前は名寄せ先の名前のn-gramで作成したインデックス（ブロック）から候補を絞り込み、
+    候補との編集距離を上限つきで計算する。照合する名前はchunksize毎にプロセスプールで並列に処理する
+    （チャンクが1つの場合や、ワーカープロセスをforkで起動できない場合はプロセスを起動しない）。
+    同じキーを持つ異なる名前が名寄せ先に複数ある場合や、編集距離で名寄せする名前のキーが短いか
+    信頼度が低い場合は名寄せしない
+
+    Args:
+        names (pd.Series): 照合する名前（売上データの顧客名等）
+        master_names (pd.Series): 名寄せ先の名前（顧客台帳の顧客名等）
+        max_distance (int): 名寄せする編集距離の上限
+        min_confidence (float): 編集距離で名寄せする場合の信頼度の下限
+        min_key_length (int): 編集距離で名寄せする名前のキーの文字数の下限（短い名前は1文字違いでも別人の可能性が高いため）
+        n (int): インデックスに用いるn-gramの文字数
+        chunksize (int): 1つのプロセスでまとめて照合する名前の数
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+
+    Returns:
+        name_matches (pd.DataFrame): ユニークな名前毎の照合結果
+            name: 名前、matched_name: 名寄せ先の名前（名寄せしない場合は欠損値）、
+            distance: キーの編集距離（max_distanceを超える場合はmax_distance + 1）、
+            n_candidates: 最も近い距離の候補（名寄せ先の名前）数、
+            confidence: 1 - distance / 長い方のキーの文字数（候補が1つでない場合は0）、
+            status: exact（名前またはキーが一致）、fuzzy（編集距離で名寄せ）、
+            rejected（候補が1つだがキーが短いか信頼度が低いため名寄せしない）、
+            ambiguous（最も近い距離の候補が複数あるため名寄せしない）、unmatched（候補がない）
+    """
+    unique_names = pd.Series(pd.unique(names.dropna()), dtype=object)
+    keys = unique_names.map(name_key).tolist()
+
+    # 名寄せ先のキー毎の名前（同じキーを持つ異なる名前がある場合は、全ての名前を候補とする）
+    master = pd.DataFrame({"name": pd.unique(master_names.dropna())})
+    master["key"] = master["name"].map(name_key)
+    key_names = master.groupby("key", sort=False)["name"].agg(list)
+    master_keys = key_names.index.tolist()
+    master_positions = pd.Series(np.arange(len(master_keys)), index=master_keys)
+
+    # キーが一致する名前はそのまま照合する
+    matched = np.array(
+        master_positions.reindex(keys).fillna(-1).to_numpy(), dtype=np.int64
+    )
+    distance = np.zeros(len(keys), dtype=np.int64)
+    n_candidates = np.ones(len(keys), dtype=np.int64)
+
+    fuzzy_positions = np.flatnonzero(matched < 0)
+    if len(fuzzy_positions) > 0:
+        blocks = _build_index(master_keys, n)
+        fuzzy_keys = [keys[i] for i in fuzzy_positions]
+        chunks = [
+            fuzzy_keys[i : i + chunksize] for i in range(0, len(fuzzy_keys), chunksize)
+        ]
+        if len(chunks) == 1 or not can_fork_workers():
+            _init_worker(master_keys, blocks, n, max_distance)
+            try:
+                results = [match for chunk in chunks for match in _match_chunk(chunk)]
+            finally:
+                _worker_index.clear()
+        else:
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(master_keys, blocks, n, max_distance),
+            ) as executor:
+                results = [
+                    match
+                    for chunk_matches in executor.map(_match_chunk, chunks)
+                    for match in chunk_matches
+                ]
+        results = np.array(results, dtype=np.int64).reshape(-1, 3)
+        matched[fuzzy_positions] = results[:, 0]
+        distance[fuzzy_positions] = results[:, 1]
+        n_candidates[fuzzy_positions] = results[:, 2]
+
+    # 候補のキーを持つ名寄せ先の名前（名寄せ先に同じ名前がある場合はその名前のみとする）
+    candidate_names = [
+        key_names.iloc[position] if position >= 0 else [] for position in matched
+    ]
+    master_name_set = set(master["name"])
+    for i, name in enumerate(unique_names):
+        if name in master_name_set:
+            candidate_names[i] = [name]
+    n_candidates = np.where(
+        matched >= 0, [len(candidates) for candidates in candidate_names], n_candidates
+    )
+    has_candidate = n_candidates == 1
+
+    # 信頼度は編集距離を長い方のキーの文字数で割って求める
+    key_lengths = np.array([len(key) for key in keys], dtype=np.int64)
+    matched_lengths = np.zeros(len(keys), dtype=np.int64)
+    matched_lengths[has_candidate] = [
+        len(master_keys[position]) for position in matched[has_candidate]
+    ]
+    max_lengths = np.maximum(np.maximum(key_lengths, matched_lengths), 1)
+    confidence = np.where(has_candidate, 1 - distance / max_lengths, 0.0)
+
+    is_exact = has_candidate & (distance == 0)
+    is_fuzzy = (
+        has_candidate
+        & (distance > 0)
+        & (confidence >= min_confidence)
+        & (key_lengths >= min_key_length)
+    )
+    is_matched = is_exact | is_fuzzy
+    matched_name = np.full(len(keys), None, dtype=object)
+    matched_name[is_matched] = [
+        candidate_names[i][0] for i in np.flatnonzero(is_matched)
+    ]
+    status = np.select(
+        [is_exact, is_fuzzy, has_candidate, n_candidates > 1],
+        ["exact", "fuzzy", "rejected", "ambiguous"],
+        default="unmatched",
+    )
+
+    name_matches = pd.DataFrame(
+        {
+            "name": unique_names,
+            "matched_name": matched_name,
+            "distance": distance,
+            "n_candidates": n_candidates,
+            "confidence": confidence,
+            "status": status,
+        }
+    )
+    return name_matches
+
+
+def fuzzy_merge(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    left_on: str,
+    right_on: str,
+    max_distance: int = 1,
+    min_confidence: float = 0.75,
+    min_key_length: int = 4,
+    n: int = 2,
+    chunksize: int = 1000,
+    max_workers: int = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    left_on列の名前をfuzzy_match_namesでright_on列の名前に名寄せしてから、leftを主として横結合する
+    （名寄せできなかった行のrightの列は欠損値となる）
+
+    Args:
+        left (pd.DataFrame): 結合するデータ（売上データ等）
+        right (pd.DataFrame): 結合するデータ（顧客台帳等）
+        left_on (str): leftの名前の列名
+        right_on (str): rightの名前の列名
+        max_distance (int): 名寄せする編集距離の上限
+        min_confidence (float): 編集距離で名寄せする場合の信頼度の下限
+        min_key_length (int): 編集距離で名寄せする名前のキーの文字数の下限
+        n (int): インデックスに用いるn-gramの文字数
+        chunksize (int): 1つのプロセスでまとめて照合する名前の数
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+
+    Returns:
+        join_data (pd.DataFrame): pd.merge(left, right, how="left", left_on=left_on, right_on=right_on)と同じ列を持つ結合結果
+        name_matches (pd.DataFrame): fuzzy_match_namesの照合結果（matched_nameが欠損値の名前は名寄せしていない）
+    """
+    name_matches = fuzzy_match_names(
+        left[left_on],
+        right[right_on],
+        max_distance,
+        min_confidence,
+        min_key_length,
+        n,
+        chunksize,
+        max_workers,
+    )
+    matched_name = left[left_on].map(name_matches.set_index("name")["matched_name"])
+    join_data = pd.merge(
+        left.assign(_matched_name=matched_name),
+        right,
+        how="left",
+        left_on="_matched_name",
+        right_on=right_on,
+    ).drop("_matched_name", axis=1)
+    return join_data, name_matches
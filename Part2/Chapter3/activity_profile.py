@@ -0,0 +1,234 @@
+import importlib.util
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+from common import to_month_category, summarize_monthly_activity, can_fork_workers
+
+
+def profile_customer_activity(
+    use_log: pd.DataFrame,
+    routine_threshold: int = 4,
+    id_column: str = "customer_id",
+    date_column: str = "usedate",
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    利用履歴を1回走査して、顧客毎の月別の利用回数と、月利用回数の統計量・定期利用フラグを作成する
+
+    顧客ID、年月、曜日をそれぞれ整数のコードにし、1つの整数のキーにまとめて
+    （顧客、月、曜日）毎の利用回数を1回の集計で数える。月別の利用回数や各月の同一曜日の利用回数の最大値は、
+    キーの順に並んだ集計結果を区切って合計・最大値をとることで求め、
+    顧客毎の統計量は月別の利用回数からsummarize_monthly_activityで集計する
+
+    Args:
+        use_log (pd.DataFrame): 利用履歴データ（date_columnはdatetime型で欠損値がないこと）
+        routine_threshold (int): 定期利用とみなす各月の同一曜日の利用回数の最大値の下限
+        id_column (str): 顧客IDの列名
+        date_column (str): 利用日の列名
+
+    Returns:
+        monthly_use_log (pd.DataFrame): 年月（use_month、カテゴリ型）、顧客ID、利用回数（count）、
+            その月の同一曜日の利用回数の最大値（weekday_max）の列を持つ顧客毎の月別の利用回数（年月、顧客IDの順に並べる）
+        customer_activity (pd.DataFrame): 顧客毎の月利用回数の平均値（mean）、中央値（median）、最大値（max）、
+            最小値（min）、各月の同一曜日の利用回数の最大値（weekday_max）、定期利用フラグ（routine_flg）
+    """
+    customer_codes, customer_ids = pd.factorize(use_log[id_column], sort=True)
+    use_month = to_month_category(use_log[date_column])
+    month_codes = use_month.cat.codes.to_numpy(dtype=np.int64)
+    weekdays = use_log[date_column].dt.weekday.to_numpy(dtype=np.int64)
+    n_months = len(use_month.cat.categories)
+
+    # （顧客、月、曜日）毎の利用回数（キーの昇順、すなわち顧客、月、曜日の順に並ぶ）
+    keys = (customer_codes.astype(np.int64) * n_months + month_codes) * 7 + weekdays
+    keys, weekday_counts = np.unique(keys, return_counts=True)
+
+    # （顧客、月）毎の利用回数と、各月の同一曜日の利用回数の最大値
+    customer_month_keys = keys // 7
+    month_starts = np.flatnonzero(
+        np.diff(customer_month_keys, prepend=customer_month_keys[:1] - 1)
+    )
+    customer_month_keys = customer_month_keys[month_starts]
+    monthly_counts = np.add.reduceat(weekday_counts, month_starts)
+    monthly_weekday_max = np.maximum.reduceat(weekday_counts, month_starts)
+
+    monthly_customer_codes = customer_month_keys // n_months
+    monthly_month_codes = customer_month_keys % n_months
+
+    # 年月、顧客IDの順に並べる
+    order = np.lexsort((monthly_customer_codes, monthly_month_codes))
+    monthly_use_log = pd.DataFrame(
+        {
+            "use_month": pd.Categorical.from_codes(
+                monthly_month_codes[order],
+                categories=use_month.cat.categories,
+                ordered=True,
+            ),
+            id_column: customer_ids[monthly_customer_codes[order]],
+            "count": monthly_counts[order],
+            "weekday_max": monthly_weekday_max[order],
+        }
+    )
+    customer_activity = summarize_monthly_activity(
+        monthly_use_log, routine_threshold, id_column
+    )
+    return monthly_use_log, customer_activity
+
+
+def _to_shared_memory(shard: pd.DataFrame) -> tuple[SharedMemory, int]:
+    """
+    データをArrowのIPC形式で共有メモリに書き込む
+
+    Returns:
+        shared_memory (SharedMemory): 書き込んだ共有メモリ（使用後にclose、unlinkすること）
+        size (int): 書き込んだバイト数
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(shard, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buffer = sink.getvalue()
+    shared_memory = SharedMemory(create=True, size=max(buffer.size, 1))
+    shared_memory.buf[: buffer.size] = memoryview(buffer).cast("B")
+    return shared_memory, buffer.size
+
+
+def _profile_shard(shard, routine_threshold: int, id_column: str, date_column: str):
+    """
+    1つのシャードの利用履歴についてprofile_customer_activityを実行する
+    shardが(共有メモリの名前, バイト数)の場合は、共有メモリのArrowのデータを読み込んで用いる
+    """
+    if isinstance(shard, pd.DataFrame):
+        return profile_customer_activity(
+            shard, routine_threshold, id_column, date_column
+        )
+
+    import pyarrow as pa
+
+    name, size = shard
+    shared_memory = SharedMemory(name=name)
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(shared_memory.buf[:size])).read_all()
+        result = profile_customer_activity(
+            table.to_pandas(), routine_threshold, id_column, date_column
+        )
+        # 共有メモリを参照するデータを解放してから閉じる
+        del table
+    finally:
+        shared_memory.close()
+    return result
+
+
+def profile_customer_activity_sharded(
+    use_log: pd.DataFrame,
+    n_shards: int = None,
+    max_workers: int = None,
+    routine_threshold: int = 4,
+    id_column: str = "customer_id",
+    date_column: str = "usedate",
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    利用履歴を顧客毎にシャードに分割し、シャード毎のprofile_customer_activityをプロセスプールで並列に実行して
+    結果を結合する（profile_customer_activityと同じ結果になる。シャードが1つの場合や、
+    ワーカープロセスをforkで起動できない場合はプロセスを起動せずにprofile_customer_activityで集計する）
+
+    集計は全て顧客毎に閉じているため、同じ顧客の行が同じシャードに入るように分割すれば、シャード毎の結果を
+    結合するだけでよい。顧客IDは最初に整数のコードにし、コードをシャード数で割った余りで分割する。
+    シャードはコードと利用日のみをArrowのIPC形式で共有メモリに置き、ワーカープロセスには共有メモリの名前のみを送る
+    （pyarrowがインストールされていない場合は、シャードのデータをそのままワーカープロセスに送る）
+
+    Args:
+        use_log (pd.DataFrame): 利用履歴データ（date_columnはdatetime型で欠損値がないこと）
+        n_shards (int): シャードの数（Noneの場合はプロセス数）
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+        routine_threshold (int): 定期利用とみなす各月の同一曜日の利用回数の最大値の下限
+        id_column (str): 顧客IDの列名
+        date_column (str): 利用日の列名
+
+    Returns:
+        monthly_use_log (pd.DataFrame): profile_customer_activityと同じ顧客毎の月別の利用回数
+        customer_activity (pd.DataFrame): profile_customer_activityと同じ顧客毎の利用状況
+    """
+    if n_shards is None:
+        n_shards = max_workers if max_workers is not None else os.cpu_count()
+    n_shards = max(min(n_shards, len(use_log)), 1)
+    if n_shards == 1 or not can_fork_workers():
+        # シャードが1つの場合や、ワーカープロセスをforkで起動できない場合はプロセスを起動しない
+        return profile_customer_activity(
+            use_log, routine_threshold, id_column, date_column
+        )
+
+    # 顧客IDを整数のコード（顧客IDの昇順）にし、コードをシャード数で割った余りで分割する
+    customer_codes, customer_ids = pd.factorize(use_log[id_column], sort=True)
+    coded_use_log = pd.DataFrame(
+        {id_column: customer_codes, date_column: use_log[date_column].to_numpy()}
+    )
+    order = np.argsort(customer_codes % n_shards, kind="stable")
+    bounds = np.searchsorted((customer_codes % n_shards)[order], np.arange(1, n_shards))
+    shards = [
+        coded_use_log.take(positions).reset_index(drop=True)
+        for positions in np.split(order, bounds)
+        if len(positions) > 0
+    ]
+
+    use_shared_memory = importlib.util.find_spec("pyarrow") is not None
+    shared_memories = []
+    try:
+        if use_shared_memory:
+            for i, shard in enumerate(shards):
+                shared_memory, size = _to_shared_memory(shard)
+                shared_memories.append(shared_memory)
+                shards[i] = (shared_memory.name, size)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                executor.map(
+                    _profile_shard,
+                    shards,
+                    [routine_threshold] * len(shards),
+                    [id_column] * len(shards),
+                    [date_column] * len(shards),
+                )
+            )
+    finally:
+        for shared_memory in shared_memories:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    # シャード毎の年月のカテゴリを全体の年月のカテゴリに揃えて結合し、年月、顧客IDの順に並べる
+    months = pd.Index(
+        sorted(
+            set().union(
+                *[monthly["use_month"].cat.categories for monthly, _ in results]
+            )
+        )
+    )
+    month_codes = np.concatenate(
+        [
+            months.get_indexer(monthly["use_month"].cat.categories)[
+                monthly["use_month"].cat.codes.to_numpy()
+            ]
+            for monthly, _ in results
+        ]
+    )
+    monthly_use_log = pd.concat([monthly for monthly, _ in results], ignore_index=True)
+    monthly_customer_codes = monthly_use_log[id_column].to_numpy()
+    order = np.lexsort((monthly_customer_codes, month_codes))
+    monthly_use_log = pd.DataFrame(
+        {
+            "use_month": pd.Categorical.from_codes(
+                month_codes[order], categories=months, ordered=True
+            ),
+            id_column: customer_ids[monthly_customer_codes[order]],
+            "count": monthly_use_log["count"].to_numpy()[order],
+            "weekday_max": monthly_use_log["weekday_max"].to_numpy()[order],
+        }
+    )
+
+    customer_activity = pd.concat(
+        [activity for _, activity in results], ignore_index=True
+    )
+    customer_activity = customer_activity.sort_values(id_column, ignore_index=True)
+    customer_activity[id_column] = customer_ids[customer_activity[id_column].to_numpy()]
+    return monthly_use_log, customer_activity
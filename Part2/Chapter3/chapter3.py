@@ -1,28 +1,45 @@
 # %%
 import os
+import sys
 import pandas as pd
-from dateutil.relativedelta import relativedelta
 import matplotlib.pyplot as plt
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import (
+    read_csv_cached,
+    months_between,
+    update_customer_activity,
+    write_customer_features,
+    optimize_dtypes,
+    memory_report,
+)
+from activity_profile import (
+    profile_customer_activity,
+    profile_customer_activity_sharded,
+)
+
 # データの読み込み
-use_log = pd.read_csv("input/use_log.csv")
+use_log = read_csv_cached("input/use_log.csv", parse_dates=["usedate"])
 print(len(use_log))
 use_log.head()
 
 # %%
-customer_master = pd.read_csv("input/customer_master.csv")
+customer_master = read_csv_cached(
+    "input/customer_master.csv", parse_dates=["start_date", "end_date"]
+)
 print(len(customer_master))
 customer_master.head()
 
 # %%
-class_master = pd.read_csv("input/class_master.csv")
+class_master = read_csv_cached("input/class_master.csv")
 print(len(class_master))
 class_master.head()
 
 # %%
-campaign_master = pd.read_csv("input/campaign_master.csv")
+campaign_master = read_csv_cached("input/campaign_master.csv")
 print(len(campaign_master))
 campaign_master.head()
 
@@ -115,72 +132,51 @@ customers_exist_latest_month.groupby("gender")["customer_id"].count()
 # 1-1.usedateをdatetime型に変換する
 use_log["usedate"] = pd.to_datetime(use_log["usedate"])
 
-# 1-2.use_month列を作成する
-use_log["use_month"] = use_log["usedate"].dt.strftime("%Y-%m")
-
-# 1-3.各顧客の月毎の利用回数を集計したデータフレームを作成する
-monthly_use_log = use_log.groupby(["use_month", "customer_id"], as_index=False).count()
+# 1-2.利用履歴を1回走査して、各顧客の月毎の利用回数と顧客毎の利用状況を集計する
+# 顧客ID、年月、曜日を整数のコードにして（顧客、月、曜日）毎の利用回数を一度に数え、
+# そこから月毎の利用回数、月利用回数の統計量、定期利用フラグを求める
+# （年月は整数の月キーから作成したカテゴリ型とする。カテゴリ型の列で集計するときはobserved=Trueを指定する）
+# 利用履歴が多い場合は、集計は顧客毎に閉じているため、顧客毎のシャードに分けて複数のプロセスで並列に集計できる
+# （並列に集計する場合はプロセス数を指定する。Noneの場合は1つのプロセスで集計する）
+profile_max_workers = None
+if profile_max_workers is None:
+    monthly_use_log, customer_activity = profile_customer_activity(use_log)
+else:
+    monthly_use_log, customer_activity = profile_customer_activity_sharded(
+        use_log, max_workers=profile_max_workers
+    )
 monthly_use_log
 
 # %%
-# 1-4.不要なusedate列を削除する（usedate列とlog_id列のカウント結果は等しいため）
-monthly_use_log.drop("usedate", axis=1, inplace=True)
-monthly_use_log
+# 1-3.月毎の利用回数を顧客の特徴量ストアに年月毎に保存し、顧客毎の利用状況を更新する場合はTrueにする
+# （Falseの場合は1-2で集計した利用状況をそのまま用いる）
+# 特徴量ストアでは、内容が変わった年月（新しく追加された月等）と利用履歴から無くなった年月に利用した顧客の利用状況のみを集計し直す
+use_feature_store = False
+feature_store_dir = "output/customer_feature_store"
+if use_feature_store:
+    customer_activity = update_customer_activity(feature_store_dir, monthly_use_log)
+customer_activity
 
 # %%
-# 1-5.列名log_idをcountに変更する
-monthly_use_log.rename(columns={"log_id": "count"}, inplace=True)
-monthly_use_log
+# 2.顧客毎の月利用回数の平均値、中央値、最大値、最小値を確認する
+customer_activity[["customer_id", "mean", "median", "max", "min"]]
 
 # %%
-# 2.顧客毎の月利用回数の平均値、中央値、最大値、最小値を集計する
-customer_monthly_use_log = (
-    monthly_use_log[["customer_id", "count"]]
-    .groupby("customer_id")
-    .agg(["mean", "median", "max", "min"])
-)["count"]
-customer_monthly_use_log.reset_index(drop=False, inplace=True)
-customer_monthly_use_log
-
-# %%
-# 各顧客が定期的（今回は、毎週同じ曜日に利用していることと定義する）に利用しているかどうかのフラグを作成する
-# 1.顧客毎に月毎の曜日別の利用回数をカウントする
-# 1-1.曜日データを作成する
-use_log["weekday"] = use_log["usedate"].dt.weekday
-# 1-2.各月の各曜日の利用回数をカウントする
-weekday_use_log = use_log.groupby(
-    ["customer_id", "use_month", "weekday"], as_index=False
-).count()[["customer_id", "use_month", "weekday", "log_id"]]
-weekday_use_log.rename(columns={"log_id": "count"}, inplace=True)
-weekday_use_log.head()
-# %%
-# 2.定期利用フラグを作成する
-# 2-1.顧客毎に各月の同一曜日の利用回数の最大値を取得する
-weekday_use_log = weekday_use_log.groupby("customer_id", as_index=False).max("count")[
-    ["customer_id", "count"]
-]
-weekday_use_log.head()
-# %%
-# 2-2.最大値が4以上の時にフラグを立てる
-weekday_use_log["routine_flg"] = 0
-weekday_use_log.loc[weekday_use_log["count"] >= 4, "routine_flg"] = 1
-weekday_use_log.head()
+# 各顧客が定期的（今回は、毎週同じ曜日に利用していることと定義する）に利用しているかどうかのフラグを確認する
+# 顧客毎の各月の同一曜日の利用回数の最大値（weekday_max）が4以上の時にフラグが立っている
+customer_activity[["customer_id", "weekday_max", "routine_flg"]].head()
 # %%
 # 顧客データと利用履歴データ(月利用回数の集計データと定期利用フラグ)を結合する
-# 1.顧客データと月利用回数の集計データを結合する
-join_customer_data = pd.merge(
-    join_customer_data, customer_monthly_use_log, how="left", on="customer_id"
-)
-# 2.顧客データと定期利用フラグを結合する
+# 1.顧客データと月利用回数の統計量、定期利用フラグを結合する
 join_customer_data = pd.merge(
     join_customer_data,
-    weekday_use_log[["customer_id", "routine_flg"]],
+    customer_activity[["customer_id", "mean", "median", "max", "min", "routine_flg"]],
     how="left",
     on="customer_id",
 )
 join_customer_data.head()
 # %%
-# 3.欠損値の確認をする
+# 2.欠損値の確認をする
 join_customer_data.isnull().sum()
 
 # %%
@@ -190,15 +186,42 @@ join_customer_data["calc_end_date"] = join_customer_data["end_date"]
 join_customer_data["calc_end_date"] = join_customer_data["calc_end_date"].fillna(
     pd.to_datetime("20190430")
 )
-# 2.会員期間を月単位で算出する
-join_customer_data["membership_period"] = 0
-for i in range(len(join_customer_data)):
-    delta = relativedelta(
-        join_customer_data.loc[i, "calc_end_date"],
-        join_customer_data.loc[i, "start_date"],
-    )
-    join_customer_data.loc[i, "membership_period"] = delta.years * 12 + delta.months
+# 2.会員期間を月単位で算出する（relativedeltaで行毎に計算した場合と同じ結果になる）
+join_customer_data["membership_period"] = months_between(
+    join_customer_data["calc_end_date"], join_customer_data["start_date"]
+)
 join_customer_data.head()
+
+# %%
+# データ型を変換してメモリ使用量を削減する
+# 1.文字列の列（顧客IDや名前のようにユニークな値が多い列は除く）をカテゴリ型に、整数型の列を最も小さい整数型に変換する
+#   小数の列はfloat32にすると統計量や標準化した値が変わるため、float64のままとする
+compact_customer_data = optimize_dtypes(join_customer_data)
+memory_report(join_customer_data, compact_customer_data)
+
+# %%
+# 2.型を変換しても以降の集計結果と、第4章、第5章のモデルの入力が変わらないことを確かめる
+# 2-1.統計量
+print(compact_customer_data.describe().equals(join_customer_data.describe()))
+
+# 2-2.第4章のクラスタリングに用いる列
+clustering_columns = ["mean", "median", "max", "min", "membership_period"]
+print(
+    compact_customer_data[clustering_columns]
+    .astype(float)
+    .equals(join_customer_data[clustering_columns].astype(float))
+)
+
+# 2-3.第5章の退会予測に用いる列（カテゴリー変数はダミー変数化した値）
+predict_columns = ["campaign_name", "class_name", "gender", "routine_flg", "is_deleted"]
+print(
+    pd.get_dummies(compact_customer_data[predict_columns], dtype=int)
+    .astype(int)
+    .equals(pd.get_dummies(join_customer_data[predict_columns], dtype=int).astype(int))
+)
+
+# 3.以降は型を変換したデータを用いる（特徴量ストアにも変換後の型で保存される）
+join_customer_data = compact_customer_data
 # %%
 # 顧客行動の各種統計量を計算する
 # 1.顧客毎の月利用回数の平均値、中央値、最大値、最小値の統計量を計算する
@@ -256,4 +279,7 @@ if not os.path.exists("output"):
 # 3-2.join_customer_dataをcsvファイルとして出力する
 join_customer_data.to_csv("output/join_customer_data.csv", index=False)
 
+# 3-3.join_customer_dataを顧客の特徴量として特徴量ストアに保存する（第4章、第5章では型を保ったまま読み込む）
+write_customer_features(feature_store_dir, join_customer_data)
+
 # %%
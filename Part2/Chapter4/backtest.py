@@ -0,0 +1,180 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from common import can_fork_workers
+
+# 各ワーカープロセスで共有する特徴量・目的変数の行列と検証の条件（initializerで設定する）
+_worker_data = {}
+
+
+def _init_worker(
+    data,
+    shape: tuple,
+    month_offsets: np.ndarray,
+    window_months: int,
+    model_factory,
+    limit_threads: bool,
+) -> None:
+    """
+    ワーカープロセスに予測月順に並べた特徴量・目的変数の行列と検証の条件を設定する
+    dataが共有メモリの名前の場合は、共有メモリ上の行列をコピーせずに参照する
+    """
+    if isinstance(data, str):
+        shared_memory = SharedMemory(name=data)
+        # 共有メモリを参照している間は閉じられないよう、共有メモリのオブジェクトも保持する
+        _worker_data["shared_memory"] = shared_memory
+        data = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+    if limit_threads:
+        # 複数のプロセスで並列に検証するため、各プロセス内の計算はスレッド1つで実行する
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(limits=1)
+    _worker_data.update(
+        data=data,
+        month_offsets=month_offsets,
+        window_months=window_months,
+        model_factory=model_factory,
+    )
+
+
+def _run_fold(test_month: int) -> tuple:
+    """
+    test_month番目の予測月より前の予測月のデータで学習し、test_month番目の予測月のデータで検証する
+    行列は予測月順に並んでいるため、学習・検証データは行列の連続した範囲（コピーしないビュー）として取り出す
+
+    Returns:
+        result (tuple): (学習データ数, 検証データ数, 平均絶対誤差, 二乗平均平方根誤差, 決定係数, 学習時間（秒）, 予測時間（秒）)
+    """
+    data = _worker_data["data"]
+    month_offsets = _worker_data["month_offsets"]
+    window_months = _worker_data["window_months"]
+
+    first_month = 0 if window_months is None else max(test_month - window_months, 0)
+    train = data[month_offsets[first_month] : month_offsets[test_month]]
+    test = data[month_offsets[test_month] : month_offsets[test_month + 1]]
+
+    model = _worker_data["model_factory"]()
+    start = time.perf_counter()
+    model.fit(train[:, :-1], train[:, -1])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted = model.predict(test[:, :-1])
+    predict_seconds = time.perf_counter() - start
+
+    error = predicted - test[:, -1]
+    total = ((test[:, -1] - test[:, -1].mean()) ** 2).sum()
+    r2 = 1 - (error**2).sum() / total if total > 0 else np.nan
+    return (
+        len(train),
+        len(test),
+        np.abs(error).mean(),
+        np.sqrt((error**2).mean()),
+        r2,
+        fit_seconds,
+        predict_seconds,
+    )
+
+
+def rolling_origin_backtest(
+    predict_data: pd.DataFrame,
+    feature_columns: list,
+    target_column: str,
+    month_column: str = "pred_month",
+    min_train_months: int = 1,
+    window_months: int = None,
+    model_factory=LinearRegression,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """
+    予測月毎に、その月より前の予測月のデータのみで学習したモデルでその月を予測し（rolling-origin評価）、
+    予測月毎の誤差と学習・予測にかかった時間を求める（ランダムに分割した場合と異なり、未来の月のデータで学習しない）
+
+    特徴量と目的変数は予測月順に並べた1つの行列にして共有メモリに1度だけ置き、各予測月の検証（fold）は
+    プロセスプールで並列に実行する。各foldの学習・検証データは行列の連続した範囲をコピーせずに参照する
+    （foldが1つの場合や、ワーカープロセスをforkで起動できない場合はプロセスを起動せずに順に検証する）
+
+    Args:
+        predict_data (pd.DataFrame): 予測月、特徴量、目的変数の列を持つデータ（欠損値がないこと）
+        feature_columns (list): 特徴量の列
+        target_column (str): 目的変数の列
+        month_column (str): 予測月の列（順序つきのカテゴリ型の場合はカテゴリの順、それ以外は値の昇順を時系列順とする）
+        min_train_months (int): 学習に用いる予測月の数の下限（1以上。最初のmin_train_months個の予測月は検証しない）
+        window_months (int): 学習に用いる直前の予測月の数（1以上。Noneの場合は検証する予測月より前の全ての予測月を用いる）
+        model_factory: 引数なしで呼び出すと未学習のモデル（fit、predictメソッドを持つ）を返す関数・クラス
+            （プロセス間で受け渡すため、モジュールの最上位で定義されたものであること）
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+
+    Returns:
+        backtest (pd.DataFrame): 検証した予測月毎の結果（予測月の順）
+            month: 予測月、n_train: 学習データ数、n_test: 検証データ数、mae: 平均絶対誤差、
+            rmse: 二乗平均平方根誤差、r2: 決定係数、fit_seconds: 学習時間（秒）、predict_seconds: 予測時間（秒）
+    """
+    if min_train_months < 1:
+        raise ValueError(
+            f"min_train_monthsは1以上を指定してください: {min_train_months}"
+        )
+    if window_months is not None and window_months < 1:
+        raise ValueError(f"window_monthsは1以上を指定してください: {window_months}")
+    month_codes, months = pd.factorize(predict_data[month_column], sort=True)
+    order = np.argsort(month_codes, kind="stable")
+    data = np.column_stack(
+        [
+            predict_data[feature_columns].to_numpy(dtype=np.float64)[order],
+            predict_data[target_column].to_numpy(dtype=np.float64)[order],
+        ]
+    )
+    # 予測月毎の行の範囲（i番目の予測月はmonth_offsets[i]行目からmonth_offsets[i + 1]行目の手前まで）
+    month_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(month_codes, minlength=len(months)))]
+    )
+    test_months = list(range(min_train_months, len(months)))
+
+    results = []
+    if len(test_months) == 1 or (len(test_months) > 1 and not can_fork_workers()):
+        _init_worker(
+            data, data.shape, month_offsets, window_months, model_factory, False
+        )
+        try:
+            results = [_run_fold(test_month) for test_month in test_months]
+        finally:
+            # 特徴量・目的変数の行列への参照を残さない
+            _worker_data.clear()
+    elif len(test_months) > 1:
+        shared_memory = SharedMemory(create=True, size=data.nbytes)
+        try:
+            np.ndarray(data.shape, dtype=np.float64, buffer=shared_memory.buf)[:] = data
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(
+                    shared_memory.name,
+                    data.shape,
+                    month_offsets,
+                    window_months,
+                    model_factory,
+                    True,
+                ),
+            ) as executor:
+                results = list(executor.map(_run_fold, test_months))
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    backtest = pd.DataFrame(
+        results,
+        columns=[
+            "n_train",
+            "n_test",
+            "mae",
+            "rmse",
+            "r2",
+            "fit_seconds",
+            "predict_seconds",
+        ],
+    )
+    backtest.insert(0, "month", months[test_months])
+    return backtest
@@ -1,8 +1,8 @@
 # %%
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
-from dateutil.relativedelta import relativedelta
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
@@ -11,14 +11,63 @@ import sklearn.model_selection
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import (
+    read_csv_cached,
+    read_customer_features,
+    to_month_category,
+    months_between,
+    build_lag_features,
+    iter_lag_features,
+)
+from segmentation import (
+    iter_customer_chunks,
+    fit_minibatch_segments,
+    predict_segments,
+    save_segment_centers,
+    load_segment_centers,
+    build_segment_model,
+    save_segment_model,
+    load_segment_model,
+    assign_segments,
+    fit_streaming_pca,
+    density_map,
+    density_image,
+)
+from cluster_selection import evaluate_cluster_counts
+from backtest import rolling_origin_backtest
+
 # データの読み込み
 # 1.利用履歴データの読み込み
-use_log = pd.read_csv("input/use_log.csv")
+use_log = read_csv_cached("input/use_log.csv", parse_dates=["usedate"])
 use_log.isnull().sum()
 
 # %%
 # 2.顧客行動データの読み込み
-customer = pd.read_csv("input/join_customer_data.csv")
+# 以降で用いる列のみを読み込む
+# 第3章で作成した顧客の特徴量ストアから型を保ったまま読み込む場合はTrueにする（Falseの場合はcsvから読み込む）
+use_feature_store = False
+customer_columns = [
+    "customer_id",
+    "start_date",
+    "is_deleted",
+    "mean",
+    "median",
+    "max",
+    "min",
+    "routine_flg",
+    "membership_period",
+]
+feature_store_dir = "../Chapter3/output/customer_feature_store"
+if use_feature_store:
+    customer = read_customer_features(feature_store_dir, columns=customer_columns)
+else:
+    customer = read_csv_cached(
+        "input/join_customer_data.csv",
+        columns=customer_columns,
+        parse_dates=["start_date", "end_date"],
+    )
 customer.isnull().sum()
 
 # %%
@@ -52,6 +101,19 @@ customer_clustering["cluster"] = clusters.labels_
 # 各クラスにデータが割り振られていることを確認する
 customer_clustering["cluster"].unique()
 
+# %%
+# （参考）クラスター数を比較する
+# クラスター数2〜8と乱数シード3つの組み合わせ毎に、標準化したデータでK-means法をCPU数のプロセスで並列に実行し、
+# クラスター内誤差平方和（inertia）、シルエット係数、ブートストラップ標本で作成したクラスターとの一致度（安定性）を計算する
+# 評価結果はデータのハッシュ値毎に保存し、データが変わっていなければ次回は保存した結果を用いる
+k_selection = evaluate_cluster_counts(
+    customer_clustering_sc,
+    k_values=list(range(2, 9)),
+    seeds=[0, 1, 2],
+    cache_dir="output/cluster_selection_cache",
+)
+k_selection.groupby("k")[["inertia", "silhouette", "stability"]].agg(["mean", "std"])
+
 # %%
 customer_clustering.head()
 
@@ -73,18 +135,50 @@ customer_clustering.groupby("cluster").mean()
 # %%
 X = customer_clustering_sc
 # PCAオブジェクトを生成（ここでは次元削減を行うので、維持する主成分の数をパラメータとして指定）
-pca = PCA(n_components=2)
+# 求める主成分は2つのみのため、乱択アルゴリズム（randomized SVD）で求める（顧客数が多くても計算量が小さい）
+pca = PCA(n_components=2, svd_solver="randomized", random_state=0)
 
 # fitメソッドを呼び出し、主成分を見つける
-# transformメソッドで回転と次元削減を行う
-x_pca = pca.fit_transform(X)
+# 回転と次元削減は、以下で保存したモデルを用いて可視化する際に行う
+pca.fit(X)
 
-pca_df = pd.DataFrame(x_pca)
-pca_df["cluster"] = customer_clustering["cluster"]
+# %%
+# 学習したモデルを保存し、新しい顧客にも学習し直さずにクラスターを割り当てられるようにする
+# 1.標準化、クラスタリング、主成分分析のモデルをまとめて保存する
+# （割り当てに用いるクラスターの中心の重みと定数項も、保存時に計算しておく）
+if not os.path.exists("output"):
+    # ディレクトリが存在しない場合、ディレクトリを作成する
+    os.makedirs("output")
 
-for i in customer_clustering["cluster"].unique():
-    tmp = pca_df.loc[pca_df["cluster"] == i]
-    plt.scatter(tmp[0], tmp[1])
+segment_model_path = "output/segment_model.pkl"
+save_segment_model(
+    segment_model_path,
+    build_segment_model(
+        sc, kmeans, pca, ["mean", "median", "max", "min", "membership_period"]
+    ),
+)
+
+# 2.保存したモデルを読み込んで顧客にクラスターを割り当て、学習時のクラスターと一致することを確かめる
+segment_model = load_segment_model(segment_model_path)
+segment_assigned = assign_segments(customer, segment_model)
+print((segment_assigned == customer_clustering["cluster"]).all())
+
+# %%
+# 3.主成分の平面でクラスタリング結果を可視化する
+# 顧客を1人ずつ点で描画する代わりに、平面を格子に区切って格子毎・クラスター毎の顧客数を集計し、
+# 格子毎に最も顧客数の多いクラスターの色で、顧客数が多いほど濃く描画する（描画量は顧客数によらず格子の数で決まる）
+cluster_counts, cluster_extent = density_map(
+    lambda: [customer], segment_model, bins=100
+)
+fig = plt.figure()
+ax = fig.add_subplot()
+ax.imshow(
+    density_image(cluster_counts, plt.get_cmap("tab10").colors),
+    origin="lower",
+    extent=cluster_extent,
+    aspect="auto",
+    interpolation="nearest",
+)
 
 # %%
 # 退会顧客の傾向を把握する
@@ -106,6 +200,61 @@ customer_clustering.groupby(["cluster", "is_deleted"]).count()["customer_id"]
 # 3.クラスター毎の定期利用フラグをカウントする
 customer_clustering.groupby(["cluster", "routine_flg"]).count()["customer_id"]
 
+# %%
+# （参考）顧客数が多い場合に、顧客データをチャンク毎に読み込みながらクラスタリングする
+# 1.チャンク毎に標準化のスケール変換器を更新（partial_fit）し、標準化したチャンク毎にミニバッチK-means法で
+#   クラスターの中心を更新する（全ての顧客データを一度にメモリに載せない）
+# 前回保存したクラスターの中心があれば、その中心から更新を始める（クラスター番号が前回と入れ替わらない）
+segment_columns = ["mean", "median", "max", "min", "membership_period"]
+segment_centers_path = "output/segment_centers.csv"
+
+
+def read_customer_chunks():
+    return iter_customer_chunks(
+        "input/join_customer_data.csv",
+        columns=segment_columns,
+        batch_size=1000,
+        feature_store_dir=feature_store_dir if use_feature_store else None,
+    )
+
+
+previous_centers = load_segment_centers(segment_centers_path)
+segment_scaler, segment_kmeans = fit_minibatch_segments(
+    read_customer_chunks,
+    segment_columns,
+    n_clusters=4,
+    init_centers=previous_centers,
+    n_epochs=3 if previous_centers is None else 1,
+)
+save_segment_centers(
+    segment_centers_path, segment_scaler, segment_kmeans, segment_columns
+)
+
+# 2.各顧客のクラスターを求め、全ての顧客データで作成したクラスターと比較する
+segment_labels = predict_segments(
+    read_customer_chunks, segment_columns, segment_scaler, segment_kmeans
+)
+pd.crosstab(customer_clustering["cluster"], segment_labels)
+
+# %%
+# 3.チャンク毎に主成分分析のモデルを更新し（IncrementalPCA）、チャンク毎に集計した顧客数で可視化する
+segment_pca = fit_streaming_pca(read_customer_chunks, segment_columns, segment_scaler)
+streaming_segment_model = build_segment_model(
+    segment_scaler, segment_kmeans, segment_pca, segment_columns
+)
+segment_counts, segment_extent = density_map(
+    read_customer_chunks, streaming_segment_model, bins=100
+)
+fig = plt.figure()
+ax = fig.add_subplot()
+ax.imshow(
+    density_image(segment_counts, plt.get_cmap("tab10").colors),
+    origin="lower",
+    extent=segment_extent,
+    aspect="auto",
+    interpolation="nearest",
+)
+
 # %%
 # 翌月の利用回数の予測を行う
 # 2018年5-10月の6ヶ月間のデータを用いて2018年11月の利用回数を予測する
@@ -113,11 +262,14 @@ customer_clustering.groupby(["cluster", "routine_flg"]).count()["customer_id"]
 # 1-1.usedateデータをdatetime型に変換する
 use_log["usedate"] = pd.to_datetime(use_log["usedate"])
 # 1-2.monthデータ列を追加する
-use_log["usemonth"] = use_log["usedate"].dt.strftime("%Y-%m")
+# 年月は整数の月キーから作成したカテゴリ型とし、行毎の文字列の作成を省く
+use_log["usemonth"] = to_month_category(use_log["usedate"])
 use_log.head()
 # %%
 # 1-3.顧客毎の月毎の利用データを作成する
-monthly_use_log = use_log.groupby(["customer_id", "usemonth"], as_index=False).count()
+monthly_use_log = use_log.groupby(
+    ["customer_id", "usemonth"], as_index=False, observed=True
+).count()
 monthly_use_log.drop("usedate", axis=1, inplace=True)
 monthly_use_log.rename(columns={"log_id": "count"}, inplace=True)
 monthly_use_log.head()
@@ -125,35 +277,36 @@ monthly_use_log.head()
 # %%
 # 2.顧客毎に予測月の利用回数とその過去6ヶ月の利用回数のデータセットを作成する
 # データ取得期間が2018年4月から2019年3月なので、予測月は過去6ヶ月のデータが取れる2018年10月から2019年3月までとなる
-year_months = list(monthly_use_log["usemonth"].unique())
-
-predict_data = pd.DataFrame()
-
-for i in range(6, len(year_months)):  # 予測月は過去6ヶ月のデータが取れる2018年10月から
-    # 予測月の利用回数データのデータフレーム（tmp）を作成する
-    tmp = monthly_use_log[monthly_use_log["usemonth"] == year_months[i]].copy()
-    tmp.rename(columns={"count": "count_pred", "usemonth": "pred_month"}, inplace=True)
-
-    for j in range(1, 7):
-        # 予測月の過去6ヶ月の利用回数データを各列に持つデータフレーム（tmp_before）を作成する
-        tmp_before = monthly_use_log[
-            monthly_use_log["usemonth"] == year_months[i - j]
-        ].copy()
-
-        # 当月（予測月の前の月）を0として、何ヶ月前の利用回数かを表すカラム名をつける
-        tmp_before.rename(columns={"count": f"count_{j-1}"}, inplace=True)
-
-        # カラム名でいつの月の利用回数か判別できるようになったので、不要になったusemonthデータ列を削除する
-        tmp_before.drop("usemonth", axis=1, inplace=True)
-
-        # 予測月の利用回数データに過去の利用回数データを結合する
-        tmp = pd.merge(tmp, tmp_before, how="left", on="customer_id")
-
-    # 各予測月について作成した予測月と過去の利用回数データのデータフレームを結合する
-    predict_data = pd.concat([predict_data, tmp], ignore_index=True)
+# 顧客 × 月の利用回数の行列を一度だけ作成し、予測月の過去6ヶ月（当月（予測月の前の月）を0として、
+# 何ヶ月前の利用回数かを表すカラム名をつける）の利用回数を行列の列をずらして取り出す
+# 予測月は過去6ヶ月のデータが取れる月から（月の順序はカテゴリの順で、時系列順に並んでいる）
+predict_data = build_lag_features(
+    monthly_use_log,
+    lag_columns=[f"count_{j}" for j in range(6)],
+    target_column="count_pred",
+)
+predict_data.rename(columns={"usemonth": "pred_month"}, inplace=True)
 
 predict_data.head()
 
+# %%
+# 2-1.（参考）予測月毎に順に作成する場合
+# 直近6ヶ月のデータのみを保持しながら、月毎のデータから予測月のデータを順に作成する（履歴が長い場合向け）
+# 一度に作成した場合と同じデータになることを確かめる
+predict_data_streaming = pd.concat(
+    iter_lag_features(
+        (
+            month_frame
+            for _, month_frame in monthly_use_log.groupby("usemonth", observed=True)
+        ),
+        lag_columns=[f"count_{j}" for j in range(6)],
+        target_column="count_pred",
+    ),
+    ignore_index=True,
+)
+predict_data_streaming.rename(columns={"usemonth": "pred_month"}, inplace=True)
+print(predict_data_streaming.equals(predict_data))
+
 # %%
 # 3.過去6ヶ月間のデータに欠損があるデータを削除する
 predict_data = predict_data.dropna(ignore_index=True)
@@ -177,13 +330,9 @@ predict_data.head()
 predict_data["start_date"] = pd.to_datetime(predict_data["start_date"])
 
 # 2-3.予測月までの会員期間（membership_period: now_dateとstart_dateの差分）を計算する
-predict_data["membership_period"] = None
-
-for i in range(len(predict_data)):
-    delta = relativedelta(
-        predict_data.loc[i, "now_date"], predict_data.loc[i, "start_date"]
-    )
-    predict_data.loc[i, "membership_period"] = delta.years * 12 + delta.months
+predict_data["membership_period"] = months_between(
+    predict_data["now_date"], predict_data["start_date"]
+)
 
 predict_data.head()
 # %%
@@ -214,6 +363,15 @@ model.fit(X_train, y_train)
 print(model.score(X_train, y_train))
 print(model.score(X_test, y_test))
 
+# %%
+# 4.（参考）時系列に沿って精度を検証する
+# ランダムに分割すると未来の月のデータも学習に用いられるため、予測月毎にそれより前の予測月のデータのみで学習したモデルで
+# その月を予測し（rolling-origin評価）、予測月毎の誤差と学習・予測にかかった時間を確認する（予測月毎にプロセスを分けて並列に実行する）
+backtest = rolling_origin_backtest(
+    predict_data, feature_columns=list(X.columns), target_column="count_pred"
+)
+backtest
+
 # %%
 # モデルに寄与している変数を確認する
 coef = pd.DataFrame({"feature_names": X.columns, "coefficient": model.coef_})
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+from common import can_fork_workers
+
+# 各ワーカープロセスで共有する標準化済みのデータと評価の条件（initializerで設定する）
+_worker_data = {}
+
+# 評価結果の列
+RESULT_COLUMNS = ["k", "seed", "inertia", "silhouette", "stability"]
+
+
+def _data_hash(X: np.ndarray, condition: dict) -> str:
+    """
+    データの内容と評価の条件のハッシュ値（SHA-256）を計算する（評価結果のキャッシュのキーに用いる）
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(json.dumps([X.shape, str(X.dtype), condition]).encode())
+    sha256.update(np.ascontiguousarray(X).tobytes())
+    return sha256.hexdigest()
+
+
+def _init_worker(
+    X, shape: tuple, sample_size: int, n_bootstrap: int, limit_threads: bool
+) -> None:
+    """
+    ワーカープロセスに標準化済みのデータと評価の条件を設定する
+    Xが共有メモリの名前の場合は、共有メモリ上のデータをコピーせずに参照する
+    """
+    if isinstance(X, str):
+        shared_memory = SharedMemory(name=X)
+        # 共有メモリを参照している間は閉じられないよう、共有メモリのオブジェクトも保持する
+        _worker_data["shared_memory"] = shared_memory
+        X = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+    if limit_threads:
+        # 複数のプロセスで並列に評価するため、各プロセス内のK-means法はスレッド1つで実行する
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(limits=1)
+    _worker_data.update(X=X, sample_size=sample_size, n_bootstrap=n_bootstrap)
+
+
+def _evaluate(k: int, seed: int) -> tuple:
+    """
+    クラスター数kと乱数シードseedでK-means法を実行し、評価指標を計算する
+
+    Returns:
+        result (tuple): (k, seed, inertia（クラスター内誤差平方和）, silhouette（サンプルで計算したシルエット係数）,
+            stability（ブートストラップ標本で作成したモデルのクラスターとの調整ランド指数の平均値）)
+    """
+    X = _worker_data["X"]
+    n_bootstrap = _worker_data["n_bootstrap"]
+
+    kmeans = KMeans(n_clusters=k, n_init=1, random_state=seed).fit(X)
+    silhouette = silhouette_score(
+        X,
+        kmeans.labels_,
+        sample_size=min(_worker_data["sample_size"], len(X)),
+        random_state=seed,
+    )
+
+    # 復元抽出したデータでクラスタリングし直し、全データのクラスターがどれだけ再現されるかを調べる
+    rng = np.random.default_rng([seed, k])
+    scores = []
+    for _ in range(n_bootstrap):
+        sample = X[rng.integers(0, len(X), len(X))]
+        bootstrap_kmeans = KMeans(n_clusters=k, n_init=1, random_state=seed).fit(sample)
+        scores.append(adjusted_rand_score(kmeans.labels_, bootstrap_kmeans.predict(X)))
+    stability = float(np.mean(scores)) if n_bootstrap > 0 else np.nan
+    return k, seed, float(kmeans.inertia_), float(silhouette), stability
+
+
+def evaluate_cluster_counts(
+    X: np.ndarray,
+    k_values: list,
+    seeds: list = None,
+    sample_size: int = 1000,
+    n_bootstrap: int = 5,
+    cache_dir: str = None,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """
+    クラスター数と乱数シードの組み合わせ毎にK-means法を実行し、クラスター数を選ぶための評価指標を計算する
+
+    組み合わせ毎の評価はプロセスプールで並列に実行する（組み合わせが1つの場合や、
+    ワーカープロセスをforkで起動できない場合はプロセスを起動せずに順に評価する）。
+    標準化済みのデータは共有メモリに1度だけ置き、各ワーカープロセスはコピーせずに参照する。
+    cache_dirを指定すると、データの内容と評価の条件のハッシュ値毎に評価結果を保存し、
+    データが変わっていなければ保存済みの組み合わせは計算せずに保存した結果を用いる
+
+    Args:
+        X (np.ndarray): 標準化済みのデータ
+        k_values (list): 評価するクラスター数（2以上）
+        seeds (list): 評価する乱数シード（Noneの場合は0のみ）
+        sample_size (int): シルエット係数の計算に用いるサンプル数
+        n_bootstrap (int): 安定性の計算に用いるブートストラップ標本の数
+        cache_dir (str): 評価結果を保存するディレクトリ（Noneの場合は保存しない）
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+
+    Returns:
+        results (pd.DataFrame): 組み合わせ毎の評価結果（k、seedの昇順）
+            k: クラスター数、seed: 乱数シード、inertia: クラスター内誤差平方和、
+            silhouette: シルエット係数（大きいほどクラスターがよく分かれている）、
+            stability: ブートストラップ標本で作成したクラスターとの調整ランド指数の平均値（1に近いほど安定している）
+    """
+    if seeds is None:
+        seeds = [0]
+    if min(k_values) < 2:
+        raise ValueError(f"k_valuesは2以上を指定してください: {k_values}")
+    X = np.ascontiguousarray(X, dtype=np.float64)
+
+    cached = []
+    cache_path = None
+    if cache_dir is not None:
+        condition = {"sample_size": sample_size, "n_bootstrap": n_bootstrap}
+        cache_path = os.path.join(cache_dir, _data_hash(X, condition) + ".csv")
+        if os.path.exists(cache_path):
+            # 保存した時の値をそのまま読み込む（既定の読み込み方では小数の最後の桁がずれることがある）
+            cached = [pd.read_csv(cache_path, float_precision="round_trip")]
+
+    # 保存済みの結果がない組み合わせのみを評価する
+    done = {(k, seed) for frame in cached for k, seed in zip(frame["k"], frame["seed"])}
+    tasks = [(k, seed) for k in k_values for seed in seeds if (k, seed) not in done]
+
+    results = []
+    if len(tasks) == 1 or (len(tasks) > 1 and not can_fork_workers()):
+        _init_worker(X, X.shape, sample_size, n_bootstrap, limit_threads=False)
+        try:
+            results = [_evaluate(k, seed) for k, seed in tasks]
+        finally:
+            # 標準化済みのデータへの参照を残さない
+            _worker_data.clear()
+    elif len(tasks) > 1:
+        shared_memory = SharedMemory(create=True, size=X.nbytes)
+        try:
+            np.ndarray(X.shape, dtype=X.dtype, buffer=shared_memory.buf)[:] = X
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(shared_memory.name, X.shape, sample_size, n_bootstrap, True),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _evaluate,
+                        [k for k, _ in tasks],
+                        [seed for _, seed in tasks],
+                    )
+                )
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    if len(results) > 0:
+        cached.append(pd.DataFrame(results, columns=RESULT_COLUMNS))
+    results = pd.concat(cached, ignore_index=True)
+    results = results.astype({"k": np.int64, "seed": np.int64}).sort_values(
+        ["k", "seed"], ignore_index=True
+    )
+    if cache_path is not None and len(tasks) > 0:
+        os.makedirs(cache_dir, exist_ok=True)
+        # 書き込み途中のファイルが読まれないよう、一時ファイルに書き込んでから置き換える
+        results.to_csv(cache_path + ".tmp", index=False)
+        os.replace(cache_path + ".tmp", cache_path)
+
+    is_requested = results["k"].isin(k_values) & results["seed"].isin(seeds)
+    return results[is_requested].reset_index(drop=True)
@@ -0,0 +1,374 @@
+import os
+from collections.abc import Callable, Iterable, Iterator
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+from common import iter_customer_features
+
+
+def iter_customer_chunks(
+    csv_path: str, columns: list, batch_size: int = 10000, feature_store_dir: str = None
+) -> Iterator[pd.DataFrame]:
+    """
+    顧客毎の特徴量をbatch_size行ずつ順に読み込む
+    feature_store_dirを指定した場合は特徴量ストアから、指定しない場合はcsvから読み込む
+
+    Args:
+        csv_path (str): 顧客データ（join_customer_data.csv）のパス
+        columns (list): 読み込む列
+        batch_size (int): 一度に返す行数
+        feature_store_dir (str): 第3章で作成した顧客の特徴量ストアのディレクトリ（Noneの場合はcsvから読み込む）
+
+    Yields:
+        chunk (pd.DataFrame): 顧客毎の特徴量（indexはファイル全体での行番号）
+    """
+    if feature_store_dir is not None:
+        yield from iter_customer_features(feature_store_dir, columns, batch_size)
+    else:
+        yield from pd.read_csv(csv_path, usecols=columns, chunksize=batch_size)
+
+
+def fit_streaming_scaler(
+    read_chunks: Callable[[], Iterator[pd.DataFrame]], feature_columns: list
+) -> StandardScaler:
+    """
+    データをチャンク毎に読み込みながら、標準化のスケール変換器を作成する（partial_fitで平均と分散を更新する）
+
+    Args:
+        read_chunks (Callable[[], Iterator[pd.DataFrame]]): 呼び出す度にデータのチャンクを先頭から順に返す関数
+        feature_columns (list): 標準化する列
+
+    Returns:
+        scaler (StandardScaler): 全てのチャンクで作成したスケール変換器
+    """
+    scaler = StandardScaler()
+    for chunk in read_chunks():
+        scaler.partial_fit(chunk[feature_columns].to_numpy(dtype=np.float64))
+    return scaler
+
+
+def fit_minibatch_segments(
+    read_chunks: Callable[[], Iterator[pd.DataFrame]],
+    feature_columns: list,
+    n_clusters: int = 4,
+    init_centers: pd.DataFrame = None,
+    n_epochs: int = 1,
+    random_state: int = 0,
+) -> tuple[StandardScaler, MiniBatchKMeans]:
+    """
+    データをチャンク毎に読み込みながら、標準化とミニバッチK-means法でクラスタリングする
+    全てのデータを一度にメモリに載せないため、顧客数が多い場合でもメモリ使用量はチャンクの大きさで決まる
+
+    スケール変換器を作成してから、標準化したチャンクを1つのミニバッチとしてpartial_fitでクラスターの中心を更新する。
+    init_centers（前回のクラスターの中心）を指定すると、その中心から更新を始めるため少ない走査回数で収束し、
+    前回と同じ番号のクラスターが前回の同じ番号のクラスターの近くに残る（クラスター番号が日毎に入れ替わらない）
+
+    Args:
+        read_chunks (Callable[[], Iterator[pd.DataFrame]]): 呼び出す度にデータのチャンクを先頭から順に返す関数
+            （最初のチャンクはn_clusters行以上であること）
+        feature_columns (list): クラスタリングに用いる列
+        n_clusters (int): クラスター数
+        init_centers (pd.DataFrame): 前回のクラスターの中心（load_segment_centersで読み込んだもの。Noneの場合はk-means++で初期化する）
+        n_epochs (int): 全てのチャンクを走査する回数
+        random_state (int): 乱数シード
+
+    Returns:
+        scaler (StandardScaler): 標準化のスケール変換器
+        kmeans (MiniBatchKMeans): クラスタリングのモデル
+    """
+    scaler = fit_streaming_scaler(read_chunks, feature_columns)
+    if init_centers is None:
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, n_init="auto", random_state=random_state
+        )
+    else:
+        if (
+            list(init_centers.columns) != list(feature_columns)
+            or len(init_centers) != n_clusters
+        ):
+            raise ValueError(
+                f"init_centersは{n_clusters}行で、列が{feature_columns}である必要があります"
+            )
+        # 中心は元の単位で保存しているため、今回のスケール変換器で標準化してから初期値とする
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            init=scaler.transform(init_centers.to_numpy(dtype=np.float64)),
+            n_init=1,
+            random_state=random_state,
+        )
+    for _ in range(n_epochs):
+        for chunk in read_chunks():
+            kmeans.partial_fit(
+                scaler.transform(chunk[feature_columns].to_numpy(dtype=np.float64))
+            )
+    return scaler, kmeans
+
+
+def predict_segments(
+    read_chunks: Callable[[], Iterator[pd.DataFrame]],
+    feature_columns: list,
+    scaler: StandardScaler,
+    kmeans: MiniBatchKMeans,
+) -> pd.Series:
+    """
+    データをチャンク毎に読み込みながら、各行のクラスター番号を求める
+
+    Args:
+        read_chunks (Callable[[], Iterator[pd.DataFrame]]): 呼び出す度にデータのチャンクを先頭から順に返す関数
+        feature_columns (list): クラスタリングに用いる列
+        scaler (StandardScaler): fit_minibatch_segmentsで作成したスケール変換器
+        kmeans (MiniBatchKMeans): fit_minibatch_segmentsで作成したモデル
+
+    Returns:
+        labels (pd.Series): チャンクのindexをindexとするクラスター番号
+    """
+    labels = [
+        pd.Series(
+            kmeans.predict(
+                scaler.transform(chunk[feature_columns].to_numpy(dtype=np.float64))
+            ),
+            index=chunk.index,
+        )
+        for chunk in read_chunks()
+    ]
+    return pd.concat(labels).rename("cluster")
+
+
+def save_segment_centers(
+    path: str, scaler: StandardScaler, kmeans: MiniBatchKMeans, feature_columns: list
+) -> None:
+    """
+    クラスターの中心を元の単位（標準化前の値）に戻して保存する（次回のfit_minibatch_segmentsの初期値に用いる）
+
+    Args:
+        path (str): 保存するcsvのパス
+        scaler (StandardScaler): fit_minibatch_segmentsで作成したスケール変換器
+        kmeans (MiniBatchKMeans): fit_minibatch_segmentsで作成したモデル
+        feature_columns (list): クラスタリングに用いた列
+    """
+    centers = pd.DataFrame(
+        scaler.inverse_transform(kmeans.cluster_centers_), columns=feature_columns
+    )
+    centers.index.name = "cluster"
+    # 書き込み途中のファイルが読まれないよう、一時ファイルに書き込んでから置き換える
+    centers.to_csv(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_segment_centers(path: str) -> pd.DataFrame:
+    """
+    save_segment_centersで保存したクラスターの中心を読み込む
+
+    Args:
+        path (str): 保存したcsvのパス
+
+    Returns:
+        centers (pd.DataFrame): クラスター番号をindexとするクラスターの中心（保存されていない場合はNone）
+    """
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, index_col="cluster")
+
+
+def build_segment_model(
+    scaler: StandardScaler, kmeans, pca, feature_columns: list
+) -> dict:
+    """
+    学習済みの標準化、クラスタリング、主成分分析のモデルを、保存・クラスター割り当て用のモデルにまとめる
+
+    各顧客のクラスターは標準化した値と中心の距離の2乗が最小のクラスターである。
+    ||(x - m) / s - c||^2 = ||c||^2 + 2 * m・(c / s) - 2 * x・(c / s) + （クラスターによらない値）
+    となるため、標準化を含めた重み（2 * c / s）と定数項（||c||^2 + 2 * m・(c / s)）を事前に計算しておき、
+    割り当て時は標準化せずに元の値と重みの行列積を1回計算するだけで済むようにする
+
+    Args:
+        scaler (StandardScaler): 学習済みのスケール変換器
+        kmeans (KMeans | MiniBatchKMeans): 学習済みのクラスタリングのモデル（標準化した値で学習したもの）
+        pca (PCA): 学習済みの主成分分析のモデル（可視化に用いる。Noneでもよい）
+        feature_columns (list): 学習に用いた列（順番も学習時と同じであること）
+
+    Returns:
+        model (dict): feature_columns、scaler、kmeans、pcaと、割り当てに用いる重み（weights）、定数項（bias）
+    """
+    centers = kmeans.cluster_centers_
+    weights = (centers / scaler.scale_).T
+    bias = (centers**2).sum(axis=1) + 2 * scaler.mean_ @ weights
+    return {
+        "feature_columns": list(feature_columns),
+        "scaler": scaler,
+        "kmeans": kmeans,
+        "pca": pca,
+        "weights": 2 * weights,
+        "bias": bias,
+    }
+
+
+def save_segment_model(path: str, model: dict) -> None:
+    """
+    build_segment_modelでまとめたモデルを保存する
+
+    Args:
+        path (str): 保存先のパス
+        model (dict): build_segment_modelでまとめたモデル
+    """
+    # 書き込み途中のファイルが読まれないよう、一時ファイルに書き込んでから置き換える
+    pd.to_pickle(model, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_segment_model(path: str) -> dict:
+    """
+    save_segment_modelで保存したモデルを読み込む
+
+    Args:
+        path (str): 保存したパス
+
+    Returns:
+        model (dict): build_segment_modelでまとめたモデル
+    """
+    return pd.read_pickle(path)
+
+
+def _feature_matrix(features, model: dict) -> np.ndarray:
+    """
+    顧客毎の特徴量をmodelのfeature_columnsの順の行列にする
+    欠損値や無限大の値があるとクラスター番号等が正しく求まらないため、エラーとする
+    """
+    if isinstance(features, pd.DataFrame):
+        features = features[model["feature_columns"]]
+    X = np.asarray(features, dtype=np.float64)
+    is_finite = np.isfinite(X).all(axis=1)
+    if not is_finite.all():
+        raise ValueError(
+            f"特徴量に欠損値または無限大の値がある顧客があります: {(~is_finite).sum()}件"
+        )
+    return X
+
+
+def assign_segments(features, model: dict) -> np.ndarray:
+    """
+    学習し直さずに、保存したモデルで顧客にクラスター番号を割り当てる（kmeans.predict(scaler.transform(...))と同じ結果になる）
+    標準化を含めた重みとの行列積と、定数項との差の最小値をとるだけで求める
+
+    Args:
+        features (pd.DataFrame | np.ndarray): 顧客毎の特徴量（DataFrameの場合はmodelのfeature_columns列を用いる。
+            配列の場合は列がfeature_columnsと同じ順番であること。欠損値や無限大の値がある場合はValueError）
+        model (dict): build_segment_modelでまとめたモデル
+
+    Returns:
+        labels (np.ndarray): 顧客毎のクラスター番号
+    """
+    X = _feature_matrix(features, model)
+    return np.argmin(model["bias"] - X @ model["weights"], axis=1).astype(np.int32)
+
+
+def fit_streaming_pca(
+    read_chunks: Callable[[], Iterator[pd.DataFrame]],
+    feature_columns: list,
+    scaler: StandardScaler,
+    n_components: int = 2,
+) -> IncrementalPCA:
+    """
+    データをチャンク毎に読み込みながら、標準化した値の主成分分析のモデルを作成する（partial_fitで主成分を更新する）
+
+    Args:
+        read_chunks (Callable[[], Iterator[pd.DataFrame]]): 呼び出す度にデータのチャンクを先頭から順に返す関数
+            （各チャンクはn_components行以上であること）
+        feature_columns (list): 主成分分析に用いる列
+        scaler (StandardScaler): 学習済みのスケール変換器
+        n_components (int): 主成分の数
+
+    Returns:
+        pca (IncrementalPCA): 主成分分析のモデル
+    """
+    pca = IncrementalPCA(n_components=n_components)
+    for chunk in read_chunks():
+        pca.partial_fit(
+            scaler.transform(chunk[feature_columns].to_numpy(dtype=np.float64))
+        )
+    return pca
+
+
+def project_segments(features, model: dict) -> np.ndarray:
+    """
+    保存したモデルで、顧客毎の特徴量を標準化して主成分空間に射影する（pca.transform(scaler.transform(...))と同じ値になる）
+
+    Args:
+        features (pd.DataFrame | np.ndarray): 顧客毎の特徴量（assign_segmentsと同じ）
+        model (dict): build_segment_modelでまとめたモデル（pcaが学習済みであること）
+
+    Returns:
+        projection (np.ndarray): 顧客毎の主成分得点（顧客数 × 主成分の数）
+    """
+    X = _feature_matrix(features, model)
+    scaler = model["scaler"]
+    pca = model["pca"]
+    return ((X - scaler.mean_) / scaler.scale_ - pca.mean_) @ pca.components_.T
+
+
+def density_map(
+    read_chunks: Callable[[], Iterable[pd.DataFrame]],
+    model: dict,
+    bins: int = 300,
+    extent: tuple = None,
+) -> tuple[np.ndarray, tuple]:
+    """
+    顧客を第1・第2主成分の平面に射影し、平面を格子に区切って格子毎・クラスター毎の顧客数を集計する
+    集計結果の大きさは格子の数とクラスター数のみで決まるため、顧客数によらず一定のメモリと時間で描画できる
+
+    Args:
+        read_chunks (Callable[[], Iterable[pd.DataFrame]]): 呼び出す度にデータのチャンクを先頭から順に返す関数
+            （全てのデータを1つのチャンクとしてもよい）
+        model (dict): build_segment_modelでまとめたモデル（pcaが学習済みであること）
+        bins (int): 各軸の格子の数
+        extent (tuple): 集計する範囲（第1主成分の最小値、最大値、第2主成分の最小値、最大値）
+            （Noneの場合はデータを1回走査して求める。範囲外の顧客は集計しない）
+
+    Returns:
+        counts (np.ndarray): クラスター × 第1主成分の格子 × 第2主成分の格子毎の顧客数
+        extent (tuple): 集計した範囲
+    """
+    if extent is None:
+        lower = np.full(2, np.inf)
+        upper = np.full(2, -np.inf)
+        for chunk in read_chunks():
+            projection = project_segments(chunk, model)[:, :2]
+            lower = np.minimum(lower, projection.min(axis=0))
+            upper = np.maximum(upper, projection.max(axis=0))
+        extent = (lower[0], upper[0], lower[1], upper[1])
+
+    n_clusters = len(model["bias"])
+    counts = np.zeros((n_clusters, bins, bins), dtype=np.int64)
+    for chunk in read_chunks():
+        projection = project_segments(chunk, model)[:, :2]
+        labels = assign_segments(chunk, model)
+        for cluster in range(n_clusters):
+            is_cluster = labels == cluster
+            counts[cluster] += np.histogram2d(
+                projection[is_cluster, 0],
+                projection[is_cluster, 1],
+                bins=bins,
+                range=[extent[:2], extent[2:]],
+            )[0].astype(np.int64)
+    return counts, extent
+
+
+def density_image(counts: np.ndarray, colors: list) -> np.ndarray:
+    """
+    density_mapの集計結果を、格子毎に最も顧客数の多いクラスターの色で、顧客数が多いほど濃く塗った画像にする
+    （濃さは顧客数の対数に比例させ、顧客数の少ない格子も見えるようにする）
+
+    Args:
+        counts (np.ndarray): density_mapで集計した顧客数
+        colors (list): クラスター番号毎の色（RGBの値（0〜1）のタプル）
+
+    Returns:
+        image (np.ndarray): 第2主成分の格子 × 第1主成分の格子 × RGBA（plt.imshowにorigin="lower"で渡す）
+    """
+    total = counts.sum(axis=0)
+    image = np.zeros(total.shape + (4,))
+    image[..., :3] = np.asarray(colors, dtype=np.float64)[:, :3][counts.argmax(axis=0)]
+    image[..., 3] = np.log1p(total) / np.log1p(max(total.max(), 1))
+    return image.transpose(1, 0, 2)
@@ -1,45 +1,53 @@
 # %%
 import os
+import sys
 import pandas as pd
-from dateutil.relativedelta import relativedelta
 from sklearn.tree import DecisionTreeClassifier, export_graphviz
 import sklearn.model_selection
 import graphviz
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import (
+    read_csv_cached,
+    read_customer_features,
+    to_month_key,
+    month_str_to_key,
+    add_months,
+    months_between,
+    build_lag_features,
+)
+
 # データの読み込み
 # 顧客行動データ
-customer = pd.read_csv("input/join_customer_data.csv")
+# 第3章で作成した顧客の特徴量ストアから型を保ったまま読み込む場合はTrueにする（Falseの場合はcsvから読み込む）
+use_feature_store = False
+feature_store_dir = "../Chapter3/output/customer_feature_store"
+if use_feature_store:
+    customer = read_customer_features(feature_store_dir)
+else:
+    customer = read_csv_cached(
+        "input/join_customer_data.csv", parse_dates=["start_date", "end_date"]
+    )
 customer.head()
 
 # %%
 # 顧客毎の月別の利用回数データ
-monthly_use_log = pd.read_csv("input/use_log_months.csv")
+monthly_use_log = read_csv_cached("input/use_log_months.csv")
 monthly_use_log.head()
 
 # %%
 # 当月と過去1ヶ月の利用回数を集計したデータの作成
 # 6ヶ月未満で退会する顧客もいるため、予測に用いる過去の利用履歴データの期間を第４章より短くする
-year_months = list(monthly_use_log["usemonth"].unique())
-
-use_log = pd.DataFrame()
-
 # 過去1ヶ月のデータがある2018年5月以降のデータで作成する
-for i in range(1, len(year_months)):
-    tmp = monthly_use_log[monthly_use_log["usemonth"] == year_months[i]].copy()
-    tmp.rename(columns={"count": "count_0"}, inplace=True)
-
-    tmp_before = monthly_use_log[
-        monthly_use_log["usemonth"] == year_months[i - 1]
-    ].copy()
-    tmp_before.drop("usemonth", axis=1, inplace=True)
-    tmp_before.rename(columns={"count": "count_1"}, inplace=True)
-
-    tmp = pd.merge(tmp, tmp_before, how="left", on="customer_id")
-
-    use_log = pd.concat([use_log, tmp], ignore_index=True)
+use_log = build_lag_features(
+    monthly_use_log, lag_columns=["count_1"], target_column="count_0"
+)
 
+# 結合に用いるため、年月を整数の月キーに変換しておく
+use_log["usemonth_key"] = month_str_to_key(use_log["usemonth"])
 use_log.head()
 
 # %%
@@ -51,31 +59,24 @@ exit_customer = customer[customer["is_deleted"] == 1].copy()
 
 # 2.退会日（end_date）の1ヶ月前の年月データ（exit_month）列を作成する
 # 2-1.退会日（end_date）の1ヶ月前の日付データ（exit_date）列を作成する
-exit_customer["exit_date"] = None
+# （月末の日付は前月の末日にする。relativedelta(months=1)を引いた場合と同じ結果になる）
 exit_customer["end_date"] = pd.to_datetime(exit_customer["end_date"])
 exit_customer.reset_index(drop=True, inplace=True)
+exit_customer["exit_date"] = add_months(exit_customer["end_date"], -1)
 
-for i in range(len(exit_customer)):
-    exit_customer.loc[i, "exit_date"] = exit_customer.loc[
-        i, "end_date"
-    ] - relativedelta(months=1)
-
-# 2-2.exit_dateをdatetime型に変換する
-exit_customer["exit_date"] = pd.to_datetime(exit_customer["exit_date"])
-
-# 2-3.exit_dateの日付を年月に変換したデータ列（exit_month）を作成する
-exit_customer["exit_month"] = exit_customer["exit_date"].dt.strftime("%Y-%m")
+# 2-2.exit_dateの日付を年月の月キーに変換したデータ列（exit_month_key）を作成する
+exit_customer["exit_month_key"] = to_month_key(exit_customer["exit_date"])
 
 # 3.顧客行動データ（use_log）と作成した退会済みの顧客の行動データ（exit_customer）を結合する
 exit_use_log = pd.merge(
     use_log,
     exit_customer,
     how="left",
-    left_on=["customer_id", "usemonth"],
-    right_on=["customer_id", "exit_month"],
+    left_on=["customer_id", "usemonth_key"],
+    right_on=["customer_id", "exit_month_key"],
 )
 
-exit_use_log.drop("exit_month", axis=1, inplace=True)
+exit_use_log.drop("exit_month_key", axis=1, inplace=True)
 print(len(use_log))
 
 exit_use_log.head()
@@ -131,13 +132,9 @@ predict_data["now_date"] = pd.to_datetime(predict_data["usemonth"], format="%Y-%
 predict_data["start_date"] = pd.to_datetime(predict_data["start_date"])
 
 # 3.予測月までの会員期間（membership_period: now_dateとstart_dateの差分）を計算する)
-predict_data["membership_period"] = 0
-
-for i in range(len(predict_data)):
-    delta = relativedelta(
-        predict_data.loc[i, "now_date"], predict_data.loc[i, "start_date"]
-    )
-    predict_data.loc[i, "membership_period"] = int(delta.years * 12 + delta.months)
+predict_data["membership_period"] = months_between(
+    predict_data["now_date"], predict_data["start_date"]
+)
 
 predict_data.head()
 
@@ -1,31 +1,36 @@
 # %%
 import os
+import sys
 import pandas as pd
 import networkx as nx
 import numpy as np
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import read_csv_cached
+
 # %%
 # データの読み込み
 # %%
 # 1.工場データ
-factories = pd.read_csv("input/tbl_factory.csv", index_col=0)
+factories = read_csv_cached("input/tbl_factory.csv", index_col=0)
 factories.head()
 
 # %%
 # 2.倉庫データ
-warehouses = pd.read_csv("input/tbl_warehouse.csv", index_col=0)
+warehouses = read_csv_cached("input/tbl_warehouse.csv", index_col=0)
 warehouses.head()
 
 # %%
 # 3.コストデータ
-cost = pd.read_csv("input/rel_cost.csv", index_col=0)
+cost = read_csv_cached("input/rel_cost.csv", index_col=0)
 cost.head()
 
 # %%
 # 4.輸送実績
-transactions = pd.read_csv("input/tbl_transaction.csv", index_col=0)
+transactions = read_csv_cached("input/tbl_transaction.csv", index_col=0)
 transactions.head()
 
 # %%
@@ -109,12 +114,12 @@ print(f'東北支社の平均輸送コスト:{cost_check.loc[cost_check["FCRegio
 
 # %%
 # 各倉庫から工場への輸送ルートデータ読み込み
-trans_route = pd.read_csv("input/trans_route.csv", index_col="工場")
+trans_route = read_csv_cached("input/trans_route.csv", index_col="工場")
 trans_route.head()
 # %%
 # 各輸送ルートの輸送量データを可視化する
 # ノード座標の読み込み
-trans_route_pos = pd.read_csv("input/trans_route_pos.csv")
+trans_route_pos = read_csv_cached("input/trans_route_pos.csv")
 trans_route_pos.head()
 
 # %%
@@ -161,7 +166,7 @@ nx.draw(
 # %%
 # 輸送コストを計算する関数を作成する
 # 各倉庫から工場への輸送コストデータ読み込み
-trans_cost = pd.read_csv("input/trans_cost.csv", index_col="工場")
+trans_cost = read_csv_cached("input/trans_cost.csv", index_col="工場")
 trans_cost.head()
 
 
@@ -186,12 +191,12 @@ print(f"総輸送コスト:{calc_trans_cost(trans_route, trans_cost)}")
 # 制約条件を作る
 # 1.データの読み込み
 # 1-1.各工場の最小生産数
-factory_min_demand = pd.read_csv("input/demand.csv")
+factory_min_demand = read_csv_cached("input/demand.csv")
 factory_min_demand
 
 # %%
 # 1-2.各倉庫が供給可能な最大部品数
-warehouse_max_supply = pd.read_csv("input/supply.csv")
+warehouse_max_supply = read_csv_cached("input/supply.csv")
 warehouse_max_supply
 
 # %%
@@ -223,7 +228,7 @@ for i in range(len(warehouse_max_supply.columns)):
 # %%
 # 輸送ルートを変更して総輸送コストの変化を確認する
 # 変更後ルートデータの読み込み
-new_trans_route = pd.read_csv("input/trans_route_new.csv", index_col="工場")
+new_trans_route = read_csv_cached("input/trans_route_new.csv", index_col="工場")
 new_trans_route
 
 # %%
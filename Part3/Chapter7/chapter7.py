@@ -1,6 +1,7 @@
 # %%
 import numpy as np
 import os
+import sys
 import pandas as pd
 from itertools import product
 from pulp import LpProblem, LpVariable, lpSum, lpDot, value, const
@@ -8,20 +9,24 @@ import networkx as nx
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import read_csv_cached
+
 # %%
 # 1.データ読み込み
 # 1-1.各倉庫から工場への輸送コストデータ
-trans_cost = pd.read_csv("input/trans_cost.csv", index_col="工場")
+trans_cost = read_csv_cached("input/trans_cost.csv", index_col="工場")
 trans_cost.head()
 
 # %%
 # 1-2.各工場の必要最低生産数データ
-min_factory_demand = pd.read_csv("input/demand.csv")
+min_factory_demand = read_csv_cached("input/demand.csv")
 min_factory_demand
 
 # %%
 # 1-3.各倉庫の最大供給可能部品数データ
-max_warehouse_supply = pd.read_csv("input/supply.csv")
+max_warehouse_supply = read_csv_cached("input/supply.csv")
 max_warehouse_supply
 
 # %%
@@ -89,7 +94,7 @@ print(trans_route_solved)
 print(f"最適化ルートの総輸送コスト:{total_cost}")
 # %%
 # ノード座標の読み込み
-trans_route_pos = pd.read_csv("input/trans_route_pos.csv")
+trans_route_pos = read_csv_cached("input/trans_route_pos.csv")
 trans_route_pos.head()
 # %%
 # グラフオブジェクトの作成
@@ -179,20 +184,20 @@ print(
 # 生産計画に関するデータを読み込む
 # %%
 # 1.製品の製造に必要な原料の割合
-material = pd.read_csv("input/product_plan_material.csv", index_col="製品")
+material = read_csv_cached("input/product_plan_material.csv", index_col="製品")
 material
 
 # %%
 # 2.製品の利益
-profit = pd.read_csv("input/product_plan_profit.csv", index_col="製品")
+profit = read_csv_cached("input/product_plan_profit.csv", index_col="製品")
 profit
 # %%
 # 3.原料の在庫
-stock = pd.read_csv("input/product_plan_stock.csv", index_col="項目")
+stock = read_csv_cached("input/product_plan_stock.csv", index_col="項目")
 stock
 # %%
 # 4.製品の生産量
-product_plan = pd.read_csv("input/product_plan.csv", index_col="製品")
+product_plan = read_csv_cached("input/product_plan.csv", index_col="製品")
 product_plan
 
 
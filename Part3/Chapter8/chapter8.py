@@ -1,5 +1,6 @@
 # %%
 import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -7,10 +8,23 @@ import networkx as nx
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# 共通モジュール（リポジトリ直下のcommon）を読み込めるようにする
+sys.path.append(os.path.abspath("../.."))
+from common import read_csv_cached
+from percolation import (
+    links_to_csr,
+    simulate_percolation_csr,
+    simulate_n_members_csr,
+    simulate_n_members_ensemble,
+    summarize_ensemble,
+)
+from phase_diagram import sweep_phase_diagram
+from estimation import estimate_probabilities
+
 # %%
 # 人間関係のネットワークを可視化する
 # データ読み込み
-df_links = pd.read_csv("input/links.csv")
+df_links = read_csv_cached("input/links.csv")
 df_links
 # %%
 # グラフオブジェクトの作成
@@ -79,6 +93,9 @@ def simulate_percolation(
 percent_percolation = 0.1
 n_t = 100
 
+# 結果を再現できるよう乱数のシードを固定する
+np.random.seed(0)
+
 # アクティブユーザーリストを初期化（ユーザー0のみactiveにする）
 list_active = np.zeros(n_repeaters)
 list_active[0] = 1
@@ -91,6 +108,30 @@ for t in range(1, n_t + 1):
     list_active = simulate_percolation(n_repeaters, list_active, percent_percolation)
     list_timeseries.append(list_active.copy())
 
+# %%
+# 隣接行列をCSR形式に変換して口コミの伝播を高速にシミュレートする
+# （活性化しているノードの辺のみを対象に、まとめて乱数を生成する）
+adjacency = links_to_csr(df_links)
+
+np.random.seed(0)
+list_active = np.zeros(n_repeaters)
+list_active[0] = 1
+
+list_timeseries_csr = []
+list_timeseries_csr.append(list_active.copy())
+
+for t in range(1, n_t + 1):
+    list_active = simulate_percolation_csr(adjacency, list_active, percent_percolation)
+    list_timeseries_csr.append(list_active.copy())
+
+# 同じシードの下でsimulate_percolationと同じ結果になることを確認する
+print(
+    all(
+        np.array_equal(lst, lst_csr)
+        for lst, lst_csr in zip(list_timeseries, list_timeseries_csr)
+    )
+)
+
 
 # %%
 # 伝播した口コミの様子を可視化する
@@ -204,32 +245,42 @@ plt.plot(list_timeseries_num)
 n_t = 100
 n_join_conditions = 20
 n_cancel_conditions = 20
-# 各入会確率と退会確率下でのn_tヶ月後の会員数を格納する配列の作成
-phaseDiagram = np.zeros((n_join_conditions, n_cancel_conditions))
-
 # 初期の会員リスト（initial_list_active）の作成
 initial_list_active = np.zeros(n_people)
 initial_list_active[0] = 1
 
-for i_join in range(n_join_conditions):
-    # 入会確率を5%刻みで変化させる
-    join_probability = 0.05 * i_join
-
-    for i_cancel in range(n_cancel_conditions):
-        # 退会確率を5%刻みで変化させる
-        cancel_probability = 0.05 * i_cancel
-
-        # 会員リスト（list_active）の初期化
-        list_active = initial_list_active.copy()
-
-        # n_tヶ月後の会員数をシミュレートする
-        for t in range(n_t):
-            list_active = simulate_n_members(
-                n_people, list_active, join_probability, cancel_probability, df_links
-            )
-        phaseDiagram[i_join, i_cancel] = sum(list_active)
+# %%
+# 入会確率と退会確率をそれぞれ5%刻みで変化させた各組について、n_tヶ月後の会員数をプロセスプールで並列に計算する
+# 計算済みのセルはcsvに追記していくので、中断しても再実行すれば残りのセルのみを計算する
+# 相の境界付近（4隅の会員数の差が大きい区画）は格子を2回まで細かくして計算する
+if not os.path.exists("output"):
+    # ディレクトリが存在しない場合、ディレクトリを作成する
+    os.makedirs("output")
+
+join_grid = 0.05 * np.arange(n_join_conditions)
+cancel_grid = 0.05 * np.arange(n_cancel_conditions)
+phase_diagram_data = sweep_phase_diagram(
+    adjacency,
+    initial_list_active,
+    list(join_grid),
+    list(cancel_grid),
+    n_t,
+    checkpoint_path="output/phase_diagram.csv",
+    n_refinements=2,
+)
+phase_diagram_data
 
 # %%
+# 細かくする前の5%刻みの格子のセルから、各入会確率と退会確率下でのn_tヶ月後の会員数の配列を作成する
+# （チェックポイントのcsvから読み込んだ確率は小数の最後の桁がずれることがあるため、丸めてから対応づける）
+phaseDiagram = (
+    phase_diagram_data.round({"join_probability": 10, "cancel_probability": 10})
+    .set_index(["join_probability", "cancel_probability"])["n_members"]
+    .reindex(pd.MultiIndex.from_product([join_grid.round(10), cancel_grid.round(10)]))
+    .to_numpy()
+    .reshape(n_join_conditions, n_cancel_conditions)
+)
+
 plt.matshow(phaseDiagram)
 plt.colorbar(shrink=0.8)
 plt.xlabel("cancel_probability")
@@ -239,16 +290,32 @@ plt.yticks(np.arange(0.0, 20.0, 5), np.arange(0.0, 1.0, 0.25))
 plt.tick_params(bottom=False, left=False, right=False, top=False)
 plt.show()
 # %%
+# 細かくしたセルも含めて可視化する
+plt.scatter(
+    phase_diagram_data["cancel_probability"],
+    phase_diagram_data["join_probability"],
+    c=phase_diagram_data["n_members"],
+    marker="s",
+    s=10,
+)
+plt.colorbar(shrink=0.8)
+plt.xlabel("cancel_probability")
+plt.ylabel("join_probability")
+plt.show()
+# %%
 # スポーツジム会員全体のシミュレーション
 # %%
 # 1.データ読み込み
 # %%
 # ジム会員同士のSNSの繋がり有無テーブル
-df_member_links = pd.read_csv("input/links_members.csv")
+df_member_links = read_csv_cached("input/links_members.csv")
 df_member_links.head()
 # %%
+# シミュレーション用にCSR形式の隣接行列に変換しておく
+member_adjacency = links_to_csr(df_member_links)
+# %%
 # 各ジム会員の過去24ヶ月のジム利用状況テーブル
-df_member_info = pd.read_csv("input/info_members.csv")
+df_member_info = read_csv_cached("input/info_members.csv")
 df_member_info.head()
 # %%
 # 2.各会員のリンク数のヒストグラムを作成する
@@ -314,6 +381,22 @@ for t in range(n_t - 1):
 estimated_join_probability = count_link_to_active / count_link
 print(f"推定活性化確率:{estimated_join_probability}")
 # %%
+# 3-3.月毎の推定値と95%信頼区間を求める
+# 各会員の繋がりのある会員のうち利用した人数を、隣接行列と利用有無の行列の積で全ての月についてまとめて計算する
+member_estimation = estimate_probabilities(
+    member_adjacency, df_member_info.iloc[:, 1:].to_numpy(), confidence=0.95
+)
+# 全期間で集計すると、3-1、3-2の推定値と一致する
+print(
+    "推定非活性化確率:"
+    f"{member_estimation['count_active_to_inactive'].sum() / member_estimation['count_active'].sum()}"
+)
+print(
+    "推定活性化確率:"
+    f"{member_estimation['count_link_to_active'].sum() / member_estimation['count_link'].sum()}"
+)
+member_estimation
+# %%
 # 実データとシミュレーションを比較する
 # 推定した活性化、非活性化確率を入会、退会確率に代入する
 join_probability = estimated_join_probability
@@ -324,7 +407,7 @@ n_t = 24
 n_members = len(df_member_info.index)
 
 # 初期の会員リスト（initial_list_active）の作成
-initial_list_active = np.zeros(n_people)
+initial_list_active = np.zeros(n_members)
 initial_list_active[0] = 1
 
 # シミュレーション結果を格納する配列
@@ -333,8 +416,8 @@ list_active = initial_list_active.copy()
 list_timeseries.append(list_active.copy())
 
 for t in range(n_t):
-    list_active = simulate_n_members(
-        n_people, list_active, join_probability, cancel_probability, df_member_links
+    list_active = simulate_n_members_csr(
+        member_adjacency, list_active, join_probability, cancel_probability
     )
     list_timeseries.append(list_active.copy())
 
@@ -352,6 +435,40 @@ plt.ylabel("population")
 plt.legend(loc="lower right")
 plt.show()
 # %%
+# 1回のシミュレーションはばらつきが大きいため、1000回分の試行をまとめてシミュレートし分布で比較する
+n_replicas = 1000
+ensemble_timeseries_num = simulate_n_members_ensemble(
+    member_adjacency,
+    initial_list_active,
+    join_probability,
+    cancel_probability,
+    n_t,
+    n_replicas,
+    random_state=0,
+)
+# 各月の会員数の平均値と5%、50%、95%点、実際の最終月の会員数に初めて到達する月の分布を集計する
+ensemble_summary, ensemble_hitting = summarize_ensemble(
+    ensemble_timeseries_num,
+    quantiles=[0.05, 0.5, 0.95],
+    thresholds=[list_timeseries_num_real[-1]],
+)
+ensemble_hitting
+# %%
+# 可視化
+plt.fill_between(
+    ensemble_summary.index,
+    ensemble_summary["q0.05"],
+    ensemble_summary["q0.95"],
+    alpha=0.3,
+    label="simulated (5%-95%)",
+)
+plt.plot(ensemble_summary["mean"], label="simulated (mean)")
+plt.plot(list_timeseries_num_real, label="real")
+plt.xlabel("month")
+plt.ylabel("population")
+plt.legend(loc="lower right")
+plt.show()
+# %%
 # シミュレーション条件
 n_t = 36
 
@@ -361,8 +478,8 @@ list_active = initial_list_active.copy()
 list_timeseries.append(list_active.copy())
 
 for t in range(n_t):
-    list_active = simulate_n_members(
-        n_people, list_active, join_probability, cancel_probability, df_member_links
+    list_active = simulate_n_members_csr(
+        member_adjacency, list_active, join_probability, cancel_probability
     )
     list_timeseries.append(list_active.copy())
 
@@ -376,3 +493,31 @@ plt.ylabel("population")
 plt.legend(loc="lower right")
 plt.show()
 # %%
+# 1000回分の試行で36ヶ月後までの会員数の分布を予測する
+ensemble_timeseries_num = simulate_n_members_ensemble(
+    member_adjacency,
+    initial_list_active,
+    join_probability,
+    cancel_probability,
+    n_t,
+    n_replicas,
+    random_state=0,
+)
+ensemble_summary, _ = summarize_ensemble(
+    ensemble_timeseries_num, quantiles=[0.05, 0.5, 0.95]
+)
+
+# 可視化
+plt.fill_between(
+    ensemble_summary.index,
+    ensemble_summary["q0.05"],
+    ensemble_summary["q0.95"],
+    alpha=0.3,
+    label="simulated (5%-95%)",
+)
+plt.plot(ensemble_summary["mean"], label="simulated (mean)")
+plt.xlabel("month")
+plt.ylabel("population")
+plt.legend(loc="lower right")
+plt.show()
+# %%
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.stats import norm
+
+
+def _wilson_interval(
+    count_success: np.ndarray, count_trial: np.ndarray, confidence: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    二項分布の成功確率のWilsonスコア信頼区間を計算する（試行回数が0の場合はNaN）
+
+    Args:
+        count_success (np.ndarray): 成功回数
+        count_trial (np.ndarray): 試行回数
+        confidence (float): 信頼係数
+
+    Returns:
+        lower (np.ndarray): 信頼区間の下限
+        upper (np.ndarray): 信頼区間の上限
+    """
+    z = norm.ppf(0.5 + confidence / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = count_success / count_trial
+        denominator = 1 + z**2 / count_trial
+        center = (p + z**2 / (2 * count_trial)) / denominator
+        half_width = (
+            z
+            * np.sqrt(p * (1 - p) / count_trial + z**2 / (4 * count_trial**2))
+            / denominator
+        )
+    return center - half_width, center + half_width
+
+
+def estimate_probabilities(
+    adjacency: sp.csr_matrix, activity: np.ndarray, confidence: float = 0.95
+) -> pd.DataFrame:
+    """
+    利用履歴から、月毎の非活性化（利用した翌月に利用しなくなる）確率と
+    活性化（利用しなかった翌月に利用する）確率をその信頼区間とともに推定する
+
+    chapter8.pyのcount_link、count_link_to_activeと同じ数え方をする。
+    対象月に利用しなかった会員について、繋がりのある会員のうち対象月に利用した人数をmとすると、
+    翌月に利用した場合はcount_link、count_link_to_activeともに1（m >= 1のとき）、
+    翌月も利用しなかった場合はcount_linkのみm増える。
+    mは全ての月について隣接行列と利用有無の行列の積でまとめて計算する
+
+    Args:
+        adjacency (sp.csr_matrix): 会員同士の隣接行列（percolation.links_to_csr等で作成したもの）
+        activity (np.ndarray): 各会員の各月の利用有無（利用していれば1、していなければ0）の行列（形状は(会員数, 月数)）
+        confidence (float): 信頼区間の信頼係数
+
+    Returns:
+        estimation (pd.DataFrame): 対象月毎（最終月を除く）の集計結果と推定値
+            count_active, count_active_to_inactive: 利用した会員数、そのうち翌月に利用しなかった会員数
+            cancel_probability, cancel_lower, cancel_upper: 非活性化確率の推定値と信頼区間
+            count_link, count_link_to_active: 活性化確率の推定に用いるリンク数、そのうち翌月に利用した数
+            join_probability, join_lower, join_upper: 活性化確率の推定値と信頼区間
+    """
+    activity = np.asarray(activity) == 1
+    is_active = activity[:, :-1]
+    is_active_next = activity[:, 1:]
+
+    # 各会員の、繋がりのある会員のうち対象月に利用した人数（形状は(会員数, 月数 - 1)）
+    n_active_links = adjacency @ is_active.astype(np.float32)
+
+    # 非活性化
+    count_active = is_active.sum(axis=0)
+    count_active_to_inactive = (is_active & ~is_active_next).sum(axis=0)
+
+    # 活性化
+    is_activated = ~is_active & is_active_next
+    is_not_activated = ~is_active & ~is_active_next
+    count_link_to_active = (is_activated & (n_active_links > 0)).sum(axis=0)
+    count_link = count_link_to_active + np.where(
+        is_not_activated, n_active_links, 0
+    ).astype(np.int64).sum(axis=0)
+
+    estimation = pd.DataFrame(
+        {
+            "count_active": count_active,
+            "count_active_to_inactive": count_active_to_inactive,
+            "count_link": count_link,
+            "count_link_to_active": count_link_to_active,
+        }
+    )
+    estimation.index.name = "month"
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estimation["cancel_probability"] = count_active_to_inactive / count_active
+        estimation["join_probability"] = count_link_to_active / count_link
+    estimation["cancel_lower"], estimation["cancel_upper"] = _wilson_interval(
+        count_active_to_inactive, count_active, confidence
+    )
+    estimation["join_lower"], estimation["join_upper"] = _wilson_interval(
+        count_link_to_active, count_link, confidence
+    )
+    return estimation[
+        [
+            "count_active",
+            "count_active_to_inactive",
+            "cancel_probability",
+            "cancel_lower",
+            "cancel_upper",
+            "count_link",
+            "count_link_to_active",
+            "join_probability",
+            "join_lower",
+            "join_upper",
+        ]
+    ]
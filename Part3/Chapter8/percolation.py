@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def links_to_csr(df_links: pd.DataFrame) -> sp.csr_matrix:
+    """
+    繋がり有無テーブルをCSR形式の隣接行列に変換する
+
+    Args:
+        df_links (pd.DataFrame): 1列目がインデックス（Unnamed: 0）、2列目以降が各ノードとの繋がり（繋がりがあれば1、なければ0）のテーブル
+
+    Returns:
+        adjacency (sp.csr_matrix): 繋がりがあれば1を持つ隣接行列（各行の列インデックスは昇順）
+    """
+    adjacency = sp.csr_matrix((df_links.iloc[:, 1:].to_numpy() == 1).astype(np.int8))
+    adjacency.sort_indices()
+    return adjacency
+
+
+def load_links_csr(path: str, chunksize: int = 1000) -> sp.csr_matrix:
+    """
+    繋がり有無テーブルのcsvを分割して読み込み、CSR形式の隣接行列を作成する
+    密行列全体をメモリに載せないため、大規模なネットワークでも読み込める
+
+    Args:
+        path (str): 繋がり有無テーブル（links.csv等）のパス
+        chunksize (int): 一度に読み込む行数
+
+    Returns:
+        adjacency (sp.csr_matrix): 繋がりがあれば1を持つ隣接行列（各行の列インデックスは昇順）
+    """
+    blocks = [
+        links_to_csr(df_chunk) for df_chunk in pd.read_csv(path, chunksize=chunksize)
+    ]
+    adjacency = sp.vstack(blocks, format="csr")
+    adjacency.sort_indices()
+    return adjacency
+
+
+def _edge_layout(
+    adjacency: sp.csr_matrix, sources: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    指定したノードの出ていく辺を、ノード番号順・繋がり先の番号順に並べる
+
+    Args:
+        adjacency (sp.csr_matrix): 隣接行列
+        sources (np.ndarray): 対象ノードの番号（昇順）
+
+    Returns:
+        degrees (np.ndarray): 各対象ノードの辺の数
+        edge_src (np.ndarray): 各辺の繋がり元のノード番号
+        edge_dst (np.ndarray): 各辺の繋がり先のノード番号
+    """
+    starts = adjacency.indptr[sources]
+    degrees = adjacency.indptr[sources + 1] - starts
+    n_edges = degrees.sum()
+    # 各辺がadjacency.indicesの何番目にあたるか（対象ノード毎の先頭位置 + 対象ノード内での順番）
+    offsets = np.repeat(starts - (np.cumsum(degrees) - degrees), degrees)
+    edge_dst = adjacency.indices[offsets + np.arange(n_edges)]
+    edge_src = np.repeat(sources, degrees)
+    return degrees, edge_src, edge_dst
+
+
+def simulate_percolation_csr(
+    adjacency: sp.csr_matrix,
+    list_active: np.ndarray,
+    percent_percolation: float,
+    random_state: np.random.RandomState = None,
+) -> np.ndarray:
+    """
+    口コミの伝播を隣接行列（CSR形式）を用いてシミュレートする
+    chapter8.pyのsimulate_percolationと同じ順番で乱数を消費するため、同じシードなら同じ結果になる
+
+    simulate_percolationはノード番号順にlist_activeを更新しながら走査するため、
+    同じ時刻の中で口コミが伝わった番号の大きいノードからもさらに口コミが伝播する。
+    ここではactiveなノードの全ての辺に対する乱数をまとめて生成し、
+    その途中で番号の大きいノードに口コミが伝わった場合のみ、そのノードの手前まで乱数の状態を巻き戻して続きを計算する
+
+    Args:
+        adjacency (sp.csr_matrix): 隣接行列（links_to_csr、load_links_csrで作成したもの）
+        list_active (np.ndarray): 各リピーター（ノード）に口コミが伝わったかどうかを0,1で表現する配列
+        percent_percolation (float): 口コミが起こる確率
+        random_state (np.random.RandomState): 乱数生成器（Noneの場合はnp.randomのグローバルな乱数生成器を使う）
+
+    Returns:
+        list_active (np.ndarray): 更新した各リピーター（ノード）に口コミが伝わったかどうかを0,1で表現する配列
+    """
+    random_state = np.random if random_state is None else random_state
+    list_active = np.array(list_active, copy=True)
+
+    # 次に走査を始めるノード番号
+    cursor = 0
+    while True:
+        sources = np.flatnonzero(list_active[cursor:] == 1) + cursor
+        degrees, edge_src, edge_dst = _edge_layout(adjacency, sources)
+        n_draws = len(edge_dst)
+        if n_draws == 0:
+            break
+
+        state = random_state.get_state()
+        is_linked = random_state.random_sample(n_draws) <= percent_percolation
+
+        # 走査中のノードより番号の大きいノードに新たに口コミが伝わった場合、そのノードも同じ時刻で口コミを伝播させる
+        is_forward = is_linked & (list_active[edge_dst] != 1) & (edge_dst > edge_src)
+        if not is_forward.any():
+            list_active[edge_dst[is_linked]] = 1
+            break
+
+        # 最初に新たに伝わったノードの手前までの結果のみを採用する
+        next_cursor = edge_dst[is_forward].min()
+        n_accepted = degrees[: np.searchsorted(sources, next_cursor)].sum()
+        random_state.set_state(state)
+        random_state.random_sample(n_accepted)
+
+        list_active[edge_dst[:n_accepted][is_linked[:n_accepted]]] = 1
+        cursor = next_cursor
+
+    return list_active
+
+
+def simulate_n_members_csr(
+    adjacency: sp.csr_matrix,
+    list_member: np.ndarray,
+    join_probability: float,
+    cancel_probability: float,
+    random_state: np.random.RandomState = None,
+) -> np.ndarray:
+    """
+    次の時刻の会員数を隣接行列（CSR形式）を用いてシミュレートする
+    chapter8.pyのsimulate_n_membersと同じ順番（会員毎に、繋がりのある人への拡散、退会の順）で乱数を消費するため、
+    同じシードなら同じ結果になる
+
+    Args:
+        adjacency (sp.csr_matrix): シミュレート対象の人同士の隣接行列（links_to_csr、load_links_csrで作成したもの）
+        list_member (np.ndarray): 現在の、シミュレート対象の人が会員かどうか（会員なら1、非会員なら0）の配列
+        join_probability (float): 口コミが伝わってかつ入会する確率
+        cancel_probability (float): 会員が退会する確率
+        random_state (np.random.RandomState): 乱数生成器（Noneの場合はnp.randomのグローバルな乱数生成器を使う）
+
+    Returns:
+        list_member (np.ndarray): 次の時刻の、シミュレート対象の人が会員かどうかの配列
+    """
+    random_state = np.random if random_state is None else random_state
+    list_member_backup = np.asarray(list_member)
+    list_member = np.array(list_member, copy=True)
+
+    sources = np.flatnonzero(list_member_backup == 1)
+    degrees, edge_src, edge_dst = _edge_layout(adjacency, sources)
+
+    # 会員毎に「各辺の拡散判定（degrees個）、退会判定（1個）」の順に乱数を並べる
+    draws = random_state.random_sample(len(edge_dst) + len(sources))
+    block_starts = np.cumsum(degrees + 1) - (degrees + 1)
+    edge_draw_pos = np.repeat(block_starts, degrees) + (
+        np.arange(len(edge_dst)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    )
+    is_joined = draws[edge_draw_pos] <= join_probability
+    is_canceled = draws[block_starts + degrees] <= cancel_probability
+
+    # 拡散
+    list_member[edge_dst[is_joined]] = 1
+
+    # 消滅
+    # 退会した会員でも、その会員より後に走査される（番号の大きい）会員から拡散されていれば再び会員になる
+    is_rejoined = np.zeros(len(list_member), dtype=bool)
+    is_rejoined[edge_dst[is_joined & (edge_dst < edge_src)]] = True
+    canceled = sources[is_canceled]
+    list_member[canceled] = is_rejoined[canceled]
+
+    return list_member
+
+
+def simulate_n_members_ensemble(
+    adjacency: sp.csr_matrix,
+    initial_list_member: np.ndarray,
+    join_probability: float,
+    cancel_probability: float,
+    n_t: int,
+    n_replicas: int,
+    random_state: np.random.Generator = None,
+    batch_size: int = 1000,
+) -> np.ndarray:
+    """
+    独立なn_replicas回分の会員数の時系列変化をまとめてシミュレートする
+    各試行の会員状態を(試行数, 人数)の行列で持ち、隣接行列は全試行で共有する
+
+    繋がりのあるm人の会員から口コミが伝わって入会する確率は 1 - (1 - join_probability)^m なので、
+    会員の人数を隣接行列との積で数え、1人につき1回の乱数で入会を判定する。
+    simulate_n_membersと同様に、退会した会員でも番号の大きい会員から拡散されていれば再び会員になるため、
+    番号の小さい会員からの拡散（退会判定の前）と大きい会員からの拡散（退会判定の後）を分けて数える。
+    結果はsimulate_n_membersを繰り返し実行した場合と同じ分布になる
+
+    Args:
+        adjacency (sp.csr_matrix): シミュレート対象の人同士の隣接行列（links_to_csr、load_links_csrで作成したもの）
+        initial_list_member (np.ndarray): 初期の、シミュレート対象の人が会員かどうか（会員なら1、非会員なら0）の配列
+        join_probability (float): 口コミが伝わってかつ入会する確率
+        cancel_probability (float): 会員が退会する確率
+        n_t (int): シミュレートする時刻の数
+        n_replicas (int): 試行回数
+        random_state (np.random.Generator): 乱数生成器（Noneまたは整数の場合はnp.random.default_rngで作成する）
+        batch_size (int): 一度にシミュレートする試行数の上限（メモリ使用量は batch_size × 人数 に比例する）
+
+    Returns:
+        list_timeseries_num (np.ndarray): 各時刻、各試行の会員数の配列（形状は(n_t + 1, n_replicas)）
+    """
+    random_state = np.random.default_rng(random_state)
+    n_people = adjacency.shape[0]
+
+    # 繋がり先から見た、番号の小さい（自身を含む）繋がり元と大きい繋がり元の隣接行列
+    adjacency_early_t = sp.triu(adjacency, k=0).T.tocsr().astype(np.float32)
+    adjacency_late_t = sp.tril(adjacency, k=-1).T.tocsr().astype(np.float32)
+
+    # 繋がりのある会員数がm人のときに入会する確率の表
+    # 繋がりのある会員数は各人（列）への繋がり元の数で数えるため、表の大きさは列毎の非ゼロ要素数の最大値で決める
+    max_degree = int(adjacency.getnnz(axis=0).max(initial=0))
+    join_probability_table = (
+        1 - (1 - join_probability) ** np.arange(max_degree + 1)
+    ).astype(np.float32)
+
+    initial_member = np.asarray(initial_list_member) == 1
+    list_timeseries_num = np.zeros((n_t + 1, n_replicas))
+
+    for start in range(0, n_replicas, batch_size):
+        n_batch = min(batch_size, n_replicas - start)
+        members = np.tile(initial_member, (n_batch, 1))
+        list_timeseries_num[0, start : start + n_batch] = members.sum(axis=1)
+
+        for t in range(1, n_t + 1):
+            # 各人について繋がりのある会員数を数える（形状は(試行数, 人数)）
+            members_t = members.T.astype(np.float32)
+            n_early = (adjacency_early_t @ members_t).T.astype(np.int32)
+            n_late = (adjacency_late_t @ members_t).T.astype(np.int32)
+
+            is_joined_early = (
+                random_state.random((n_batch, n_people), dtype=np.float32)
+                < join_probability_table[n_early]
+            )
+            is_joined_late = (
+                random_state.random((n_batch, n_people), dtype=np.float32)
+                < join_probability_table[n_late]
+            )
+            is_canceled = members & (
+                random_state.random((n_batch, n_people), dtype=np.float32)
+                <= cancel_probability
+            )
+
+            # 拡散
+            next_members = members | is_joined_early | is_joined_late
+            # 消滅（番号の大きい会員から拡散されていれば会員のまま）
+            next_members[is_canceled] = is_joined_late[is_canceled]
+
+            members = next_members
+            list_timeseries_num[t, start : start + n_batch] = members.sum(axis=1)
+
+    return list_timeseries_num
+
+
+def summarize_ensemble(
+    list_timeseries_num: np.ndarray,
+    quantiles: tuple = (0.05, 0.5, 0.95),
+    thresholds: tuple = (),
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    simulate_n_members_ensembleの結果から、各時刻の会員数の平均値と分位点、
+    会員数が初めて閾値以上になる時刻の分布を集計する
+
+    Args:
+        list_timeseries_num (np.ndarray): 各時刻、各試行の会員数の配列（形状は(時刻数, 試行数)）
+        quantiles (tuple): 集計する分位点
+        thresholds (tuple): 到達時刻の分布を集計する会員数の閾値
+
+    Returns:
+        summary (pd.DataFrame): 各時刻の会員数の平均値（mean）と分位点（q0.05等）
+        hitting (pd.DataFrame): 各時刻に会員数が初めて閾値以上になった試行の割合（列は閾値。一度も到達しなかった割合はindexがNoneの行）
+    """
+    summary = pd.DataFrame(
+        np.quantile(list_timeseries_num, quantiles, axis=1).T,
+        columns=[f"q{q}" for q in quantiles],
+    )
+    summary.insert(0, "mean", list_timeseries_num.mean(axis=1))
+    summary.index.name = "month"
+
+    n_months, n_replicas = list_timeseries_num.shape
+    hitting = pd.DataFrame(index=list(range(n_months)) + [None])
+    hitting.index.name = "month"
+    for threshold in thresholds:
+        is_reached = list_timeseries_num >= threshold
+        # 一度も到達しなかった試行は到達時刻をn_months（Noneの行）とする
+        first_month = np.where(
+            is_reached.any(axis=0), is_reached.argmax(axis=0), n_months
+        )
+        hitting[threshold] = (
+            np.bincount(first_month, minlength=n_months + 1) / n_replicas
+        )
+
+    return summary, hitting
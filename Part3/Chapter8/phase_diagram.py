@@ -0,0 +1,258 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from common import can_fork_workers
+from percolation import simulate_n_members_ensemble
+
+# チェックポイントのcsvの列
+CHECKPOINT_COLUMNS = [
+    "join_probability",
+    "cancel_probability",
+    "n_t",
+    "n_replicas",
+    "seed",
+    "graph_hash",
+    "n_members",
+]
+
+# 各ワーカープロセスで共有するシミュレーション条件（initializerで設定する）
+_worker_condition = {}
+
+
+def _init_worker(
+    adjacency: sp.csr_matrix,
+    initial_list_member: np.ndarray,
+    n_t: int,
+    n_replicas: int,
+    seed: int,
+) -> None:
+    """
+    ワーカープロセスにシミュレーション条件を設定する（セル毎に隣接行列を送らないようにする）
+    """
+    _worker_condition.update(
+        adjacency=adjacency,
+        initial_list_member=initial_list_member,
+        n_t=n_t,
+        n_replicas=n_replicas,
+        seed=seed,
+    )
+
+
+def _graph_hash(adjacency: sp.csr_matrix, initial_list_member: np.ndarray) -> str:
+    """
+    隣接行列と初期の会員状態のハッシュ値（SHA-256）を計算する（チェックポイントのキーに用いる）
+    """
+    adjacency = sp.csr_matrix(adjacency, copy=True)
+    adjacency.sum_duplicates()
+    adjacency.sort_indices()
+    sha256 = hashlib.sha256()
+    sha256.update(np.asarray(adjacency.shape, dtype=np.int64).tobytes())
+    for array in (adjacency.indptr, adjacency.indices):
+        sha256.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    sha256.update(np.ascontiguousarray(adjacency.data, dtype=np.float64).tobytes())
+    sha256.update(np.ascontiguousarray(np.asarray(initial_list_member) == 1).tobytes())
+    return sha256.hexdigest()
+
+
+def _cell_seed_sequence(
+    seed: int, join_probability: float, cancel_probability: float
+) -> np.random.SeedSequence:
+    """
+    セル（入会確率と退会確率の組）毎の乱数の種を作成する
+    計算する順番やプロセスに関わらず、同じセルには同じ乱数列が割り当てられる
+    """
+    return np.random.SeedSequence(
+        [seed, round(join_probability * 10**9), round(cancel_probability * 10**9)]
+    )
+
+
+def _simulate_cell(join_probability: float, cancel_probability: float) -> tuple:
+    """
+    1つのセルについてn_t時刻後の会員数（n_replicas回の試行の平均値）をシミュレートする
+    """
+    condition = _worker_condition
+    list_timeseries_num = simulate_n_members_ensemble(
+        condition["adjacency"],
+        condition["initial_list_member"],
+        join_probability,
+        cancel_probability,
+        condition["n_t"],
+        condition["n_replicas"],
+        random_state=np.random.default_rng(
+            _cell_seed_sequence(condition["seed"], join_probability, cancel_probability)
+        ),
+    )
+    return join_probability, cancel_probability, list_timeseries_num[-1].mean()
+
+
+def _refine(squares: list, results: dict, threshold: float) -> tuple[list, list]:
+    """
+    4隅の会員数の差が閾値を超える（相の境界を含む）区画を4分割する
+
+    Args:
+        squares (list): 区画（(入会確率の下限, 上限, 退会確率の下限, 上限)）のリスト
+        results (dict): (入会確率, 退会確率)をキー、会員数を値とする計算済みの結果
+        threshold (float): 分割する4隅の会員数の差の閾値
+
+    Returns:
+        next_squares (list): 分割後の区画のリスト
+        new_cells (list): 分割した区画の辺の中点と中心の(入会確率, 退会確率)のリスト
+    """
+    next_squares = []
+    new_cells = set()
+    for join_lo, join_hi, cancel_lo, cancel_hi in squares:
+        corners = [
+            results[_key(join, cancel)]
+            for join in (join_lo, join_hi)
+            for cancel in (cancel_lo, cancel_hi)
+        ]
+        if max(corners) - min(corners) <= threshold:
+            continue
+        join_mid = (join_lo + join_hi) / 2
+        cancel_mid = (cancel_lo + cancel_hi) / 2
+        for join_range in ((join_lo, join_mid), (join_mid, join_hi)):
+            for cancel_range in ((cancel_lo, cancel_mid), (cancel_mid, cancel_hi)):
+                next_squares.append(join_range + cancel_range)
+        for join, cancel in [
+            (join_mid, cancel_lo),
+            (join_mid, cancel_hi),
+            (join_lo, cancel_mid),
+            (join_hi, cancel_mid),
+            (join_mid, cancel_mid),
+        ]:
+            new_cells.add(_key(join, cancel))
+    return next_squares, sorted(new_cells)
+
+
+def _key(join_probability: float, cancel_probability: float) -> tuple:
+    """
+    浮動小数点の誤差を丸めたセルのキーを作成する
+    """
+    return round(join_probability, 9), round(cancel_probability, 9)
+
+
+def sweep_phase_diagram(
+    adjacency: sp.csr_matrix,
+    initial_list_member: np.ndarray,
+    join_probabilities: list,
+    cancel_probabilities: list,
+    n_t: int,
+    n_replicas: int = 1,
+    seed: int = 0,
+    checkpoint_path: str = None,
+    n_refinements: int = 0,
+    refine_threshold: float = None,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """
+    入会確率と退会確率の各組についてn_t時刻後の会員数をプロセスプールで並列にシミュレートし、相図のデータを作成する
+
+    計算の終わったセルはcheckpoint_pathのcsvに逐次追記し、再実行時は計算済みのセルを読み込んで残りのみを計算する。
+    計算済みのセルは、シミュレーション条件と隣接行列・初期の会員状態のハッシュ値が一致するもののみを用いる。
+    プロセスプールはワーカープロセスをforkで起動できる場合のみ用い、それ以外は同じプロセス内で順に計算する。
+    n_refinementsを指定すると、格子の区画のうち4隅の会員数の差がrefine_thresholdを超える（相の境界を含む）区画を
+    4分割して計算することを指定回数繰り返す
+
+    Args:
+        adjacency (sp.csr_matrix): シミュレート対象の人同士の隣接行列
+        initial_list_member (np.ndarray): 初期の、シミュレート対象の人が会員かどうか（会員なら1、非会員なら0）の配列
+        join_probabilities (list): 計算する入会確率（昇順）
+        cancel_probabilities (list): 計算する退会確率（昇順）
+        n_t (int): シミュレートする時刻の数
+        n_replicas (int): 各セルの試行回数（会員数は試行の平均値）
+        seed (int): 乱数の種（各セルの乱数列はseedとセルの確率から決まる）
+        checkpoint_path (str): 計算済みのセルを保存するcsvのパス（Noneの場合は保存しない）
+        n_refinements (int): 境界付近の区画を分割する回数
+        refine_threshold (float): 区画を分割する4隅の会員数の差の閾値（Noneの場合は人数の10%）
+        max_workers (int): プロセス数（Noneの場合はCPU数）
+
+    Returns:
+        phase_diagram (pd.DataFrame): 入会確率（join_probability）、退会確率（cancel_probability）、会員数（n_members）のデータ
+    """
+    if refine_threshold is None:
+        refine_threshold = 0.1 * adjacency.shape[0]
+
+    initial_list_member = np.asarray(initial_list_member)
+    graph_hash = _graph_hash(adjacency, initial_list_member)
+
+    # 計算済みのセルを読み込む（シミュレーション条件、隣接行列、初期の会員状態が異なる結果は使わない）
+    results = {}
+    checkpoint = None
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = pd.read_csv(checkpoint_path)
+        if list(checkpoint.columns) != CHECKPOINT_COLUMNS:
+            # 列が異なる（隣接行列のハッシュ値を持たない古い形式の）チェックポイントは作り直す
+            checkpoint = None
+    if checkpoint is not None:
+        checkpoint = checkpoint[
+            (checkpoint["n_t"] == n_t)
+            & (checkpoint["n_replicas"] == n_replicas)
+            & (checkpoint["seed"] == seed)
+            & (checkpoint["graph_hash"] == graph_hash)
+        ]
+        for row in checkpoint.itertuples(index=False):
+            results[_key(row.join_probability, row.cancel_probability)] = row.n_members
+    elif checkpoint_path is not None:
+        pd.DataFrame(columns=CHECKPOINT_COLUMNS).to_csv(checkpoint_path, index=False)
+
+    cells = [
+        _key(join, cancel)
+        for join in join_probabilities
+        for cancel in cancel_probabilities
+    ]
+    # 今回の計算対象となったセル
+    swept_cells = set()
+    squares = [
+        (join_lo, join_hi, cancel_lo, cancel_hi)
+        for join_lo, join_hi in zip(join_probabilities[:-1], join_probabilities[1:])
+        for cancel_lo, cancel_hi in zip(
+            cancel_probabilities[:-1], cancel_probabilities[1:]
+        )
+    ]
+
+    condition = (adjacency, initial_list_member, n_t, n_replicas, seed)
+    executor = None
+    if can_fork_workers():
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=condition
+        )
+    else:
+        _init_worker(*condition)
+    try:
+        for i_refinement in range(n_refinements + 1):
+            if i_refinement > 0:
+                squares, cells = _refine(squares, results, refine_threshold)
+            swept_cells.update(cells)
+            pending_cells = [cell for cell in cells if cell not in results]
+            if executor is None:
+                outcomes = (
+                    _simulate_cell(join, cancel) for join, cancel in pending_cells
+                )
+            else:
+                futures = [
+                    executor.submit(_simulate_cell, join, cancel)
+                    for join, cancel in pending_cells
+                ]
+                outcomes = (future.result() for future in as_completed(futures))
+            for join, cancel, n_members in outcomes:
+                results[_key(join, cancel)] = n_members
+                if checkpoint_path is not None:
+                    pd.DataFrame(
+                        [[join, cancel, n_t, n_replicas, seed, graph_hash, n_members]]
+                    ).to_csv(checkpoint_path, mode="a", header=False, index=False)
+    finally:
+        if executor is None:
+            _worker_condition.clear()
+        else:
+            executor.shutdown()
+
+    phase_diagram = pd.DataFrame(
+        [(join, cancel, results[join, cancel]) for join, cancel in swept_cells],
+        columns=["join_probability", "cancel_probability", "n_members"],
+    )
+    return phase_diagram.sort_values(
+        ["join_probability", "cancel_probability"], ignore_index=True
+    )
@@ -0,0 +1,45 @@
+from common.loader import read_csv_cached, read_excel_cached, iter_excel_batches
+from common.count_histogram import count_histogram, merge_histograms, histogram_stats
+from common.feature_store import (
+    summarize_monthly_activity,
+    update_customer_activity,
+    write_customer_features,
+    read_customer_features,
+    iter_customer_features,
+)
+from common.dtypes import optimize_dtypes, memory_report
+from common.parallel import can_fork_workers
+from common.lag_features import build_lag_features, iter_lag_features
+from common.period import (
+    to_month_key,
+    month_key_to_str,
+    month_str_to_key,
+    to_month_category,
+    add_months,
+    months_between,
+)
+
+__all__ = [
+    "read_csv_cached",
+    "read_excel_cached",
+    "iter_excel_batches",
+    "count_histogram",
+    "merge_histograms",
+    "histogram_stats",
+    "summarize_monthly_activity",
+    "update_customer_activity",
+    "write_customer_features",
+    "read_customer_features",
+    "iter_customer_features",
+    "optimize_dtypes",
+    "memory_report",
+    "can_fork_workers",
+    "build_lag_features",
+    "iter_lag_features",
+    "to_month_key",
+    "month_key_to_str",
+    "month_str_to_key",
+    "to_month_category",
+    "add_months",
+    "months_between",
+]
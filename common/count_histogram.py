@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+def count_histogram(
+    df: pd.DataFrame, id_column: str = "customer_id", value_column: str = "count"
+) -> pd.DataFrame:
+    """
+    顧客毎に、整数値（月利用回数等）の値毎の出現回数（ヒストグラム）を集計する
+    月利用回数のように取りうる値の範囲が小さい整数値は、ヒストグラムで持てば値を全て保持しなくても
+    平均値、中央値、最大値、最小値を正確に求めることができ、足し合わせることで別々に集計した結果を結合できる
+
+    Args:
+        df (pd.DataFrame): id_column、value_column列を持つデータ（value_columnは0以上の整数）
+        id_column (str): 顧客IDの列名
+        value_column (str): 集計する整数値の列名
+
+    Returns:
+        histogram (pd.DataFrame): 顧客IDをindex、値を列（昇順）、出現回数を値とするヒストグラム
+    """
+    histogram = df.groupby([id_column, value_column]).size().unstack(fill_value=0)
+    histogram.columns = histogram.columns.astype(np.int64)
+    histogram.columns.name = None
+    return histogram.sort_index(axis=1)
+
+
+def merge_histograms(*histograms: pd.DataFrame) -> pd.DataFrame:
+    """
+    ヒストグラムを足し合わせる（シャードや月毎に集計したヒストグラムを結合する）
+    符号を反転したヒストグラム（-histogram）を足し合わせると、そのヒストグラムの分を取り除くことができる
+
+    Args:
+        *histograms (pd.DataFrame): count_histogramで作成したヒストグラム（Noneは無視する）
+
+    Returns:
+        histogram (pd.DataFrame): 足し合わせたヒストグラム（出現回数が全て0になった顧客と値は除く）
+    """
+    merged = None
+    for histogram in histograms:
+        if histogram is None:
+            continue
+        merged = histogram if merged is None else merged.add(histogram, fill_value=0)
+    merged = merged.fillna(0).astype(np.int64)
+    merged = merged.loc[merged.sum(axis=1) > 0, merged.sum(axis=0) > 0]
+    return merged.sort_index().sort_index(axis=1)
+
+
+def histogram_stats(histogram: pd.DataFrame) -> pd.DataFrame:
+    """
+    ヒストグラムから、顧客毎の平均値、中央値、最大値、最小値を求める
+    （値を全て保持してgroupbyで集計した場合と同じ値になる。中央値は値の数が偶数の場合、中央の2つの値の平均値とする）
+
+    Args:
+        histogram (pd.DataFrame): count_histogramで作成したヒストグラム
+
+    Returns:
+        stats (pd.DataFrame): 顧客IDをindexとし、mean、median、max、min列を持つデータ
+    """
+    values = histogram.columns.to_numpy(dtype=np.int64)
+    counts = histogram.to_numpy(dtype=np.int64)
+    n = counts.sum(axis=1)
+    cumulative_counts = counts.cumsum(axis=1)
+
+    # 昇順に並べたときの中央の2つの値（0始まりの順位が(n - 1) // 2とn // 2の値）
+    lower_median = values[(cumulative_counts <= ((n - 1) // 2)[:, None]).sum(axis=1)]
+    upper_median = values[(cumulative_counts <= (n // 2)[:, None]).sum(axis=1)]
+
+    is_observed = counts > 0
+    return pd.DataFrame(
+        {
+            "mean": (counts * values).sum(axis=1) / n,
+            "median": (lower_median + upper_median) / 2,
+            "max": values[len(values) - 1 - is_observed[:, ::-1].argmax(axis=1)],
+            "min": values[is_observed.argmax(axis=1)],
+        },
+        index=histogram.index,
+    )
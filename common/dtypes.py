@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+# 整数型の列を縮小する候補の型（小さい順）
+INTEGER_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _smallest_integer_dtype(values: pd.Series) -> np.dtype:
+    """
+    値を全て表せる最も小さい整数型を求める
+    """
+    if len(values) == 0:
+        return values.dtype
+    min_value, max_value = values.min(), values.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(dtype)
+    return values.dtype
+
+
+def _is_float32_exact(values: pd.Series) -> bool:
+    """
+    float32に変換しても全ての値が変わらない（float64に戻すと元の値と一致する）かを確認する
+    """
+    array = values.to_numpy(dtype=np.float64)
+    return np.array_equal(
+        array.astype(np.float32).astype(np.float64), array, equal_nan=True
+    )
+
+
+def optimize_dtypes(
+    df: pd.DataFrame,
+    max_category_ratio: float = 0.5,
+    float32_columns: list = None,
+    exclude: list = None,
+) -> pd.DataFrame:
+    """
+    値を変えずにメモリ使用量が小さくなるよう、列のデータ型を変換する
+
+    文字列の列はユニークな値の数が行数のmax_category_ratio倍以下の場合にカテゴリ型にし（カテゴリは値の昇順）、
+    整数型の列は値を全て表せる最も小さい整数型にする。
+    0/1のフラグ列もbool型にはしない（bool型にするとdescribeの集計対象から外れ、groupbyのキーもTrue/Falseになるため）。
+    float32で計算すると集計値や標準化した値が変わるため、小数の列はfloat32_columnsに指定した列のうち、
+    float32に変換しても値が変わらない列のみを変換する
+
+    Args:
+        df (pd.DataFrame): 変換するデータ
+        max_category_ratio (float): カテゴリ型にする文字列の列のユニークな値の数の行数に対する割合の上限
+        float32_columns (list): float32に変換する小数の列（Noneの場合は変換しない）
+        exclude (list): 変換しない列
+
+    Returns:
+        df (pd.DataFrame): データ型を変換したデータ（元のデータは変更しない）
+    """
+    float32_columns = [] if float32_columns is None else float32_columns
+    exclude = [] if exclude is None else exclude
+
+    dtypes = {}
+    for column in df.columns:
+        if column in exclude:
+            continue
+        values = df[column]
+        if values.dtype == object:
+            non_null = values.dropna()
+            is_string = non_null.map(type).eq(str).all()
+            if is_string and non_null.nunique() <= max_category_ratio * len(values):
+                dtypes[column] = "category"
+        elif pd.api.types.is_integer_dtype(values) and isinstance(
+            values.dtype, np.dtype
+        ):
+            dtype = _smallest_integer_dtype(values)
+            if dtype != values.dtype:
+                dtypes[column] = dtype
+        elif (
+            column in float32_columns
+            and values.dtype == np.float64
+            and _is_float32_exact(values)
+        ):
+            dtypes[column] = np.float32
+    return df.astype(dtypes)
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """
+    データ型の変換前後の列毎のデータ型とメモリ使用量（文字列の中身を含む）を比較する
+
+    Args:
+        before (pd.DataFrame): 変換前のデータ
+        after (pd.DataFrame): 変換後のデータ（beforeと同じ列を持つこと）
+
+    Returns:
+        report (pd.DataFrame): 列名をindexとし、変換前後のデータ型（dtype_before、dtype_after）、
+            メモリ使用量のバイト数（bytes_before、bytes_after）、変換後の変換前に対する割合（ratio）を持つデータ
+            （最後の行（total）は全ての列とindexの合計）
+    """
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_before": before.memory_usage(index=False, deep=True),
+            "bytes_after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total"] = [
+        "",
+        "",
+        before.memory_usage(deep=True).sum(),
+        after.memory_usage(deep=True).sum(),
+    ]
+    report[["bytes_before", "bytes_after"]] = report[
+        ["bytes_before", "bytes_after"]
+    ].astype(np.int64)
+    report["ratio"] = report["bytes_after"] / report["bytes_before"]
+    return report
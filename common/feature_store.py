@@ -0,0 +1,281 @@
+import os
+from collections.abc import Iterator
+import numpy as np
+import pandas as pd
+from common.count_histogram import count_histogram, merge_histograms, histogram_stats
+
+# 特徴量ストア（ディレクトリ）内のファイル名
+# 月毎の顧客別利用回数のパーティション（年月毎に1ファイル）を保存するディレクトリ
+MONTHLY_DIR_NAME = "monthly"
+# 顧客毎の利用状況（月利用回数の統計量、定期利用フラグ）
+ACTIVITY_FILE_NAME = "activity.parquet"
+# 顧客毎の特徴量（顧客データと利用状況等を結合したもの）
+FEATURES_FILE_NAME = "customer_features.parquet"
+# 顧客毎の月利用回数のヒストグラムと、各月の同一曜日の利用回数の最大値のヒストグラム
+COUNT_HISTOGRAM_FILE_NAME = "count_histogram.parquet"
+WEEKDAY_MAX_HISTOGRAM_FILE_NAME = "weekday_max_histogram.parquet"
+
+
+def summarize_monthly_activity(
+    monthly_use_log: pd.DataFrame,
+    routine_threshold: int = 4,
+    id_column: str = "customer_id",
+    method: str = "exact",
+) -> pd.DataFrame:
+    """
+    顧客毎の月別の利用回数から、顧客毎の月利用回数の統計量と定期利用フラグを集計する
+
+    Args:
+        monthly_use_log (pd.DataFrame): 顧客ID、利用回数（count）、その月の同一曜日の利用回数の最大値（weekday_max）
+            の列を持つ顧客毎の月別の利用回数（同じ顧客の行は時系列順に並んでいること）
+        routine_threshold (int): 定期利用とみなす各月の同一曜日の利用回数の最大値の下限
+        id_column (str): 顧客IDの列名
+        method (str): 集計方法
+            "exact": 顧客毎の全ての月の値をgroupbyで集計する
+            "histogram": 顧客毎の値のヒストグラム（count_histogram）から求める（結果は"exact"と同じ）
+
+    Returns:
+        customer_activity (pd.DataFrame): 顧客毎の月利用回数の平均値（mean）、中央値（median）、最大値（max）、
+            最小値（min）、各月の同一曜日の利用回数の最大値（weekday_max）、定期利用フラグ（routine_flg）
+    """
+    if method == "histogram":
+        return _activity_from_histograms(
+            count_histogram(monthly_use_log, id_column, "count"),
+            count_histogram(monthly_use_log, id_column, "weekday_max"),
+            routine_threshold,
+            id_column,
+        )
+    if method != "exact":
+        raise ValueError(f'methodは"exact"か"histogram"を指定してください: {method}')
+    grouped = monthly_use_log.groupby(id_column)
+    customer_activity = grouped["count"].agg(["mean", "median", "max", "min"])
+    customer_activity["weekday_max"] = grouped["weekday_max"].max()
+    customer_activity["routine_flg"] = (
+        customer_activity["weekday_max"] >= routine_threshold
+    ).astype(np.int64)
+    return customer_activity.reset_index()
+
+
+def _activity_from_histograms(
+    count_histogram: pd.DataFrame,
+    weekday_max_histogram: pd.DataFrame,
+    routine_threshold: int,
+    id_column: str,
+) -> pd.DataFrame:
+    """
+    月利用回数と各月の同一曜日の利用回数の最大値のヒストグラムから、顧客毎の利用状況を求める
+    """
+    customer_activity = histogram_stats(count_histogram)
+    customer_activity["weekday_max"] = histogram_stats(weekday_max_histogram)["max"]
+    customer_activity["routine_flg"] = (
+        customer_activity["weekday_max"] >= routine_threshold
+    ).astype(np.int64)
+    customer_activity.index.name = id_column
+    return customer_activity.reset_index()
+
+
+def _read_histogram(path: str, id_column: str) -> pd.DataFrame:
+    """
+    保存したヒストグラムを読み込む（列名を整数の値に戻す）
+    """
+    histogram = pd.read_parquet(path).set_index(id_column)
+    histogram.columns = histogram.columns.astype(np.int64)
+    return histogram
+
+
+def _write_histogram(histogram: pd.DataFrame, path: str) -> None:
+    """
+    ヒストグラムを保存する（parquet形式では列名を文字列にする必要があるため、値を文字列にして保存する）
+    """
+    _write_parquet(histogram.rename(columns=str).reset_index(), path)
+
+
+def _write_parquet(df: pd.DataFrame, path: str) -> None:
+    """
+    データをparquet形式で保存する（書き込み途中のファイルが読まれないよう、一時ファイルに書き込んでから置き換える）
+    """
+    df.to_parquet(path + ".tmp", compression="zstd", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def update_customer_activity(
+    store_dir: str,
+    monthly_use_log: pd.DataFrame,
+    routine_threshold: int = 4,
+    id_column: str = "customer_id",
+    month_column: str = "use_month",
+) -> pd.DataFrame:
+    """
+    月毎の顧客別利用回数を特徴量ストアの年月毎のパーティションに保存し、顧客毎の利用状況を更新する
+
+    monthly_use_logは利用履歴の全期間とみなし、内容が変わった年月のパーティションを置き換え、
+    monthly_use_logに含まれない年月のパーティションは削除する（内容が変わっていない年月はそのままにする）。
+    顧客毎の利用状況は月利用回数（と各月の同一曜日の利用回数の最大値）のヒストグラムとして保持し、
+    置き換えた（削除した）パーティションの分だけヒストグラムを足し引きして、そのパーティションに含まれる顧客の利用状況のみを求め直す。
+    そのため、新しい月の利用履歴を追加した場合も過去の月のパーティションは読み込まない
+
+    Args:
+        store_dir (str): 特徴量ストアのディレクトリ
+        monthly_use_log (pd.DataFrame): 年月、顧客ID、利用回数（count）、その月の同一曜日の利用回数の最大値
+            （weekday_max）の列を持つ顧客毎の月別の利用回数（全ての年月、全ての顧客の行があること）
+        routine_threshold (int): 定期利用とみなす各月の同一曜日の利用回数の最大値の下限
+            （変更した場合は特徴量ストアを削除して作り直すこと）
+        id_column (str): 顧客IDの列名
+        month_column (str): 年月の列名（"%Y-%m"形式の文字列またはカテゴリ型）
+
+    Returns:
+        customer_activity (pd.DataFrame): 更新後の全ての顧客の利用状況（summarize_monthly_activityと同じ列。
+            monthly_use_logに利用履歴のない顧客は含まない）
+    """
+    monthly_dir = os.path.join(store_dir, MONTHLY_DIR_NAME)
+    os.makedirs(monthly_dir, exist_ok=True)
+
+    # 内容が変わった年月のパーティションを置き換え、ヒストグラムの増減と影響を受ける顧客を記録する
+    count_deltas = []
+    weekday_max_deltas = []
+    affected_ids = []
+
+    # monthly_use_logに含まれない年月のパーティションは、その分のヒストグラムを差し引いて削除する
+    months = {str(month) for month in monthly_use_log[month_column].dropna().unique()}
+    for name in sorted(os.listdir(monthly_dir)):
+        if not name.endswith(".parquet") or name[: -len(".parquet")] in months:
+            continue
+        partition_path = os.path.join(monthly_dir, name)
+        stored_rows = pd.read_parquet(partition_path)
+        count_deltas.append(-count_histogram(stored_rows, id_column, "count"))
+        weekday_max_deltas.append(
+            -count_histogram(stored_rows, id_column, "weekday_max")
+        )
+        affected_ids.append(stored_rows[id_column])
+        os.remove(partition_path)
+
+    for month, month_rows in monthly_use_log.groupby(month_column, observed=True):
+        rows = month_rows[[id_column, "count", "weekday_max"]].sort_values(
+            id_column, ignore_index=True
+        )
+        partition_path = os.path.join(monthly_dir, f"{month}.parquet")
+        if os.path.exists(partition_path):
+            stored_rows = pd.read_parquet(partition_path)
+            if stored_rows.equals(rows):
+                continue
+            count_deltas.append(-count_histogram(stored_rows, id_column, "count"))
+            weekday_max_deltas.append(
+                -count_histogram(stored_rows, id_column, "weekday_max")
+            )
+            affected_ids.append(stored_rows[id_column])
+        count_deltas.append(count_histogram(rows, id_column, "count"))
+        weekday_max_deltas.append(count_histogram(rows, id_column, "weekday_max"))
+        affected_ids.append(rows[id_column])
+        _write_parquet(rows, partition_path)
+
+    activity_path = os.path.join(store_dir, ACTIVITY_FILE_NAME)
+    count_histogram_path = os.path.join(store_dir, COUNT_HISTOGRAM_FILE_NAME)
+    weekday_max_histogram_path = os.path.join(
+        store_dir, WEEKDAY_MAX_HISTOGRAM_FILE_NAME
+    )
+    is_initialized = all(
+        os.path.exists(path)
+        for path in [activity_path, count_histogram_path, weekday_max_histogram_path]
+    )
+    if is_initialized and len(affected_ids) == 0:
+        return pd.read_parquet(activity_path)
+
+    if is_initialized:
+        # 保存したヒストグラムに増減を足し合わせ、影響を受ける顧客の利用状況のみを求め直す
+        counts = merge_histograms(
+            _read_histogram(count_histogram_path, id_column), *count_deltas
+        )
+        weekday_max = merge_histograms(
+            _read_histogram(weekday_max_histogram_path, id_column),
+            *weekday_max_deltas,
+        )
+        affected_ids = pd.unique(pd.concat(affected_ids))
+        is_affected = counts.index.isin(affected_ids)
+        updated_activity = _activity_from_histograms(
+            counts[is_affected],
+            weekday_max.loc[counts.index[is_affected]],
+            routine_threshold,
+            id_column,
+        )
+        customer_activity = pd.read_parquet(activity_path)
+        customer_activity = pd.concat(
+            [
+                customer_activity[~customer_activity[id_column].isin(affected_ids)],
+                updated_activity,
+            ]
+        ).sort_values(id_column, ignore_index=True)
+    else:
+        # 初回は全てのパーティションからヒストグラムを作成する
+        history = pd.concat(
+            [
+                pd.read_parquet(os.path.join(monthly_dir, name))
+                for name in sorted(os.listdir(monthly_dir))
+                if name.endswith(".parquet")
+            ],
+            ignore_index=True,
+        )
+        counts = count_histogram(history, id_column, "count")
+        weekday_max = count_histogram(history, id_column, "weekday_max")
+        customer_activity = _activity_from_histograms(
+            counts, weekday_max, routine_threshold, id_column
+        )
+
+    _write_histogram(counts, count_histogram_path)
+    _write_histogram(weekday_max, weekday_max_histogram_path)
+    _write_parquet(customer_activity, activity_path)
+    return customer_activity
+
+
+def write_customer_features(store_dir: str, customer_features: pd.DataFrame) -> None:
+    """
+    顧客毎の特徴量を、型を保ったまま特徴量ストアに保存する
+
+    Args:
+        store_dir (str): 特徴量ストアのディレクトリ
+        customer_features (pd.DataFrame): 顧客毎の特徴量（顧客IDをキーとし、1顧客1行）
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    _write_parquet(customer_features, os.path.join(store_dir, FEATURES_FILE_NAME))
+
+
+def read_customer_features(store_dir: str, columns: list = None) -> pd.DataFrame:
+    """
+    特徴量ストアから顧客毎の特徴量を読み込む（日付列等の型は保存時のまま読み込まれる）
+
+    Args:
+        store_dir (str): 特徴量ストアのディレクトリ
+        columns (list): 読み込む列（Noneの場合は全ての列）
+
+    Returns:
+        customer_features (pd.DataFrame): 顧客毎の特徴量
+    """
+    return pd.read_parquet(os.path.join(store_dir, FEATURES_FILE_NAME), columns=columns)
+
+
+def iter_customer_features(
+    store_dir: str, columns: list = None, batch_size: int = 10000
+) -> Iterator[pd.DataFrame]:
+    """
+    特徴量ストアから顧客毎の特徴量をbatch_size行ずつ順に読み込む
+    ファイル全体をメモリに読み込まないため、顧客数が多い場合でもメモリ使用量はbatch_sizeで決まる
+
+    Args:
+        store_dir (str): 特徴量ストアのディレクトリ
+        columns (list): 読み込む列（Noneの場合は全ての列）
+        batch_size (int): 一度に返す行数
+
+    Yields:
+        batch (pd.DataFrame): 顧客毎の特徴量（indexはファイル全体での行番号）
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(os.path.join(store_dir, FEATURES_FILE_NAME))
+    start = 0
+    for record_batch in parquet_file.iter_batches(
+        batch_size=batch_size, columns=columns
+    ):
+        batch = record_batch.to_pandas()
+        batch.index = pd.RangeIndex(start, start + len(batch))
+        start += len(batch)
+        yield batch
+
@@ -0,0 +1,113 @@
+from collections import deque
+from collections.abc import Iterable, Iterator
+import numpy as np
+import pandas as pd
+
+
+def _month_positions(months: pd.Series) -> tuple[np.ndarray, int]:
+    """
+    年月データを時系列順の位置（何番目の月か）に変換する
+    カテゴリ型の場合はカテゴリの順、それ以外の場合は出現順を時系列順とみなす
+
+    Args:
+        months (pd.Series): 年月データ
+
+    Returns:
+        month_positions (np.ndarray): 各行の月の位置
+        n_months (int): 月の数
+    """
+    if isinstance(months.dtype, pd.CategoricalDtype):
+        return months.cat.codes.to_numpy(dtype=np.int64), len(months.cat.categories)
+    codes, unique_months = pd.factorize(months, sort=False)
+    return codes, len(unique_months)
+
+
+def build_lag_features(
+    monthly_counts: pd.DataFrame,
+    lag_columns: list,
+    target_column: str,
+    id_column: str = "customer_id",
+    month_column: str = "usemonth",
+    value_column: str = "count",
+) -> pd.DataFrame:
+    """
+    顧客毎の月別の集計データから、対象月の値とその過去nヶ月の値（ラグ特徴量）を持つデータを作成する
+    顧客 × 月の行列を一度だけ作成し、各ラグは行列の列をずらして参照するため、月毎の抽出や結合を繰り返さない
+
+    対象月は過去nヶ月（n = len(lag_columns)）のデータが揃う月以降とし、行は対象月にデータがある顧客のみとする
+    （対象月毎に過去の月のデータを左結合して縦に結合した場合と同じ行、同じ順序になる）。
+    過去の月にデータがない場合のラグ特徴量はNaNとする
+
+    Args:
+        monthly_counts (pd.DataFrame): id_column、month_column、value_column列を持つ顧客毎の月別の集計データ
+            （顧客と月の組は重複しないこと。month_columnがカテゴリ型の場合はカテゴリの順、それ以外は出現順を時系列順とする）
+        lag_columns (list): 1ヶ月前、2ヶ月前、…の値の列名のリスト
+        target_column (str): 対象月の値の列名（value_column列の名前を変更する）
+        id_column (str): 顧客IDの列名
+        month_column (str): 年月の列名
+        value_column (str): 集計値の列名
+
+    Returns:
+        lag_data (pd.DataFrame): monthly_countsの列（value_columnはtarget_columnに変更）とラグ特徴量の列を持つデータ
+    """
+    n_lags = len(lag_columns)
+    month_positions, n_months = _month_positions(monthly_counts[month_column])
+    id_codes, unique_ids = pd.factorize(monthly_counts[id_column])
+
+    # 顧客 × 月の行列（データがない箇所はNaN）
+    count_matrix = np.full((len(unique_ids), n_months), np.nan)
+    count_matrix[id_codes, month_positions] = monthly_counts[value_column].to_numpy(
+        dtype=np.float64
+    )
+
+    # 対象月の行を月順に並べる（同じ月の中では元の順序を保つ）
+    is_target = month_positions >= n_lags
+    target_rows = np.flatnonzero(is_target)[
+        np.argsort(month_positions[is_target], kind="stable")
+    ]
+    lag_data = (
+        monthly_counts.iloc[target_rows]
+        .rename(columns={value_column: target_column})
+        .reset_index(drop=True)
+    )
+    for lag, column in enumerate(lag_columns, start=1):
+        lag_data[column] = count_matrix[
+            id_codes[target_rows], month_positions[target_rows] - lag
+        ]
+    return lag_data
+
+
+def iter_lag_features(
+    monthly_frames: Iterable[pd.DataFrame],
+    lag_columns: list,
+    target_column: str,
+    id_column: str = "customer_id",
+    value_column: str = "count",
+) -> Iterator[pd.DataFrame]:
+    """
+    月毎の集計データを時系列順に受け取り、build_lag_featuresと同じ行を対象月毎に順に返す
+    保持するのは直近nヶ月（n = len(lag_columns)）のデータのみのため、履歴が長くてもメモリ使用量は増えない
+
+    Args:
+        monthly_frames (Iterable[pd.DataFrame]): 1ヶ月分ずつの顧客毎の集計データ（時系列順）
+        lag_columns (list): 1ヶ月前、2ヶ月前、…の値の列名のリスト
+        target_column (str): 対象月の値の列名（value_column列の名前を変更する）
+        id_column (str): 顧客IDの列名
+        value_column (str): 集計値の列名
+
+    Yields:
+        lag_data (pd.DataFrame): 対象月の行とラグ特徴量の列を持つデータ（過去nヶ月のデータが揃う月以降）
+    """
+    # 直近の月の集計値（顧客IDをindexとする）
+    window = deque(maxlen=len(lag_columns))
+    for month_frame in monthly_frames:
+        if len(window) == len(lag_columns):
+            lag_data = month_frame.rename(
+                columns={value_column: target_column}
+            ).reset_index(drop=True)
+            for lag, column in enumerate(lag_columns, start=1):
+                lag_data[column] = (
+                    lag_data[id_column].map(window[-lag]).astype(np.float64)
+                )
+            yield lag_data
+        window.append(month_frame.set_index(id_column)[value_column])
@@ -0,0 +1,260 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+from collections.abc import Iterator
+import pandas as pd
+
+# キャッシュを保存するディレクトリ名（入力ファイルと同じディレクトリに作成する）
+CACHE_DIR_NAME = ".parquet_cache"
+
+
+def _file_hash(path: str) -> str:
+    """
+    ファイルの内容のハッシュ値（SHA-256）を計算する
+    サイズと更新時刻が前回と同じ場合は、保存しておいたハッシュ値を使い再計算しない
+
+    Args:
+        path (str): ファイルのパス
+
+    Returns:
+        file_hash (str): ハッシュ値の16進数文字列
+    """
+    stat = os.stat(path)
+    cache_dir = os.path.join(os.path.dirname(path), CACHE_DIR_NAME)
+    hash_path = os.path.join(cache_dir, os.path.basename(path) + ".hash.json")
+
+    if os.path.exists(hash_path):
+        with open(hash_path) as f:
+            saved = json.load(f)
+        if saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime:
+            return saved["sha256"]
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    file_hash = sha256.hexdigest()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(hash_path, "w") as f:
+        json.dump(
+            {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash}, f
+        )
+    return file_hash
+
+
+def read_csv_cached(
+    path: str,
+    columns: list = None,
+    parse_dates: list = None,
+    **read_csv_kwargs,
+) -> pd.DataFrame:
+    """
+    csvを読み込む。初回は型を確定させた（日付列はdatetime型に変換した）データを
+    圧縮した列指向のparquet形式でキャッシュし、2回目以降はキャッシュから必要な列のみを読み込む
+
+    キャッシュは元のcsvの内容のハッシュ値と読み込み条件をキーとして保存するため、
+    csvが更新されてキャッシュが古くなった場合は自動的にcsvから読み込み直す。
+    pyarrowがインストールされていない場合は、キャッシュを使わずcsvから読み込む
+
+    Args:
+        path (str): csvのパス
+        columns (list): 読み込む列（Noneの場合は全ての列。index_colで指定した列は常に読み込まれる）
+        parse_dates (list): datetime型に変換する列（Noneの場合は変換しない）
+        **read_csv_kwargs: pd.read_csvに渡すその他の引数（index_col等）
+
+    Returns:
+        df (pd.DataFrame): 読み込んだデータ
+    """
+    if parse_dates is None:
+        parse_dates = []
+    if importlib.util.find_spec("pyarrow") is None:
+        df = pd.read_csv(path, **read_csv_kwargs)
+        for column in parse_dates:
+            df[column] = pd.to_datetime(df[column])
+        return df if columns is None else df[columns]
+
+    cache_path = _cache_path(
+        path, {"parse_dates": list(parse_dates), "read_csv_kwargs": read_csv_kwargs}
+    )
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path, columns=columns)
+
+    df = pd.read_csv(path, **read_csv_kwargs)
+    for column in parse_dates:
+        df[column] = pd.to_datetime(df[column])
+    _save_cache(df, cache_path)
+
+    return df if columns is None else df[columns]
+
+
+def iter_excel_batches(
+    path: str, sheet_name=0, batch_size: int = 10000, converters: dict = None
+) -> Iterator[pd.DataFrame]:
+    """
+    xlsxを読み取り専用モードで先頭から順に読み込み、batch_size行ずつのデータを返す
+    ブック全体をメモリに展開しないため、行数の多いファイルでもメモリ使用量はbatch_sizeで決まる
+
+    Args:
+        path (str): xlsxのパス
+        sheet_name (int | str): シート名またはシートの番号
+        batch_size (int): 一度に返す行数
+        converters (dict): 列名をキー、その列（pd.Series）を変換する関数を値とする辞書（バッチ毎に適用する。Noneの場合は変換しない）
+
+    Yields:
+        batch (pd.DataFrame): 1行目を列名とし、値の型から列の型を推定したデータ（indexはファイル全体での行番号。空行は読み飛ばす）
+    """
+    from openpyxl import load_workbook
+
+    if converters is None:
+        converters = {}
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet_name, str):
+            worksheet = workbook[sheet_name]
+        else:
+            worksheet = workbook.worksheets[sheet_name]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, ())
+
+        start = 0
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield _excel_batch(batch, header, start, converters)
+                start += len(batch)
+                batch = []
+        if len(batch) > 0 or start == 0:
+            yield _excel_batch(batch, header, start, converters)
+    finally:
+        workbook.close()
+
+
+def _excel_batch(
+    rows: list, header: tuple, start: int, converters: dict
+) -> pd.DataFrame:
+    """
+    xlsxから読み込んだ行をデータフレームにし、列毎の変換を適用する
+    """
+    batch = pd.DataFrame(
+        rows, columns=list(header), index=pd.RangeIndex(start, start + len(rows))
+    )
+    for column, converter in converters.items():
+        batch[column] = converter(batch[column])
+    return batch
+
+
+def read_excel_cached(
+    path: str,
+    sheet_name=0,
+    batch_size: int = 10000,
+    converters: dict = None,
+    cache_version: str = None,
+) -> pd.DataFrame:
+    """
+    xlsxをiter_excel_batchesで順に読み込み、列毎の変換を適用したデータを返す
+    変換後のデータはread_csv_cachedと同様にparquet形式でキャッシュし、
+    xlsxが更新されていなければ2回目以降はxlsxを読み込まない
+
+    キャッシュはxlsxのハッシュ値（サイズと更新時刻が変わらない場合は前回計算したもの）と
+    シート、変換関数の名前と変換関数を定義したモジュールのソースコードをキーとする
+    （変換関数や、同じモジュール内で変換関数から呼び出す関数の処理内容を変更した場合も読み込み直す）。
+    他のモジュールの関数の変更等、キーに含まれない変更を反映させる場合はcache_versionを変更する。
+    型が混在する列（数値と日付が混在する列等）はparquet形式で保存できないため、convertersで型を揃えておく
+
+    Args:
+        path (str): xlsxのパス
+        sheet_name (int | str): シート名またはシートの番号
+        batch_size (int): 一度に読み込む行数
+        converters (dict): 列名をキー、その列（pd.Series）を変換する関数を値とする辞書（Noneの場合は変換しない）
+        cache_version (str): キャッシュのキーに加える任意の文字列（変更すると読み込み直す）
+
+    Returns:
+        df (pd.DataFrame): 読み込んだデータ
+    """
+    if converters is None:
+        converters = {}
+    if importlib.util.find_spec("pyarrow") is None:
+        return pd.concat(iter_excel_batches(path, sheet_name, batch_size, converters))
+
+    cache_path = _cache_path(
+        path,
+        {
+            "sheet_name": sheet_name,
+            "cache_version": cache_version,
+            "converters": {
+                column: _converter_key(converter)
+                for column, converter in converters.items()
+            },
+        },
+    )
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df = pd.concat(iter_excel_batches(path, sheet_name, batch_size, converters))
+    _save_cache(df, cache_path)
+    return df
+
+
+def _converter_key(converter) -> str:
+    """
+    変換関数の名前と、変換関数を定義したモジュールのソースファイルのハッシュ値から、キャッシュのキーに用いる文字列を作成する
+    変換関数が同じモジュール内の関数に処理を委ねている場合も、それらの変更がキーに反映される
+    ソースファイルを取得できない関数（組み込み関数等）は名前のみとする
+    """
+    name = (
+        f"{getattr(converter, '__module__', None)}."
+        f"{getattr(converter, '__qualname__', repr(converter))}"
+    )
+    try:
+        source_path = inspect.getsourcefile(converter)
+    except TypeError:
+        return name
+    if source_path is None or not os.path.exists(source_path):
+        return name
+    with open(source_path, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    return f"{name}:{source_hash}"
+
+
+def _cache_path(path: str, condition: dict) -> str:
+    """
+    ファイルの内容のハッシュ値と読み込み条件から、キャッシュのパスを作成する
+
+    Args:
+        path (str): 読み込むファイルのパス
+        condition (dict): 読み込み条件（読み込み条件が変わった場合も別のキャッシュとする）
+
+    Returns:
+        cache_path (str): キャッシュのパス
+    """
+    condition = json.dumps(condition, sort_keys=True, default=str)
+    condition_hash = hashlib.sha256(condition.encode("utf-8")).hexdigest()[:8]
+    cache_dir = os.path.join(os.path.dirname(path), CACHE_DIR_NAME)
+    return os.path.join(
+        cache_dir,
+        f"{os.path.basename(path)}.{condition_hash}.{_file_hash(path)[:16]}.parquet",
+    )
+
+
+def _save_cache(df: pd.DataFrame, cache_path: str) -> None:
+    """
+    同じ読み込み条件の古いキャッシュを削除してから、データをキャッシュとして保存する
+
+    Args:
+        df (pd.DataFrame): 保存するデータ
+        cache_path (str): _cache_pathで作成したキャッシュのパス
+    """
+    cache_dir = os.path.dirname(cache_path)
+    # キャッシュのファイル名からファイルのハッシュ値の部分を除いたもの
+    cache_prefix = os.path.basename(cache_path).rsplit(".", 2)[0] + "."
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith(cache_prefix):
+            os.remove(os.path.join(cache_dir, file_name))
+    df.to_parquet(cache_path + ".tmp", compression="zstd")
+    os.replace(cache_path + ".tmp", cache_path)
@@ -0,0 +1,16 @@
+import multiprocessing
+
+
+def can_fork_workers() -> bool:
+    """
+    プロセスプールのワーカープロセスをforkで起動できるかを確認する
+
+    各章のスクリプトは処理を if __name__ == "__main__": で囲まずに最上位で実行しているため、
+    起動方式がspawnやforkserver（macOS、Windows、Python 3.14以降のLinuxの既定）の場合は、
+    ワーカープロセスがスクリプトを読み込み直して先頭から実行してしまう。
+    プロセスプールを使う関数は、Falseの場合はプロセスを起動せずに同じプロセス内で順に計算すること
+
+    Returns:
+        can_fork (bool): 起動方式がforkならTrue
+    """
+    return multiprocessing.get_start_method() == "fork"
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+
+def to_month_key(dates: pd.Series) -> pd.Series:
+    """
+    日付を1970年1月からの経過月数（int32の月キー）に変換する
+    dt.strftime("%Y-%m")で文字列を作るよりも高速で、集計・結合や前後の月の参照（キー ± 1）にそのまま使える
+
+    Args:
+        dates (pd.Series): datetime型の日付データ
+
+    Returns:
+        month_key (pd.Series): 月キー（欠損値がある場合は欠損値をpd.NAとするInt32型）
+    """
+    values = dates.to_numpy(dtype="datetime64[ns]")
+    month_key = values.astype("datetime64[M]").astype(np.int64)
+    is_null = np.isnat(values)
+    if is_null.any():
+        return pd.Series(
+            pd.arrays.IntegerArray(
+                np.where(is_null, 0, month_key).astype(np.int32), is_null
+            ),
+            index=dates.index,
+            name=dates.name,
+        )
+    return pd.Series(month_key.astype(np.int32), index=dates.index, name=dates.name)
+
+
+def month_key_to_str(month_key: pd.Series) -> pd.Series:
+    """
+    月キーを"%Y-%m"形式の文字列に変換する（表示用）
+    文字列への変換はユニークな月キーに対してのみ行う
+
+    Args:
+        month_key (pd.Series): to_month_keyで作成した月キー
+
+    Returns:
+        month (pd.Series): "%Y-%m"形式の文字列
+    """
+    unique_key = pd.unique(month_key.dropna())
+    labels = pd.Series(
+        pd.to_datetime(np.asarray(unique_key, dtype="datetime64[M]")).strftime("%Y-%m"),
+        index=unique_key,
+    )
+    return month_key.map(labels)
+
+
+def month_str_to_key(month: pd.Series) -> pd.Series:
+    """
+    "%Y-%m"形式の文字列（csvから読み込んだ年月データ等）を月キーに変換する
+    日付への変換はユニークな文字列に対してのみ行う
+
+    Args:
+        month (pd.Series): "%Y-%m"形式の文字列
+
+    Returns:
+        month_key (pd.Series): 月キー
+    """
+    unique_month = pd.unique(month.dropna())
+    keys = to_month_key(pd.Series(pd.to_datetime(unique_month, format="%Y-%m")))
+    return month.map(pd.Series(keys.to_numpy(), index=unique_month))
+
+
+def to_month_category(dates: pd.Series) -> pd.Series:
+    """
+    日付を"%Y-%m"形式の年月を表すカテゴリ型に変換する
+    カテゴリのコードは月キーから直接計算するため、行毎の文字列の作成やハッシュ計算が不要になる。
+    カテゴリはデータに含まれる年月のみで、時系列順に並ぶ
+
+    カテゴリ型の列でgroupbyやpivot_tableを行う場合は、observed=Trueを指定する
+    （指定しない場合、pandasのバージョンによっては存在しない組み合わせも集計結果に含まれる）
+
+    Args:
+        dates (pd.Series): datetime型の日付データ
+
+    Returns:
+        month (pd.Series): 年月のカテゴリ型データ（欠損値はNaN）
+    """
+    month_key = to_month_key(dates)
+    is_null = month_key.isna().to_numpy()
+    keys = month_key.to_numpy(dtype=np.int64, na_value=0)
+
+    if is_null.all():
+        return pd.Series(
+            pd.Categorical([None] * len(dates), categories=[], ordered=True),
+            index=dates.index,
+            name=dates.name,
+        )
+
+    # 最小の月からの経過月数をもとに、データに含まれる月のみのコードを振り直す
+    min_key = keys[~is_null].min()
+    offsets = keys - min_key
+    is_observed = np.bincount(offsets[~is_null]) > 0
+    new_codes = np.cumsum(is_observed) - 1
+    codes = np.where(is_null, -1, new_codes[np.where(is_null, 0, offsets)])
+
+    categories = month_key_to_str(
+        pd.Series(np.flatnonzero(is_observed) + min_key, dtype=np.int32)
+    )
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=categories, ordered=True),
+        index=dates.index,
+        name=dates.name,
+    )
+
+
+def add_months(dates: pd.Series, months) -> pd.Series:
+    """
+    日付にnヶ月を加算する（dates + relativedelta(months=n) と同じ結果になる）
+    加算後の月に同じ日が存在しない場合は、その月の末日にする（1月31日 + 1ヶ月 = 2月28日）。時刻は保持する
+
+    Args:
+        dates (pd.Series): datetime型の日付データ
+        months (int | np.ndarray | pd.Series): 加算する月数（負の値で減算）
+
+    Returns:
+        shifted_dates (pd.Series): nヶ月加算した日付データ（欠損値はNaT）
+    """
+    values = dates.to_numpy(dtype="datetime64[ns]")
+    month_start = values.astype("datetime64[M]")
+    day_start = values.astype("datetime64[D]")
+    # 月初からの日数と、日付からの経過時間
+    day_offset = day_start - month_start.astype("datetime64[D]")
+    time_offset = values - day_start
+
+    target_month = month_start + np.asarray(months, dtype=np.int64)
+    days_in_month = (target_month + 1).astype("datetime64[D]") - target_month.astype(
+        "datetime64[D]"
+    )
+    shifted = (
+        target_month.astype("datetime64[D]")
+        + np.minimum(day_offset, days_in_month - np.timedelta64(1, "D"))
+        + time_offset
+    )
+    return pd.Series(shifted, index=dates.index, name=dates.name)
+
+
+def months_between(end_dates: pd.Series, start_dates: pd.Series) -> pd.Series:
+    """
+    2つの日付の間の月数を計算する
+    relativedelta(end_date, start_date)のyears * 12 + monthsと同じ結果になる
+    （月末の日付や時刻を含め、start_dateにその月数を加算してもend_dateを超えない最大の月数）
+
+    Args:
+        end_dates (pd.Series): datetime型の終了日データ
+        start_dates (pd.Series): datetime型の開始日データ
+
+    Returns:
+        months (pd.Series): 月数（いずれかが欠損値の場合はpd.NAとするInt64型、欠損値がなければint64型）
+    """
+    end_values = pd.Series(end_dates).to_numpy(dtype="datetime64[ns]")
+    start_values = pd.Series(start_dates).to_numpy(dtype="datetime64[ns]")
+    is_null = np.isnat(end_values) | np.isnat(start_values)
+
+    # 年月のみで計算した月数
+    months = end_values.astype("datetime64[M]").astype(np.int64) - start_values.astype(
+        "datetime64[M]"
+    ).astype(np.int64)
+    months = np.where(is_null, 0, months)
+
+    # 開始日に月数を加算した日付が終了日を超える場合は1ヶ月戻す（終了日が開始日より前の場合は逆）
+    shifted = add_months(pd.Series(start_values), months).to_numpy()
+    is_forward = end_values >= start_values
+    months = (
+        months
+        - (is_forward & (end_values < shifted))
+        + (~is_forward & (end_values > shifted))
+    )
+
+    index = end_dates.index if isinstance(end_dates, pd.Series) else None
+    if is_null.any():
+        return pd.Series(pd.arrays.IntegerArray(months, is_null), index=index)
+    return pd.Series(months, index=index)